@@ -0,0 +1,211 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+# Per provider group, per worker process; LIMIT_<GROUP>_<SETTING> overrides each one.
+# Concurrency defaults to the adapter's max_concurrency (0 means no cap), and the
+# wait queue and token-bucket burst scale with it. Rate is upstream starts per
+# second (0: no token bucket).
+QUEUE_PER_SLOT = 4
+DEFAULT_QUEUE = 64  # uncapped groups
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_RETRY_AFTER = 5
+
+
+class Rejected(Exception):
+    """The provider's wait queue is full, or the wait timed out."""
+
+    def __init__(self, provider, reason, retry_after):
+        super().__init__(f"{provider} is busy ({reason}); retry in {retry_after}s")
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now=None):
+        """Seconds until a token is available (0 if one is available now)."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Limiter:
+    # State and bookkeeping shared by the thread and asyncio versions; callers hold the lock
+
+    def __init__(self, name, concurrency=0, rate=0, burst=1, queue=0, timeout=30, on_change=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.queue_size = queue
+        self.timeout = timeout
+        self.on_change = on_change
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "timeout": 0}
+
+    def _delay(self):
+        # None: no free slot; otherwise seconds until the token bucket allows a start
+        if self.concurrency and self.active >= self.concurrency:
+            return None
+        return self.bucket.delay() if self.bucket else 0.0
+
+    def _admit(self):
+        if self.bucket:
+            self.bucket.take()
+        self.active += 1
+        self.admitted += 1
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        if self.bucket:
+            retry_after = math.ceil((self.waiting + 1) / self.bucket.rate)
+        else:
+            retry_after = DEFAULT_RETRY_AFTER
+        return Rejected(self.name, reason, max(1, retry_after))
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change(self)
+
+    def snapshot(self):
+        return {
+            "concurrency": self.concurrency,
+            "rate": self.bucket.rate if self.bucket else 0,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+
+class Limiter(_Limiter):
+    """Concurrency semaphore + token bucket + bounded wait queue, for threads."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Wait for a slot and a token, or raise Rejected."""
+        with self._cond:
+            delay = self._delay()
+            if delay != 0:
+                if self.waiting >= self.queue_size:
+                    raise self._reject("queue_full")
+                self.waiting += 1
+                self._changed()
+                deadline = time.monotonic() + self.timeout
+                try:
+                    while delay != 0:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise self._reject("timeout")
+                        self._cond.wait(remaining if delay is None else min(remaining, delay))
+                        delay = self._delay()
+                finally:
+                    self.waiting -= 1
+                    self._changed()
+            self._admit()
+            self._changed()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._changed()
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class AsyncLimiter(_Limiter):
+    """Same limits for an event loop; waiting costs a coroutine, not a thread."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = None  # created on first use, inside the running loop
+
+    async def acquire(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            delay = self._delay()
+            if delay != 0:
+                if self.waiting >= self.queue_size:
+                    raise self._reject("queue_full")
+                self.waiting += 1
+                self._changed()
+                deadline = time.monotonic() + self.timeout
+                try:
+                    while delay != 0:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise self._reject("timeout")
+                        try:
+                            await asyncio.wait_for(self._cond.wait(), remaining if delay is None else min(remaining, delay))
+                        except asyncio.TimeoutError:
+                            pass
+                        delay = self._delay()
+                finally:
+                    self.waiting -= 1
+                    self._changed()
+            self._admit()
+            self._changed()
+
+    async def release(self):
+        async with self._cond:
+            self.active -= 1
+            self._changed()
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            await self.release()
+
+
+def settings(group, concurrency=0):
+    config = {
+        "concurrency": concurrency,
+        "rate": 0.0,
+        "burst": max(concurrency, 1),
+        "queue": concurrency * QUEUE_PER_SLOT if concurrency else DEFAULT_QUEUE,
+        "timeout": DEFAULT_TIMEOUT,
+    }
+    for name, default in config.items():
+        value = os.getenv(f"LIMIT_{group.upper()}_{name.upper()}")
+        if value:
+            config[name] = type(default)(float(value))
+    return config
+
+
+def limiters(groups, cls=Limiter, on_change=None):
+    """{group: limiter} for {group: max_concurrency}, with LIMIT_* overrides."""
+    return {group: cls(group, on_change=on_change, **settings(group, concurrency)) for group, concurrency in groups.items()}
@@ -1,9 +1,25 @@
 import os
-import requests
-from flask import Flask, render_template, request, send_file, jsonify
+from contextlib import ExitStack, contextmanager
+import time
+from concurrent.futures import ThreadPoolExecutor
+import upstream
+from flask import Flask, Response, g, redirect, render_template, request, send_file, jsonify
 from pydub import AudioSegment
 import io
+import resource
 from dotenv import load_dotenv
+from key_pool import KeyPool, SharedKeyState
+from jobs import JobStore, JobStoreFull
+from result_cache import ResultCache, cache_key
+from coalesce import Coalescer
+from admission import Limiter, Rejected, limiters
+from audio_format import sniff_format
+from transcode import prepend, stream_transcode, TranscodeError
+from metrics import Metrics, COUNT_BUCKETS
+from routing import Router
+from providers import (AssetRedirect, FakeAdapter, GenerationError, HuggingFaceAdapter, Registry,
+                       StabilityAdapter, StabilityPoolAdapter, UdioAdapter)
+import tracing
 
 load_dotenv()
 
@@ -15,158 +31,676 @@ UDIO_KEY = os.getenv("UDIO_AI")
 STABILITY_MASTER = os.getenv("STABILTY_AI") # The single key
 
 # Load the Pool (STABILITY_KEY_1 to STABILITY_KEY_100)
-STABILITY_POOL = []
+pool_keys = []
 for i in range(1, 101):
     k = os.getenv(f"STABILITY_KEY_{i}")
     if k:
-        STABILITY_POOL.append(k.strip())
+        pool_keys.append(k.strip())
+# Key health (cooldowns, failures, credits) lives in SQLite at KEY_POOL_DB, so all
+# workers share it and a restart doesn't rediscover dead keys; KEY_POOL_SHARED=0
+# keeps it per process
+KEY_POOL_SHARED = os.getenv("KEY_POOL_SHARED", "1") != "0"
+STABILITY_POOL = KeyPool(pool_keys, SharedKeyState(os.getenv("KEY_POOL_DB") or None) if KEY_POOL_SHARED else None)
 
 print(f"✅ Server Ready: Loaded {len(STABILITY_POOL)} pool keys.")
 
 # --- FIXED HUGGING FACE URLS ---
 HF_MODELS = {
-    "musicgen": "https://router.huggingface.co/models/facebook/musicgen-small",
-    "riffusion": "https://router.huggingface.co/models/riffusion/riffusion-model-v1",
+    "musicgen": f"{upstream.HF_API}/models/facebook/musicgen-small",
+    "riffusion": f"{upstream.HF_API}/models/riffusion/riffusion-model-v1",
 }
 
+# Background generation jobs, shared by all workers through JOB_DIR
+JOBS = JobStore(
+    os.getenv("JOB_DIR") or None,
+    max_jobs=int(os.getenv("JOB_MAX", "200")),
+    ttl=int(os.getenv("JOB_TTL", "3600")),
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+)
+
+# Finished tracks keyed by (model, prompt, format, provider params)
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") != "0"
+RESULT_CACHE = ResultCache(
+    os.getenv("CACHE_DIR") or None,
+    memory_bytes=int(os.getenv("CACHE_MEMORY_MB", "64")) * 1024 * 1024,
+    disk_bytes=int(os.getenv("CACHE_DISK_MB", "1024")) * 1024 * 1024,
+)
+
+# Identical generations in flight at once share one upstream call (not for "fresh" takes)
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1") != "0"
+COALESCER = Coalescer(
+    os.getenv("COALESCE_DIR") or None,
+    across_workers=os.getenv("COALESCE_ACROSS_WORKERS", "0") == "1",
+    stream_wait=upstream.READ_TIMEOUT,
+)
+
+# ==========================================
+# METRICS (Prometheus text format at /metrics, summed across workers)
+# ==========================================
+METRICS = Metrics(os.getenv("METRICS_DIR") or None)
+METRICS.counter("sonicforge_requests_total", "HTTP responses by endpoint and status code.")
+METRICS.histogram("sonicforge_upstream_seconds", "Time spent waiting on the provider, including pool retries.")
+METRICS.histogram("sonicforge_transcode_seconds", "Time spent converting provider audio to the requested format.")
+METRICS.counter("sonicforge_transcode_cpu_seconds_total", "CPU seconds (user + system) used by ffmpeg for transcodes.")
+METRICS.histogram("sonicforge_pool_attempts", "Stability pool keys tried per request.", COUNT_BUCKETS)
+METRICS.counter("sonicforge_upstream_bytes_total", "Audio bytes received from providers.")
+METRICS.counter("sonicforge_response_bytes_total", "Audio bytes sent to clients.")
+METRICS.counter("sonicforge_cache_lookups_total", "Result cache lookups by result.")
+METRICS.counter("sonicforge_output_path_total", "Results sent as-is (passthrough) or re-encoded (transcode).")
+METRICS.counter("sonicforge_coalesced_total", "Upstream generations saved by joining an identical in-flight request, by scope (process or worker).")
+METRICS.gauge("sonicforge_admission_in_flight", "Generations running against each provider.")
+METRICS.gauge("sonicforge_admission_queue_depth", "Generations waiting for a provider slot or rate-limit token.")
+METRICS.counter("sonicforge_admission_rejected_total", "Generations turned away with 503, by provider and reason (queue_full or timeout).")
+
+def cache_hit_ratio(totals):
+    hits = METRICS.total(totals, "sonicforge_cache_lookups_total", result="hit")
+    lookups = hits + METRICS.total(totals, "sonicforge_cache_lookups_total", result="miss")
+    return round(hits / lookups, 4) if lookups else 0
+
+METRICS.derived("sonicforge_cache_hit_ratio", "Result cache hits / (hits + misses) across all workers.", cache_hit_ratio)
+
+# ==========================================
+# PROVIDERS (model key -> adapter; see providers.py)
+# ==========================================
+# Hedging for the pool: if the first key hasn't answered within the pool's
+# recent STABILITY_HEDGE_PERCENTILE latency, the next healthy key is raced
+# against it. STABILITY_HEDGE_MAX_EXTRA caps the extra calls per request.
+HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("STABILITY_HEDGE_THREADS", "16")), thread_name_prefix="hedge")
+
+PROVIDERS = Registry()
+PROVIDERS.register("stable-audio-standard", StabilityAdapter(STABILITY_MASTER, "stable-audio-2"))
+PROVIDERS.register("stable-audio-infinite", StabilityPoolAdapter(
+    STABILITY_POOL, pool_keys, "stable-audio-2.5", metrics=METRICS,
+    hedge=os.getenv("STABILITY_HEDGE", "0") == "1",
+    hedge_percentile=float(os.getenv("STABILITY_HEDGE_PERCENTILE", "95")),
+    hedge_delay=float(os.getenv("STABILITY_HEDGE_DELAY", "20")),
+    hedge_max_extra=int(os.getenv("STABILITY_HEDGE_MAX_EXTRA", "1")),
+    executor=HEDGE_EXECUTOR,
+))
+PROVIDERS.register("udio", UdioAdapter(UDIO_KEY))
+for model_key, url in HF_MODELS.items():
+    PROVIDERS.register(model_key, HuggingFaceAdapter(url, HF_API_TOKEN))
+
+# Model "fake": silent audio generated in-process, for load-testing this server alone
+if os.getenv("FAKE_PROVIDER", "0") == "1":
+    PROVIDERS.register("fake", FakeAdapter(
+        latency=float(os.getenv("FAKE_PROVIDER_LATENCY", "0.5")),
+        seconds=float(os.getenv("FAKE_PROVIDER_SECONDS", "5")),
+        stream_seconds=float(os.getenv("FAKE_PROVIDER_STREAM_SECONDS", "0")),
+    ))
+
+# ==========================================
+# AUTO ROUTING (model "auto": best provider by recent success rate and latency)
+# ==========================================
+AUTO_MODEL = "auto"
+AUTO_MODELS = [m.strip() for m in os.getenv("AUTO_MODELS", "stable-audio-infinite,stable-audio-standard,udio,musicgen,riffusion").split(",") if m.strip()]
+AUTO_DEADLINE = float(os.getenv("AUTO_DEADLINE", "120"))  # seconds to find a provider that delivers
+ROUTER = Router(
+    window=int(os.getenv("AUTO_WINDOW", "50")),
+    horizon=float(os.getenv("AUTO_HORIZON", "300")),
+    explore=float(os.getenv("AUTO_EXPLORE", "0.05")),
+)
+
+def auto_models():
+    return [m for m in AUTO_MODELS if m in PROVIDERS and PROVIDERS[m].configured]
+
+def can_fail_over(e):
+    # Provider trouble (5xx, rate limits, busy); a bad request would fail the same everywhere
+    return e.status >= 500 or e.status == 429
+
+def routed_error(e, route):
+    e.headers["X-Route"] = route.header()
+    tracing.current().set(route=route.header())
+    return e
+
+def run_routed(attempt):
+    # attempt(model_key) returns a tuple ending in an info dict with "cache";
+    # models are tried best first until one delivers or AUTO_DEADLINE runs out
+    route = ROUTER.route(auto_models(), AUTO_DEADLINE)
+    error = GenerationError("No provider is available right now, please try again shortly.", 503, {"Retry-After": "5"})
+    for model_key in route:
+        started = time.time()
+        try:
+            result = attempt(model_key)
+        except GenerationError as e:
+            route.failed(model_key, e.status, time.time() - started)
+            if not can_fail_over(e):
+                raise routed_error(e, route)
+            print(f"⚠️ [Auto] {model_key} failed ({e.status}), failing over")
+            error = e
+            continue
+        info = result[-1]
+        route.succeeded(model_key, time.time() - started, cached=info["cache"] == "hit")
+        info.update(model=model_key, route=route.header())
+        tracing.current().set(routed=model_key, route=route.header())
+        return result
+    raise routed_error(error, route)
+
+def route_headers(resp, info):
+    if "route" in info:
+        resp.headers["X-Model"] = info["model"]
+        resp.headers["X-Route"] = info["route"]
+    return resp
+
+# ==========================================
+# ADMISSION CONTROL (per provider group, per worker; see admission.py for LIMIT_* settings)
+# ==========================================
+def publish_admission(limiter):
+    METRICS.set("sonicforge_admission_in_flight", limiter.active, provider=limiter.name)
+    METRICS.set("sonicforge_admission_queue_depth", limiter.waiting, provider=limiter.name)
+
+LIMITS = limiters(PROVIDERS.groups(), Limiter, on_change=publish_admission)
+
+def provider_for(model_key):
+    adapter = PROVIDERS.get(model_key)
+    return adapter.group if adapter else None
+
+def rejection_error(e):
+    METRICS.inc("sonicforge_admission_rejected_total", provider=e.provider, reason=e.reason)
+    tracing.current().set(rejected=e.reason)
+    return GenerationError(f"{e.provider} is busy right now, please try again shortly.", 503, {"Retry-After": str(e.retry_after)})
+
+@contextmanager
+def admitted(model_key):
+    # Hold a provider slot for the whole upstream call (pool retries included)
+    provider = provider_for(model_key)
+    if provider is None:
+        yield
+        return
+    try:
+        with tracing.span("admission", provider=provider):
+            LIMITS[provider].acquire()
+    except Rejected as e:
+        raise rejection_error(e)
+    try:
+        yield
+    finally:
+        LIMITS[provider].release()
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/generate', methods=['POST'])
-def generate_music():
-    data = request.json
-    prompt = data.get('prompt')
-    model_key = data.get('model')
-    output_format = data.get('format', 'mp3')
+@app.route('/pool')
+def pool_status():
+    if request.args.get('refresh'):
+        PROVIDERS["stable-audio-infinite"].refresh_credits()
+    return jsonify(STABILITY_POOL.snapshot())
 
-    if not prompt: return jsonify({"error": "Please enter a prompt."}), 400
+@app.route('/providers')
+def providers():
+    return jsonify(PROVIDERS.describe())
 
-    audio_bytes = None
+def stats_snapshot():
+    totals = METRICS.collect()
+    output = {path: METRICS.total(totals, "sonicforge_output_path_total", path=path) for path in ("passthrough", "transcode")}
+    coalesced = {scope: METRICS.total(totals, "sonicforge_coalesced_total", scope=scope) for scope in ("process", "worker")}
+    admission = {}
+    for provider in LIMITS:
+        labels = (("provider", provider),)
+        admission[provider] = {
+            "in_flight": totals["gauges"].get(("sonicforge_admission_in_flight", labels), 0),
+            "queued": totals["gauges"].get(("sonicforge_admission_queue_depth", labels), 0),
+            "rejected": METRICS.total(totals, "sonicforge_admission_rejected_total", provider=provider),
+        }
+    return {"cache": RESULT_CACHE.stats(), "output": output, "coalesced": coalesced, "admission": admission,
+            "routing": ROUTER.snapshot(auto_models())}
 
-    # ==========================================
-    # 1. STABLE AUDIO (SINGLE MASTER KEY)
-    # ==========================================
-    if model_key == "stable-audio-standard":
-        if not STABILITY_MASTER:
-            return jsonify({"error": "Master Key (STABILTY_AI) is missing."}), 500
-        
-        try:
-            api_url = "https://api.stability.ai/v2beta/audio/stable-audio-2/text-to-audio"
-            headers = {"Authorization": f"Bearer {STABILITY_MASTER}", "Accept": "audio/*"}
-            
-            # Using valid model name 'stable-audio-2'
-            body = {
-                "prompt": prompt, 
-                "model": "stable-audio-2", 
-                "output_format": output_format
-            }
-            files = {"none": ""} 
-
-            response = requests.post(api_url, headers=headers, data=body, files=files)
-            
-            if response.status_code == 200:
-                audio_bytes = response.content
-            else:
-                return jsonify({"error": f"Stability Error: {response.text}"}), response.status_code
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+@app.route('/stats')
+def stats():
+    return jsonify(stats_snapshot())
 
-    # ==========================================
-    # 2. STABLE AUDIO (INFINITE POOL CYCLE)
-    # ==========================================
-    elif model_key == "stable-audio-infinite":
-        if not STABILITY_POOL:
-            return jsonify({"error": "No pool keys (STABILITY_KEY_1...) found."}), 500
-        
-        success = False
-        last_err = ""
-
-        # Loop through keys until one works
-        for index, api_key in enumerate(STABILITY_POOL):
-            print(f"🔄 [Pool] Trying Key #{index+1}...")
-            try:
-                api_url = "https://api.stability.ai/v2beta/audio/stable-audio-2.5/text-to-audio"
-                headers = {"Authorization": f"Bearer {api_key}", "Accept": "audio/*"}
-                
-                body = {
-                    "prompt": prompt, 
-                    "model": "stable-audio-2.5", 
-                    "output_format": output_format
-                }
-                files = {"none": ""} 
-
-                response = requests.post(api_url, headers=headers, data=body, files=files)
-                
-                if response.status_code == 200:
-                    print(f"✅ Success on Key #{index+1}")
-                    audio_bytes = response.content
-                    success = True
-                    break
-                else:
-                    print(f"❌ Key #{index+1} Failed: {response.status_code}")
-                    last_err = response.text
-            except Exception as e:
-                print(f"⚠️ Key #{index+1} Error: {e}")
-                last_err = str(e)
-                continue
-        
-        if not success:
-            return jsonify({"error": f"All {len(STABILITY_POOL)} keys failed. Last: {last_err}"}), 500
+@app.route('/metrics')
+def metrics():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+@app.after_request
+def count_response(resp):
+    METRICS.inc("sonicforge_requests_total", endpoint=request.endpoint or "unknown", status=resp.status_code)
+    return resp
+
+@app.after_request
+def attach_trace(resp):
+    # Timings so far go out as Server-Timing; the JSON log line is written once
+    # the body has been sent, so it also covers streamed transcodes and "send"
+    trace = g.pop("trace", None)
+    if trace is None:
+        return resp
+    tracing.stop()
+    resp.headers["Server-Timing"] = trace.server_timing()
+    resp.headers["X-Request-ID"] = trace.request_id
+    trace.mark_response()
+    status = resp.status_code
+    if resp.direct_passthrough:
+        # send_file hands its file wrapper straight to the server and skips close callbacks
+        trace.finish(status=status)
+    else:
+        resp.call_on_close(lambda: trace.finish(status=status))
+    return resp
+
+def error_response(e):
+    resp = jsonify({"error": e.message})
+    resp.headers.update(e.headers)
+    return resp, e.status
+
+# How Udio's audio_url (any adapter with assets) is handled outside /jobs:
+# "proxy" streams it through this server chunk by chunk, "buffer" downloads it
+# whole first, "redirect" sends the client straight to the file when it is
+# already in the requested format (the result is then not cached). Identical
+# requests in flight share one generation in every mode.
+UDIO_ASSET_MODE = os.getenv("UDIO_ASSET_MODE", "proxy")
+
+def generate_audio(prompt, model_key, output_format, stream=False, redirect=False):
+    # Returns (raw upstream audio bytes, upstream Content-Type) or raises GenerationError.
+    # With stream=True the audio comes back as a chunk iterator, read as it arrives
+    # when the adapter can stream. With redirect=True an adapter serving files by
+    # URL may return an AssetRedirect instead.
+    adapter = PROVIDERS[model_key]
+    audio, content_type = adapter.generate(prompt, output_format, stream=stream and adapter.streaming, redirect=redirect)
+    if not stream or isinstance(audio, AssetRedirect):
+        return audio, content_type
+    if isinstance(audio, bytes):
+        # Adapter without streaming: the whole body is the one and only chunk
+        audio = (chunk for chunk in (audio,))
+    return upstream_chunks(audio, model_key), content_type
+
+def mimetype_for(output_format):
+    return "audio/mp4" if output_format == "m4a" else f"audio/{output_format}"
+
+# Pipe transcodes through ffmpeg chunk by chunk instead of decoding to PCM with pydub
+STREAM_TRANSCODE = os.getenv("STREAM_TRANSCODE", "1") != "0"
 
+def cpu_recorder(output_format, trace):
+    # on_cpu callback for stream_transcode
+    def on_cpu(seconds):
+        METRICS.inc("sonicforge_transcode_cpu_seconds_total", seconds, format=output_format)
+        trace.set(transcode_cpu_ms=round(seconds * 1000, 2))
+    return on_cpu
+
+def convert_audio(audio_bytes, output_format, content_type=None):
     # ==========================================
-    # 3. UDIO AI
+    # OUTPUT PROCESSING
     # ==========================================
-    elif model_key == "udio":
-        if not UDIO_KEY: return jsonify({"error": "Udio Key missing"}), 500
+    # Already in the requested format: no decode, no re-encode
+    if sniff_format(audio_bytes, content_type) == output_format:
+        METRICS.inc("sonicforge_output_path_total", path="passthrough")
+        tracing.current().set(output_path="passthrough")
+        return audio_bytes
+
+    METRICS.inc("sonicforge_output_path_total", path="transcode")
+    trace = tracing.current()
+    trace.set(output_path="transcode")
+    if STREAM_TRANSCODE:
         try:
-            api_url = "https://api.udio.com/v1/generate" 
-            headers = {"Authorization": f"Bearer {UDIO_KEY}", "Content-Type": "application/json"}
-            payload = {"prompt": prompt, "is_instrumental": False, "format": output_format}
-            
-            response = requests.post(api_url, headers=headers, json=payload)
-            if response.status_code == 200:
-                ct = response.headers.get("Content-Type", "")
-                if "application/json" in ct:
-                    audio_bytes = requests.get(response.json()['audio_url']).content
-                else:
-                    audio_bytes = response.content
+            # Only ffmpeg start-up and the first chunk; the rest is timed as "transcode" while streaming
+            with trace.span("transcode_start"):
+                return stream_transcode(audio_bytes, output_format, on_cpu=cpu_recorder(output_format, trace))
+        except TranscodeError as e:
+            raise GenerationError(f"Processing Error: {str(e)}", 500)
+
+    # pydub runs ffprobe/ffmpeg itself, so charge whatever child CPU this
+    # process accrued meanwhile (exact for one request per process)
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        with trace.span("decode"):
+            seg = AudioSegment.from_file(io.BytesIO(audio_bytes))
+        with trace.span("encode") as span:
+            buf = io.BytesIO()
+            seg.export(buf, format=output_format)
+            span["bytes"] = buf.tell()
+        return buf.getvalue()
+    except Exception as e:
+        raise GenerationError(f"Processing Error: {str(e)}", 500)
+    finally:
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        METRICS.inc("sonicforge_transcode_cpu_seconds_total",
+                    (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime), format=output_format)
+
+def provider_params(model_key):
+    # Everything besides the prompt and format that changes what the provider returns
+    adapter = PROVIDERS.get(model_key)
+    return adapter.params if adapter else None
+
+def cache_lookup(prompt, model_key, output_format, fresh=False):
+    # Returns (cache key, cached audio or None, cache status)
+    params = provider_params(model_key)
+    if params is None: raise GenerationError("Invalid Model Selection", 400)
+
+    key = cache_key(model_key, prompt, output_format, params)
+    if not CACHE_ENABLED:
+        return key, None, "off"
+    if fresh:
+        RESULT_CACHE.record_bypass()
+        METRICS.inc("sonicforge_cache_lookups_total", result="bypass")
+        return key, None, "bypass"
+
+    with tracing.span("cache_lookup") as span:
+        audio = RESULT_CACHE.get(key)
+        span["hit"] = audio is not None
+    METRICS.inc("sonicforge_cache_lookups_total", result="hit" if audio is not None else "miss")
+    return key, audio, "hit" if audio is not None else "miss"
+
+def process_output(key, model_key, audio_bytes, content_type, output_format):
+    # Converts the upstream audio and arranges for the result to be cached
+    METRICS.inc("sonicforge_upstream_bytes_total", len(audio_bytes), provider=model_key)
+
+    trace = tracing.current()
+    started = time.time()
+    audio = convert_audio(audio_bytes, output_format, content_type)
+    if isinstance(audio, bytes):
+        if audio is not audio_bytes:
+            METRICS.observe("sonicforge_transcode_seconds", time.time() - started, provider=model_key)
+    else:
+        audio = timed_transcode(audio, started, model_key, trace)
+    if CACHE_ENABLED:
+        if isinstance(audio, bytes):
+            with trace.span("cache_store", bytes=len(audio)):
+                RESULT_CACHE.put(key, audio)
+        else:
+            audio = tee_to_cache(audio, key)
+    return audio
+
+def admitted_generate(prompt, model_key, output_format):
+    # Only the caller that actually goes upstream takes a provider slot
+    with admitted(model_key):
+        return generate_audio(prompt, model_key, output_format)
+
+def count_coalesced(role):
+    if role != "leader":
+        METRICS.inc("sonicforge_coalesced_total", scope=role)
+
+def run_generation(prompt, model_key, output_format, fresh=False, redirect=False):
+    if model_key == AUTO_MODEL:
+        return run_routed(lambda m: run_generation(prompt, m, output_format, fresh, redirect))
+
+    key, audio, cache_status = cache_lookup(prompt, model_key, output_format, fresh)
+    if audio is not None:
+        return audio, mimetype_for(output_format), {"cache": cache_status}
+
+    if PROVIDERS[model_key].assets and UDIO_ASSET_MODE != "buffer":
+        # The provider's file goes out as it downloads instead of being held whole
+        audio = coalesced_stream(key, prompt, model_key, output_format, fresh, redirect and UDIO_ASSET_MODE == "redirect")
+        return audio, mimetype_for(output_format), {"cache": cache_status}
+
+    started = time.time()
+    try:
+        with tracing.span("upstream", provider=model_key) as span:
+            if COALESCE_ENABLED and not fresh:
+                (audio_bytes, content_type), role = COALESCER.run(key, lambda: admitted_generate(prompt, model_key, output_format))
+                count_coalesced(role)
+                span["role"] = role
             else:
-                return jsonify({"error": response.text}), 500
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+                audio_bytes, content_type = admitted_generate(prompt, model_key, output_format)
+            span["bytes"] = len(audio_bytes)
+    finally:
+        METRICS.observe("sonicforge_upstream_seconds", time.time() - started, provider=model_key)
 
-    # ==========================================
-    # 4 & 5. HUGGINGFACE (MusicGen / Riffusion)
-    # ==========================================
-    elif model_key in HF_MODELS:
+    audio = process_output(key, model_key, audio_bytes, content_type, output_format)
+    return audio, mimetype_for(output_format), {"cache": cache_status}
+
+def timed_transcode(chunks, started, model_key, trace=tracing.NULL_TRACE):
+    # A streamed transcode is only done once ffmpeg's last chunk has gone out
+    try:
+        yield from chunks
+    finally:
+        chunks.close()
+    METRICS.observe("sonicforge_transcode_seconds", time.time() - started, provider=model_key)
+    trace.add("transcode", time.time() - started)
+
+def count_bytes_out(chunks, trace=tracing.NULL_TRACE):
+    try:
+        for chunk in chunks:
+            METRICS.inc("sonicforge_response_bytes_total", len(chunk))
+            trace.incr("bytes_out", len(chunk))
+            yield chunk
+    finally:
+        chunks.close()
+
+def tee_to_cache(chunks, key):
+    # Cache a streamed result as it goes out; only a complete stream is kept
+    writer = RESULT_CACHE.writer(key)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+            yield chunk
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        chunks.close()
+    writer.commit()
+
+def audio_response(audio, mimetype, output_format):
+    # Bytes go out with send_file; a chunk iterator is streamed as it is produced
+    if isinstance(audio, bytes):
+        METRICS.inc("sonicforge_response_bytes_total", len(audio))
+        tracing.current().set(bytes_out=len(audio))
+        return send_file(io.BytesIO(audio), mimetype=mimetype, as_attachment=True, download_name=f"generated.{output_format}")
+    return Response(count_bytes_out(audio, tracing.current()), mimetype=mimetype, headers={"Content-Disposition": f"attachment; filename=generated.{output_format}"})
+
+def parse_generation_request():
+    return parse_generation_body(request.get_json(silent=True) or {})
+
+def parse_generation_body(data):
+    prompt = data.get('prompt')
+    model_key = data.get('model')
+    output_format = data.get('format', 'mp3')
+    fresh = bool(data.get('fresh'))  # skip the result cache and generate a new take
+
+    if not prompt: raise GenerationError("Please enter a prompt.", 400)
+    return prompt, model_key, output_format, fresh
+
+@app.route('/generate', methods=['POST'])
+def generate_music():
+    trace = g.trace = tracing.start("generate", request.headers.get("X-Request-ID"))
+    try:
+        prompt, model_key, output_format, fresh = parse_generation_request()
+        if trace:
+            trace.set(model=model_key, format=output_format)
+        audio, mimetype, info = run_generation(prompt, model_key, output_format, fresh, redirect=True)
+        if trace:
+            trace.set(cache=info["cache"])
+    except GenerationError as e:
+        if trace:
+            trace.set(error=e.message[:200])
+        return error_response(e)
+
+    if isinstance(audio, AssetRedirect):
+        resp = redirect(audio.url)
+    else:
+        resp = audio_response(audio, mimetype, output_format)
+    resp.headers["X-Cache"] = info["cache"].upper()
+    return route_headers(resp, info)
+
+# ==========================================
+# PROGRESSIVE STREAMING (GET /stream, usable directly as an <audio> src)
+# ==========================================
+# The provider's body is read with stream=True and forwarded as it arrives,
+# passed through or piped into ffmpeg chunk by chunk, so the browser can start
+# playing with the first bytes instead of after generation + download + transcode.
+def upstream_chunks(chunks, model_key):
+    try:
+        for chunk in chunks:
+            METRICS.inc("sonicforge_upstream_bytes_total", len(chunk), provider=model_key)
+            yield chunk
+    finally:
+        chunks.close()
+
+def stream_output(first, rest, content_type, output_format, model_key):
+    # convert_audio for a stream: decided on the first chunk, never buffered whole
+    trace = tracing.current()
+    source = prepend(first, rest)
+    if sniff_format(first, content_type) == output_format:
+        METRICS.inc("sonicforge_output_path_total", path="passthrough")
+        trace.set(output_path="passthrough")
+        return source
+
+    METRICS.inc("sonicforge_output_path_total", path="transcode")
+    trace.set(output_path="transcode")
+    started = time.time()
+    try:
+        with trace.span("transcode_start"):
+            chunks = stream_transcode(source, output_format, on_cpu=cpu_recorder(output_format, trace), low_latency=True)
+    except TranscodeError as e:
+        source.close()
+        raise GenerationError(f"Processing Error: {str(e)}", 500)
+    return timed_transcode(chunks, started, model_key, trace)
+
+def released(chunks, stack):
+    # Keep the provider slot and upstream connection until the last chunk has gone out
+    with stack:
         try:
-            response = requests.post(HF_MODELS[model_key], headers={"Authorization": f"Bearer {HF_API_TOKEN}"}, json={"inputs": prompt})
-            if response.status_code == 200:
-                audio_bytes = response.content
-            else:
-                return jsonify({"error": f"HF Error: {response.text}"}), 503
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            yield from chunks
+        finally:
+            chunks.close()
+
+def close_source(chunks):
+    try:
+        chunks.close()
+    except ValueError:
+        pass  # still being read by a transcode's feeder thread, which closes it when done
+
+def stream_generation(key, prompt, model_key, output_format, redirect=False):
+    stack = ExitStack()
+    try:
+        stack.enter_context(admitted(model_key))
+        started = time.time()
+        with tracing.span("first_byte", provider=model_key):
+            rest, content_type = generate_audio(prompt, model_key, output_format, stream=True, redirect=redirect)
+            if isinstance(rest, AssetRedirect):
+                stack.close()
+                METRICS.inc("sonicforge_output_path_total", path="redirect")
+                tracing.current().set(output_path="redirect")
+                return rest
+            stack.callback(close_source, rest)
+            first = next(rest, b"")
+        METRICS.observe("sonicforge_upstream_seconds", time.time() - started, provider=model_key)
+        if not first: raise GenerationError("No data received", 500)
+
+        audio = stream_output(first, rest, content_type, output_format, model_key)
+        if CACHE_ENABLED:
+            audio = tee_to_cache(audio, key)
+    except BaseException:
+        stack.close()
+        raise
+    return released(audio, stack)
+
+def coalesced_stream(key, prompt, model_key, output_format, fresh=False, redirect=False):
+    # Identical streams in flight read one upstream generation (not for "fresh" takes)
+    if not COALESCE_ENABLED or fresh:
+        return stream_generation(key, prompt, model_key, output_format, redirect)
+
+    def lead():
+        # A flight that finished since our cache lookup has already cached its output
+        if CACHE_ENABLED and RESULT_CACHE.contains(key):
+            audio = RESULT_CACHE.get(key)
+            if audio is not None:
+                return audio
+        return stream_generation(key, prompt, model_key, output_format, redirect)
+
+    audio, role = COALESCER.stream(key, lead)
+    count_coalesced(role)
+    return audio
 
+def cached_audio(prompt, model_key, output_format, probe=False):
+    # A finished result from the cache, never a generation (GET /stream?cached=1).
+    # For "auto" any of its models will do; probe=True only checks it is there.
+    models = auto_models() if model_key == AUTO_MODEL else [model_key]
+    for m in models:
+        params = provider_params(m)
+        if params is None: raise GenerationError("Invalid Model Selection", 400)
+        if not CACHE_ENABLED:
+            break
+        key = cache_key(m, prompt, output_format, params)
+        audio = RESULT_CACHE.contains(key) if probe else RESULT_CACHE.get(key)
+        if audio:
+            return audio
+    raise GenerationError("This track isn't ready yet.", 404)
+
+@app.route('/stream')
+def stream_music():
+    trace = g.trace = tracing.start("stream", request.headers.get("X-Request-ID"))
+    try:
+        args = request.args.to_dict()
+        args["fresh"] = args.get("fresh") in ("1", "true")
+        prompt, model_key, output_format, fresh = parse_generation_body(args)
+        if trace:
+            trace.set(model=model_key, format=output_format)
+        if args.get("cached") in ("1", "true"):
+            # The page's download link: only a finished, cached stream
+            audio = cached_audio(prompt, model_key, output_format, probe=request.method == "HEAD")
+            if request.method == "HEAD":
+                return Response(mimetype=mimetype_for(output_format))
+            return audio_response(audio, mimetype_for(output_format), output_format)
+        if request.method == "HEAD":
+            # The server never iterates a HEAD body, so the slot would never be given back
+            return Response(mimetype=mimetype_for(output_format))
+
+        def attempt(model_key):
+            key, audio, cache_status = cache_lookup(prompt, model_key, output_format, fresh)
+            if audio is None:
+                audio = coalesced_stream(key, prompt, model_key, output_format, fresh, redirect=UDIO_ASSET_MODE == "redirect")
+            return audio, {"cache": cache_status}
+
+        # Auto routing can only fail over until the first byte is out
+        audio, info = run_routed(attempt) if model_key == AUTO_MODEL else attempt(model_key)
+        if trace:
+            trace.set(cache=info["cache"])
+    except GenerationError as e:
+        if trace:
+            trace.set(error=e.message[:200])
+        return error_response(e)
+
+    mimetype = mimetype_for(output_format)
+    if isinstance(audio, AssetRedirect):
+        resp = redirect(audio.url)
+    elif isinstance(audio, bytes):
+        resp = audio_response(audio, mimetype, output_format)
     else:
-        return jsonify({"error": "Invalid Model Selection"}), 400
+        resp = Response(count_bytes_out(audio, tracing.current()), mimetype=mimetype)
+        resp.headers["Cache-Control"] = "no-store"
+        resp.headers["X-Accel-Buffering"] = "no"  # don't let nginx sit on the first chunks
+    resp.headers["X-Cache"] = info["cache"].upper()
+    return route_headers(resp, info)
 
-    # ==========================================
-    # OUTPUT PROCESSING
-    # ==========================================
+# ==========================================
+# ASYNC JOBS (POST /jobs, then poll GET /jobs/<id>)
+# ==========================================
+@app.route('/jobs', methods=['POST'])
+def create_job():
     try:
-        if not audio_bytes: return jsonify({"error": "No data received"}), 500
-        
-        seg = AudioSegment.from_file(io.BytesIO(audio_bytes))
-        buf = io.BytesIO()
-        seg.export(buf, format=output_format)
-        buf.seek(0)
-        
-        m = "audio/mp4" if output_format == "m4a" else f"audio/{output_format}"
-        return send_file(buf, mimetype=m, as_attachment=True, download_name=f"generated.{output_format}")
-    except Exception as e:
-        return jsonify({"error": f"Processing Error: {str(e)}"}), 500
+        prompt, model_key, output_format, fresh = parse_generation_request()
+        job_id = JOBS.submit(run_generation, (prompt, model_key, output_format, fresh), {"model": model_key, "format": output_format})
+    except GenerationError as e:
+        return error_response(e)
+    except JobStoreFull as e:
+        resp = jsonify({"error": str(e)})
+        resp.headers["Retry-After"] = "5"
+        return resp, 503
+
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "audio_url": f"/jobs/{job_id}/audio",
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = JOBS.get(job_id)
+    if not job: return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/audio')
+def job_audio(job_id):
+    job = JOBS.get(job_id)
+    if not job: return jsonify({"error": "Job not found or expired"}), 404
+    if job["status"] == "error": return jsonify({"error": job["error"]}), job["code"]
+    if job["status"] != "done": return jsonify({"error": "Job is not finished yet", "status": job["status"]}), 409
+
+    output_format = job["format"]
+    METRICS.inc("sonicforge_response_bytes_total", job["size"])
+    return send_file(JOBS.audio_path(job_id), mimetype=job["mimetype"], as_attachment=True, download_name=f"generated.{output_format}")
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,188 @@
+"""Async serving mode: the same /generate contract on an asyncio stack.
+
+Provider calls go through a shared httpx.AsyncClient, so a worker can hold
+thousands of in-flight generations instead of one per thread. Blocking work
+(cache disk I/O, ffmpeg) runs in the default thread pool. Run it with:
+
+    uvicorn asgi_app:app --workers 2
+"""
+import asyncio
+import time
+
+from quart import Quart, Response, g, jsonify, render_template, request
+
+import tracing
+import upstream
+from admission import AsyncLimiter, Rejected, limiters
+import app as sync_app
+from app import METRICS, GenerationError, mimetype_for
+
+app = Quart(__name__)
+
+# Same LIMIT_* settings as the sync app, with waiters parked on the event loop
+LIMITS = limiters(sync_app.PROVIDERS.groups(), AsyncLimiter, on_change=sync_app.publish_admission)
+
+
+def error_response(e):
+    resp = jsonify({"error": e.message})
+    resp.headers.update(e.headers)
+    return resp, e.status
+
+
+async def generate_audio(prompt, model_key, output_format):
+    # Async twin of app.generate_audio: (raw audio bytes, Content-Type) or GenerationError
+    return await sync_app.PROVIDERS[model_key].agenerate(prompt, output_format)
+
+
+async def admitted_generate(prompt, model_key, output_format):
+    # Async twin of app.admitted_generate
+    limiter = LIMITS.get(sync_app.provider_for(model_key))
+    if limiter is None:
+        return await generate_audio(prompt, model_key, output_format)
+    try:
+        with tracing.span("admission", provider=limiter.name):
+            await limiter.acquire()
+    except Rejected as e:
+        raise sync_app.rejection_error(e)
+    try:
+        return await generate_audio(prompt, model_key, output_format)
+    finally:
+        await limiter.release()
+
+
+async def run_generation(prompt, model_key, output_format, fresh=False):
+    # Async twin of app.run_generation: (audio bytes or chunk iterator, info)
+    if model_key == sync_app.AUTO_MODEL:
+        return await run_routed(lambda m: run_generation(prompt, m, output_format, fresh))
+
+    key, audio, cache_status = await asyncio.to_thread(sync_app.cache_lookup, prompt, model_key, output_format, fresh)
+    if audio is not None:
+        return audio, {"cache": cache_status}
+    started = time.time()
+    try:
+        with tracing.span("upstream", provider=model_key) as span:
+            if sync_app.COALESCE_ENABLED and not fresh:
+                (audio_bytes, content_type), role = await sync_app.COALESCER.run_async(
+                    key, lambda: admitted_generate(prompt, model_key, output_format))
+                sync_app.count_coalesced(role)
+                span["role"] = role
+            else:
+                audio_bytes, content_type = await admitted_generate(prompt, model_key, output_format)
+            span["bytes"] = len(audio_bytes)
+    finally:
+        METRICS.observe("sonicforge_upstream_seconds", time.time() - started, provider=model_key)
+    audio = await asyncio.to_thread(sync_app.process_output, key, model_key, audio_bytes, content_type, output_format)
+    return audio, {"cache": cache_status}
+
+
+async def run_routed(attempt):
+    # Async twin of app.run_routed, sharing its Router statistics
+    route = sync_app.ROUTER.route(sync_app.auto_models(), sync_app.AUTO_DEADLINE)
+    error = GenerationError("No provider is available right now, please try again shortly.", 503, {"Retry-After": "5"})
+    for model_key in route:
+        started = time.time()
+        try:
+            result = await attempt(model_key)
+        except GenerationError as e:
+            route.failed(model_key, e.status, time.time() - started)
+            if not sync_app.can_fail_over(e):
+                raise sync_app.routed_error(e, route)
+            print(f"⚠️ [Auto] {model_key} failed ({e.status}), failing over")
+            error = e
+            continue
+        info = result[-1]
+        route.succeeded(model_key, time.time() - started, cached=info["cache"] == "hit")
+        info.update(model=model_key, route=route.header())
+        tracing.current().set(routed=model_key, route=route.header())
+        return result
+    raise sync_app.routed_error(error, route)
+
+
+async def iterate_in_thread(chunks, trace=None):
+    # Pull a blocking chunk iterator (ffmpeg's stdout) without stalling the loop
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        await asyncio.to_thread(chunks.close)
+        # Quart has no call_on_close: the trace ends with the last streamed chunk
+        if trace:
+            trace.finish(status=200)
+
+
+@app.route('/')
+async def index():
+    return await render_template('index.html')
+
+
+@app.route('/generate', methods=['POST'])
+async def generate_music():
+    # asyncio.to_thread copies the context, so spans from worker threads land in this trace
+    trace = g.trace = tracing.start("generate", request.headers.get("X-Request-ID"))
+    try:
+        prompt, model_key, output_format, fresh = sync_app.parse_generation_body(await request.get_json(silent=True) or {})
+        if trace:
+            trace.set(model=model_key, format=output_format)
+        audio, info = await run_generation(prompt, model_key, output_format, fresh)
+        if trace:
+            trace.set(cache=info["cache"])
+    except GenerationError as e:
+        if trace:
+            trace.set(error=e.message[:200])
+        return error_response(e)
+
+    headers = {
+        "Content-Disposition": f"attachment; filename=generated.{output_format}",
+        "X-Cache": info["cache"].upper(),
+    }
+    if "route" in info:
+        headers.update({"X-Model": info["model"], "X-Route": info["route"]})
+    if isinstance(audio, bytes):
+        METRICS.inc("sonicforge_response_bytes_total", len(audio))
+        tracing.current().set(bytes_out=len(audio))
+        return Response(audio, mimetype=mimetype_for(output_format), headers=headers)
+    g.trace_streaming = True
+    chunks = sync_app.count_bytes_out(audio, tracing.current())
+    return Response(iterate_in_thread(chunks, trace), mimetype=mimetype_for(output_format), headers=headers)
+
+
+@app.route('/stats')
+async def stats():
+    return jsonify(await asyncio.to_thread(sync_app.stats_snapshot))
+
+
+@app.route('/metrics')
+async def metrics():
+    return Response(await asyncio.to_thread(METRICS.render), mimetype="text/plain; version=0.0.4")
+
+
+@app.after_request
+async def count_response(resp):
+    METRICS.inc("sonicforge_requests_total", endpoint=request.endpoint or "unknown", status=resp.status_code)
+    return resp
+
+
+@app.after_request
+async def attach_trace(resp):
+    trace = g.pop("trace", None)
+    if trace is None:
+        return resp
+    tracing.stop()
+    resp.headers["Server-Timing"] = trace.server_timing()
+    resp.headers["X-Request-ID"] = trace.request_id
+    trace.mark_response()
+    if not g.get("trace_streaming"):
+        trace.finish(status=resp.status_code)
+    return resp
+
+
+@app.after_serving
+async def close_clients():
+    await upstream.close_async_client()
+
+
+if __name__ == '__main__':
+    app.run(debug=True)
@@ -0,0 +1,48 @@
+# Identify what an upstream provider actually sent, so audio that is already
+# in the requested format can skip the pydub/ffmpeg round trip.
+
+CONTENT_TYPES = {
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/wav": "wav",
+    "audio/wave": "wav",
+    "audio/x-wav": "wav",
+    "audio/vnd.wave": "wav",
+    "audio/ogg": "ogg",
+    "audio/flac": "flac",
+    "audio/x-flac": "flac",
+    "audio/mp4": "m4a",
+    "audio/x-m4a": "m4a",
+    "audio/aac": "aac",
+    "audio/webm": "webm",
+}
+
+
+def sniff_bytes(data):
+    head = data[:12]
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:3] == b"ID3":
+        return "mp3"
+    if head[:4] == b"OggS":
+        return "ogg"
+    if head[:4] == b"fLaC":
+        return "flac"
+    if head[4:8] == b"ftyp":
+        return "m4a"
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        # MPEG frame sync: layer bits 00 mean ADTS AAC, anything else is MP3
+        return "aac" if head[1] & 0x06 == 0 else "mp3"
+    return None
+
+
+def sniff_format(data, content_type=None):
+    """Best guess at the container of `data`; magic numbers win over headers."""
+    fmt = sniff_bytes(data)
+    if fmt:
+        return fmt
+    if content_type:
+        return CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+    return None
@@ -0,0 +1,163 @@
+"""Generate many mods from one manifest.
+
+The manifest is JSON (a list of objects) or CSV with a header row. Columns:
+
+    mod_id, mod_name, description, package   (mod generator)
+    mod_id, mod_name, description, author    (fabric generator)
+    mc_version, version, template_set        (optional)
+
+    python batch_generate.py mods.csv --output dist --workers 4
+    python batch_generate.py mods.json --generator fabric
+
+The template (or, for the fabric generator, the Gradle wrapper) is acquired
+once up front; every mod is then built in a worker
+process and written to <output>/<mod_id>.zip. A summary with per-mod timings
+and errors goes to <output>/summary.json.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import fabric_generator
+import gradle_cache
+import mod_generator
+import template_cache
+import template_registry
+
+REQUIRED = {
+    "mod": ("mod_id", "mod_name", "description", "package"),
+    "fabric": ("mod_id", "mod_name", "description"),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a batch of mods from a JSON or CSV manifest")
+    parser.add_argument("manifest", help="Path to a .json or .csv manifest")
+    parser.add_argument("--generator", choices=sorted(REQUIRED), default="mod",
+                        help="mod: fabric-example-mod template (mod_generator.py); fabric: built-in files (fabric_generator.py)")
+    parser.add_argument("--output", default=".", help="Directory for the archives and summary.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--template-url", default=template_cache.TEMPLATE_URL)
+    parser.add_argument("--template-ref", default=template_cache.DEFAULT_BRANCH)
+    parser.add_argument("--cache-dir", default=template_cache.CACHE_DIR)
+    parser.add_argument("--gradle", help="Gradle wrapper version (fabric generator; default: each template set's)")
+    parser.add_argument("--offline", action="store_true", help="Only use cached templates and Gradle wrappers")
+    return parser.parse_args()
+
+
+def load_manifest(path):
+    if path.lower().endswith(".csv"):
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(path) as f:
+            rows = json.load(f)
+        if isinstance(rows, dict):
+            rows = rows.get("mods", [])
+    # Accept the CLI's spellings too (--name/--id/--desc/--mc)
+    aliases = {"name": "mod_name", "id": "mod_id", "desc": "description", "mc": "mc_version", "package_name": "package"}
+    return [{aliases.get(k.strip(), k.strip()): (v.strip() if isinstance(v, str) else v)
+             for k, v in row.items() if v not in (None, "")} for row in rows]
+
+
+def build_one(kind, row, output_dir, snapshot, gradle_version=None):
+    """Worker: build one mod archive. Returns a summary record, never raises."""
+    started = time.time()
+    record = {"mod_id": row.get("mod_id"), "status": "ok"}
+    try:
+        missing = [field for field in REQUIRED[kind] if not row.get(field)]
+        if missing:
+            raise ValueError(f"missing {', '.join(missing)}")
+        if not mod_generator.MOD_ID_RE.match(row["mod_id"]):
+            raise ValueError(f"invalid mod_id {row['mod_id']!r} (lowercase letters, digits, _ and -, starting with a letter)")
+
+        archive = os.path.join(output_dir, f"{row['mod_id']}.zip")
+        mc_version = row.get("mc_version", mod_generator.DEFAULT_MC_VERSION)
+        if kind == "mod":
+            mod_generator.build_archive(snapshot, archive, row["mod_id"], row["mod_name"], row["description"],
+                                        row["package"], mc_version=mc_version)
+        else:
+            fabric_generator.build_archive(archive, row["mod_name"], row["mod_id"], row.get("version", "1.0.0"),
+                                           row.get("author", "User"), row["description"], mc_version,
+                                           gradle_version=gradle_version, offline=True,
+                                           template_set=row.get("template_set"))
+        record["archive"] = archive
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = f"{type(e).__name__}: {e}"
+        record["traceback"] = traceback.format_exc()
+    record["seconds"] = round(time.time() - started, 3)
+    return record
+
+
+def main():
+    args = parse_args()
+    rows = load_manifest(args.manifest)
+    os.makedirs(args.output, exist_ok=True)
+    started = time.time()
+
+    snapshot = None
+    if args.generator == "mod":
+        try:
+            snapshot = template_cache.snapshot(args.template_ref, offline=args.offline,
+                                               url=args.template_url, cache_dir=args.cache_dir)
+        except template_cache.TemplateCacheError as e:
+            sys.exit(str(e))
+    else:
+        # Seed once here so workers only ever read from the cache
+        versions = {args.gradle} if args.gradle else set()
+        for row in rows if not args.gradle else []:
+            try:
+                versions.add(fabric_generator.select_templates(row.get("mc_version", mod_generator.DEFAULT_MC_VERSION),
+                                                               row.get("template_set")).gradle_wrapper)
+            except template_registry.TemplateError:
+                pass  # reported per mod by the worker
+        try:
+            for version in versions:
+                gradle_cache.ensure(version, offline=args.offline)
+        except gradle_cache.GradleCacheError as e:
+            sys.exit(str(e))
+
+    seen = set()
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {}
+        for row in rows:
+            mod_id = row.get("mod_id")
+            if mod_id and mod_id in seen:
+                results.append({"mod_id": mod_id, "status": "failed", "error": "duplicate mod_id in manifest", "seconds": 0})
+                continue
+            seen.add(mod_id)
+            futures[executor.submit(build_one, args.generator, row, args.output, snapshot, args.gradle)] = mod_id
+        for future in as_completed(futures):
+            record = future.result()
+            print(f"{'✅' if record['status'] == 'ok' else '❌'} {record['mod_id']} ({record['seconds']}s)"
+                  + (f": {record['error']}" if record["status"] != "ok" else ""))
+            results.append(record)
+
+    results.sort(key=lambda r: str(r.get("mod_id")))
+    failed = [r for r in results if r["status"] != "ok"]
+    summary = {
+        "generator": args.generator,
+        "manifest": args.manifest,
+        "workers": args.workers,
+        "total": len(results),
+        "succeeded": len(results) - len(failed),
+        "failed": len(failed),
+        "seconds": round(time.time() - started, 3),
+        "mods": results,
+    }
+    with open(os.path.join(args.output, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"🏁 {summary['succeeded']}/{summary['total']} mods built in {summary['seconds']}s "
+          f"(summary: {os.path.join(args.output, 'summary.json')})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
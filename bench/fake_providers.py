@@ -0,0 +1,167 @@
+import io
+import json
+import random
+import re
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz): 4-byte header, zeroed
+# side info and main data. Decoders play it as silence.
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+def make_audio(fmt, size):
+    """Roughly `size` bytes of valid, silent audio in `fmt` (wav or mp3)."""
+    if fmt == "mp3":
+        return MP3_FRAME * max(1, size // len(MP3_FRAME))
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(44100)
+        w.writeframes(b"\x00\x00" * max(1, (size - 44) // 2))
+    return buf.getvalue()
+
+
+class FakeConfig:
+    def __init__(self, latency=0.2, jitter=0.05, slow_rate=0.0, slow_latency=2.0,
+                 payload_bytes=256 * 1024, fmt=None, errors=None, udio_indirect=True, stream_seconds=0.0):
+        self.latency = latency              # typical seconds per generation
+        self.jitter = jitter                # +/- uniform noise on latency
+        self.slow_rate = slow_rate          # fraction of calls that hit the tail
+        self.slow_latency = slow_latency    # seconds for a tail call
+        self.payload_bytes = payload_bytes
+        self.fmt = fmt                      # force a format; default is what was asked for
+        self.errors = errors or {}          # status code -> probability, e.g. {429: 0.1}
+        self.udio_indirect = udio_indirect  # Udio answers with JSON {"audio_url"} instead of audio
+        self.stream_seconds = stream_seconds  # spread each audio body over this long, like a model still rendering
+
+    def delay(self):
+        if self.slow_rate and random.random() < self.slow_rate:
+            return self.slow_latency
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def pick_error(self):
+        roll = random.random()
+        for status, rate in self.errors.items():
+            if roll < rate:
+                return int(status)
+            roll -= rate
+        return None
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body, content_type, spread=0.0, pieces=16):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not spread:
+            self.wfile.write(body)
+            return
+        step = max(1, -(-len(body) // pieces))
+        for i in range(0, len(body), step):
+            self.wfile.write(body[i:i + step])
+            self.wfile.flush()
+            time.sleep(spread / pieces)
+
+    def _error(self, status):
+        self._send(status, json.dumps({"errors": [f"fake error {status}"]}).encode(), "application/json")
+
+    def _audio(self, fmt, ranged=False):
+        config = self.server.config
+        fmt = config.fmt or fmt or "wav"
+        body = make_audio(fmt, config.payload_bytes)
+        content_type = "audio/mpeg" if fmt == "mp3" else "audio/wav"
+        match = re.match(r"^bytes=(\d+)-(\d*)$", self.headers.get("Range", "")) if ranged else None
+        if not match:
+            return self._send(200, body, content_type, spread=config.stream_seconds)
+
+        # Asset downloads honour single byte ranges, like a CDN would
+        start = int(match.group(1))
+        end = min(int(match.group(2) or len(body) - 1), len(body) - 1)
+        part = body[start:end + 1]
+        self.send_response(206)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(part)))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+        self.end_headers()
+        self.wfile.write(part)
+
+    def do_GET(self):
+        if self.path == "/v1/user/balance":
+            return self._send(200, json.dumps({"credits": 100.0}).encode(), "application/json")
+        match = re.match(r"^/files/\w+\.(\w+)$", self.path)  # Udio asset downloads
+        if match:
+            self.server.count()
+            return self._audio(match.group(1), ranged=True)
+        self._error(404)
+
+    def do_POST(self):
+        body = self._body()
+        self.server.count()
+        config = self.server.config
+
+        if re.match(r"^/v2beta/audio/[^/]+/text-to-audio$", self.path):
+            fmt = re.search(rb'name="output_format"\r\n\r\n(\w+)', body)
+            fmt = fmt.group(1).decode() if fmt else None
+        elif self.path == "/v1/generate":
+            fmt = json.loads(body or b"{}").get("format")
+        elif re.match(r"^/models/[^/]+/[^/]+$", self.path):
+            fmt = None  # HF returns whatever the model produces
+        else:
+            return self._error(404)
+
+        time.sleep(config.delay())
+        status = config.pick_error()
+        if status:
+            return self._error(status)
+
+        if self.path == "/v1/generate" and config.udio_indirect:
+            audio_url = f"{self.server.url}/files/{random.getrandbits(64):x}.{config.fmt or fmt or 'wav'}"
+            return self._send(200, json.dumps({"audio_url": audio_url}).encode(), "application/json")
+        self._audio(fmt)
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    """Local stand-in for the Stability, Udio and HF APIs with configurable latency and errors.
+
+    All three APIs are served on every instance; start one per provider to
+    give each its own FakeConfig.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024  # load tests open hundreds of connections at once
+
+    def __init__(self, config=None, port=0):
+        super().__init__(("127.0.0.1", port), FakeHandler)
+        self.config = config or FakeConfig()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.calls += 1
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,189 @@
+"""End-to-end /generate benchmark against local fake Stability, Udio and HF servers.
+
+No real API credits are spent: every provider base URL points at a
+FakeProviderServer. Reports throughput, latency percentiles, error counts,
+peak RSS of every server process and ffmpeg CPU time as JSON, so runs can be
+diffed between versions:
+
+    python -m bench.generate --mode sync --concurrency 16 --requests 200 \\
+        --models stable-audio-infinite,udio,musicgen --formats mp3 --output before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench.fake_providers import FakeConfig, FakeProviderServer
+from bench.load_test import ROOT, drive, free_port, server_command, wait_ready
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark /generate against fake providers")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync", help="gunicorn app:app or uvicorn asgi_app:app")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--models", default="stable-audio-infinite,stable-audio-standard,udio,musicgen",
+                        help="Comma-separated models; requests cycle through them")
+    parser.add_argument("--formats", default="mp3", help="Comma-separated output formats requested")
+    parser.add_argument("--provider-format", default="wav", help="What the fakes return (wav forces a transcode for mp3 requests)")
+    parser.add_argument("--payload-kb", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake seconds per generation")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of calls that take --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--errors", default="", help="Provider error rates, e.g. 401=0.01,429=0.05,500=0.02")
+    parser.add_argument("--pool-keys", type=int, default=4)
+    parser.add_argument("--cache", action="store_true", help="Leave the result cache on (off by default)")
+    parser.add_argument("--label", default=None, help="Free-form tag stored in the report (default: git describe)")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    return parser.parse_args()
+
+
+def parse_errors(spec):
+    errors = {}
+    for part in filter(None, spec.split(",")):
+        status, rate = part.split("=")
+        errors[int(status)] = float(rate)
+    return errors
+
+
+def git_describe():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def process_tree(root_pid):
+    """root_pid plus its direct children (gunicorn/uvicorn workers), from /proc."""
+    pids = [root_pid]
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; ppid is the 2nd field after ")"
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == root_pid:
+            pids.append(int(entry))
+    return pids
+
+
+def memory_status(pid):
+    # VmHWM is the process's peak resident set size since it started
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                fields[key] = value.strip()
+    except OSError:
+        return None
+    mb = lambda key: round(int(fields[key].split()[0]) / 1024, 1) if key in fields else None  # kB -> MB
+    return {"pid": pid, "name": fields.get("Name"), "peak_rss_mb": mb("VmHWM"), "rss_mb": mb("VmRSS")}
+
+
+def scrape_metrics(port):
+    """Sum every sample of each metric family we report on, across labels."""
+    text = httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=10).text
+    totals = {}
+    for line in text.splitlines():
+        match = re.match(r"^(sonicforge_\w+?)(\{[^}]*\})? ([0-9.eE+-]+)$", line)
+        if match:
+            totals[match.group(1)] = totals.get(match.group(1), 0) + float(match.group(3))
+    return totals
+
+
+def main():
+    args = parse_args()
+    errors = parse_errors(args.errors)
+    models = args.models.split(",")
+    formats = args.formats.split(",")
+
+    def provider():
+        config = FakeConfig(latency=args.latency, jitter=args.jitter, slow_rate=args.slow_rate,
+                            slow_latency=args.slow_latency, payload_bytes=args.payload_kb * 1024,
+                            fmt=args.provider_format, errors=errors)
+        return FakeProviderServer(config).start()
+
+    fakes = {"stability": provider(), "udio": provider(), "hf": provider()}
+    scratch = tempfile.mkdtemp(prefix="sonicforge-bench-")
+    env = dict(os.environ)
+    env.update({
+        "STABILITY_API_BASE": fakes["stability"].url,
+        "UDIO_API_BASE": fakes["udio"].url,
+        "HF_API_BASE": fakes["hf"].url,
+        "STABILTY_AI": "sk-fake-master",
+        "UDIO_AI": "fake-udio",
+        "HF_API_TOKEN": "fake-hf",
+        "CACHE_ENABLED": "1" if args.cache else "0",
+        "CACHE_DIR": os.path.join(scratch, "cache"),
+        "JOB_DIR": os.path.join(scratch, "jobs"),
+        "METRICS_DIR": os.path.join(scratch, "metrics"),
+        "KEY_POOL_DB": os.path.join(scratch, "keys.db"),
+    })
+    for i in range(1, args.pool_keys + 1):
+        env[f"STABILITY_KEY_{i}"] = f"sk-fake-{i}"
+
+    rng = random.Random(0)
+
+    def make_body(i):
+        return {"prompt": f"bench {i} {rng.random()}", "model": models[i % len(models)], "format": formats[i % len(formats)]}
+
+    port = free_port()
+    log_path = os.path.join(scratch, "server.log")
+    log = open(log_path, "w")
+    server = subprocess.Popen(server_command(args.mode, port, args.workers), cwd=ROOT, env=env,
+                              stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_ready(port)
+        result = asyncio.run(drive(port, args.requests, args.concurrency, make_body))
+        time.sleep(1.5)  # let every worker's metrics flusher write its last counts
+        metrics = scrape_metrics(port)
+        processes = [p for p in map(memory_status, process_tree(server.pid)) if p]
+    finally:
+        server.terminate()
+        server.wait()
+        log.close()
+        for fake in fakes.values():
+            fake.stop()
+
+    ok = args.requests - sum(result["errors"].values())
+    report = {
+        "label": args.label or git_describe(),
+        "timestamp": int(time.time()),
+        "config": vars(args),
+        "result": result,
+        "processes": processes,
+        "peak_rss_mb": max((p["peak_rss_mb"] or 0 for p in processes), default=None),
+        "transcode": {
+            "cpu_seconds": round(metrics.get("sonicforge_transcode_cpu_seconds_total", 0.0), 3),
+            "wall_seconds": round(metrics.get("sonicforge_transcode_seconds_sum", 0.0), 3),
+            "count": int(metrics.get("sonicforge_transcode_seconds_count", 0)),
+            "cpu_ms_per_ok_request": round(1000 * metrics.get("sonicforge_transcode_cpu_seconds_total", 0.0) / ok, 2) if ok else None,
+        },
+        "upstream_calls": {name: fake.calls for name, fake in fakes.items()},
+        "server_log": log_path,
+    }
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
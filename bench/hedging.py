@@ -0,0 +1,90 @@
+"""Tail latency of the stable-audio-infinite pool with hedging off vs. on.
+
+Runs the app in-process against a local fake Stability server whose latency
+has a slow tail, so no real credits are spent:
+
+    python -m bench.hedging --requests 200 --slow-rate 0.1
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.common import latency_summary
+from bench.fake_providers import FakeConfig, FakeProviderServer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure Stability pool latency with and without hedging")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per mode")
+    parser.add_argument("--warmup", type=int, default=30, help="Requests used to seed the pool's latency window")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--keys", type=int, default=10, help="Fake pool keys")
+    parser.add_argument("--latency", type=float, default=0.2, help="Typical upstream seconds")
+    parser.add_argument("--slow-rate", type=float, default=0.1, help="Fraction of calls that hit the slow tail")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="Seconds for a slow call")
+    parser.add_argument("--percentile", type=float, default=90, help="Hedge after this pool latency percentile")
+    parser.add_argument("--max-extra", type=int, default=1, help="Hedged calls allowed per request")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    return parser.parse_args()
+
+
+def run(client, count, concurrency):
+    def one(i):
+        started = time.perf_counter()
+        resp = client.post("/generate", json={"prompt": f"bench {i}", "model": "stable-audio-infinite", "format": "wav"})
+        resp.get_data()
+        return time.perf_counter() - started, resp.status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(count)))
+    return [t for t, status in results if status == 200], sum(1 for _, status in results if status != 200)
+
+
+def main():
+    args = parse_args()
+    config = FakeConfig(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency, fmt="wav")
+    server = FakeProviderServer(config).start()
+
+    scratch = tempfile.mkdtemp(prefix="sonicforge-bench-")
+    os.environ.update({
+        "STABILITY_API_BASE": server.url,
+        "CACHE_ENABLED": "0",
+        "CACHE_DIR": os.path.join(scratch, "cache"),
+        "JOB_DIR": os.path.join(scratch, "jobs"),
+        "KEY_POOL_DB": os.path.join(scratch, "keys.db"),
+        "STABILITY_HEDGE_PERCENTILE": str(args.percentile),
+        "STABILITY_HEDGE_MAX_EXTRA": str(args.max_extra),
+    })
+    for i in range(1, args.keys + 1):
+        os.environ[f"STABILITY_KEY_{i}"] = f"sk-fake-{i:04d}"
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        import app
+        client = app.app.test_client()
+        run(client, args.warmup, args.concurrency)
+
+        report = {"config": vars(args)}
+        for mode, enabled in (("off", False), ("on", True)):
+            app.PROVIDERS["stable-audio-infinite"].hedge = enabled
+            calls_before = server.calls
+            latencies, errors = run(client, args.requests, args.concurrency)
+            report[mode] = latency_summary(latencies)
+            report[mode]["errors"] = errors
+            report[mode]["upstream_calls_per_request"] = round((server.calls - calls_before) / args.requests, 3)
+        report["hedge_delay"] = app.STABILITY_POOL.latency_percentile(args.percentile)
+
+    server.stop()
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
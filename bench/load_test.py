@@ -0,0 +1,138 @@
+"""Concurrent /generate throughput: sync gunicorn (app.py) vs. async uvicorn (asgi_app.py).
+
+Both servers are started as subprocesses against a local fake Stability
+server, so the only thing being measured is how many slow upstream calls
+each deployment can keep in flight:
+
+    python -m bench.load_test --concurrency 200 --requests 1000 --latency 1.0
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench.common import latency_summary
+from bench.fake_providers import FakeConfig, FakeProviderServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare sync and async serving throughput")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=2, help="Server processes for each mode")
+    parser.add_argument("--latency", type=float, default=1.0, help="Fake upstream seconds per generation")
+    parser.add_argument("--payload-kb", type=int, default=64)
+    parser.add_argument("--modes", default="sync,async")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    return parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_command(mode, port, workers):
+    if mode == "sync":
+        return [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "--log-level", "warning", "app:app"]
+    return [sys.executable, "-m", "uvicorn", "asgi_app:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+
+def default_body(i):
+    return {"prompt": f"load {i}", "model": "stable-audio-infinite", "format": "wav"}
+
+
+async def drive(port, count, concurrency, make_body=default_body):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = {}
+
+    async with httpx.AsyncClient(limits=limits, timeout=600) as client:
+        async def one(i):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    resp = await client.post(f"http://127.0.0.1:{port}/generate", json=make_body(i))
+                    status = resp.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                if status == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(count)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "elapsed": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 2),
+        "latency": latency_summary(latencies),
+        "errors": errors,
+    }
+
+
+def main():
+    args = parse_args()
+    config = FakeConfig(latency=args.latency, jitter=0, payload_bytes=args.payload_kb * 1024, fmt="wav")
+    provider = FakeProviderServer(config).start()
+    scratch = tempfile.mkdtemp(prefix="sonicforge-load-")
+
+    env = dict(os.environ)
+    env.update({
+        "STABILITY_API_BASE": provider.url,
+        "STABILITY_KEY_1": "sk-fake-load",
+        "CACHE_ENABLED": "0",
+        "CACHE_DIR": os.path.join(scratch, "cache"),
+        "JOB_DIR": os.path.join(scratch, "jobs"),
+        "METRICS_DIR": os.path.join(scratch, "metrics"),
+        "KEY_POOL_DB": os.path.join(scratch, "keys.db"),
+    })
+
+    report = {"config": vars(args)}
+    for mode in args.modes.split(","):
+        port = free_port()
+        log = open(os.path.join(scratch, f"{mode}.log"), "w")
+        server = subprocess.Popen(server_command(mode, port, args.workers), cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            wait_ready(port)
+            report[mode] = asyncio.run(drive(port, args.requests, args.concurrency))
+        finally:
+            server.terminate()
+            server.wait()
+            log.close()
+
+    provider.stop()
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
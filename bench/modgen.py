@@ -0,0 +1,302 @@
+"""Per-phase timings for mod_generator.py and fabric_generator.py, fully offline.
+
+mod_generator runs against a local fixture git repo shaped like
+fabric-example-mod (optionally padded with thousands of synthetic Java
+files); fabric_generator runs against a stub Gradle wrapper cache. Each phase
+reports wall time, files written, bytes written and files moved, and can be
+profiled (one .prof per phase, for snakeviz/pstats):
+
+    python -m bench.modgen --runs 5
+    python -m bench.modgen --java-files 5000 --profile /tmp/modgen-prof --output modgen.json
+"""
+import argparse
+import cProfile
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+
+import fabric_generator
+import gradle_cache
+import mod_generator
+import template_cache
+import template_registry
+from mod_archive import VirtualTree, iter_zip, write_zip
+
+MOD = {"mod_id": "benchmod", "mod_name": "Bench Mod", "description": "Benchmark mod",
+       "package_name": "org.bench.benchmod", "author": "Bench", "version": "1.0.0"}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time and profile mod generation phases")
+    parser.add_argument("--generators", default="mod,fabric", help="Comma-separated: mod, fabric")
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions per generator")
+    parser.add_argument("--java-files", type=int, default=0, help="Extra synthetic Java files in each template")
+    parser.add_argument("--profile", help="Directory for one cProfile .prof file per generator phase")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    return parser.parse_args()
+
+
+# ==========================================
+# FIXTURES
+# ==========================================
+def _write(path, text, mode=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+    if mode:
+        os.chmod(path, mode)
+
+
+def synthetic_java(package, name, refs):
+    # Mentions every identifier the rewrite phase looks for
+    return (f"package {package};\n\nimport com.example.ExampleMod;\n\n"
+            f"public class {name} {{\n"
+            f"\tstatic final String ID = \"modid\";\n"
+            f"\tstatic final String TEXTURE = \"modid:textures/{name.lower()}.png\";\n"
+            + "".join(f"\tvoid call{i}() {{ ExampleMod.LOGGER.info(\"{name} {i}\"); }}\n" for i in range(refs))
+            + "}\n")
+
+
+def make_fixture_repo(root, java_files=0, branch=template_cache.DEFAULT_BRANCH):
+    """A git repo laid out like fabric-example-mod, plus `java_files` synthetic classes."""
+    files = {
+        "gradle.properties": "org.gradle.jvmargs=-Xmx1G\nminecraft_version=1.21\nyarn_mappings=1.21+build.1\n"
+                             "loader_version=0.16.0\nmod_version=1.0.0\nmaven_group=com.example\n"
+                             "archives_base_name=modid\nfabric_version=0.100.0+1.21\n",
+        "build.gradle": "plugins {\n\tid 'fabric-loom' version '1.7-SNAPSHOT'\n}\n\ndependencies {\n"
+                        "\tminecraft \"com.mojang:minecraft:${project.minecraft_version}\"\n"
+                        "\tmappings \"net.fabricmc:yarn:${project.yarn_mappings}:v2\"\n}\n",
+        "settings.gradle": "rootProject.name = 'fabric-example-mod'\n",
+        "gradlew.bat": "@rem gradle wrapper\n",
+        "LICENSE": "CC0\n" * 30,
+        "README.md": "# Example mod\n",
+        "src/main/resources/fabric.mod.json": json.dumps({
+            "schemaVersion": 1, "id": "modid", "version": "${version}", "name": "Example mod",
+            "description": "This is an example description!", "authors": ["Me!"],
+            "contact": {"homepage": "https://fabricmc.net/"}, "icon": "assets/modid/icon.png",
+            "entrypoints": {"main": ["com.example.ExampleMod"], "client": ["com.example.ExampleModClient"]},
+            "mixins": ["modid.mixins.json", {"config": "modid.client.mixins.json", "environment": "client"}],
+        }, indent=2) + "\n",
+        "src/main/resources/modid.mixins.json": '{\n  "package": "com.example.mixin",\n  "mixins": ["ExampleMixin"]\n}\n',
+        "src/client/resources/modid.client.mixins.json": '{\n  "package": "com.example.mixin.client",\n  "client": ["ExampleClientMixin"]\n}\n',
+        "src/main/java/com/example/ExampleMod.java": "package com.example;\n\npublic class ExampleMod {\n"
+                                                     "\tpublic static final String MOD_ID = \"modid\";\n}\n",
+        "src/main/java/com/example/mixin/ExampleMixin.java": "package com.example.mixin;\n\nclass ExampleMixin {}\n",
+        "src/client/java/com/example/ExampleModClient.java": "package com.example;\n\nclass ExampleModClient {}\n",
+        "src/client/java/com/example/mixin/client/ExampleClientMixin.java": "package com.example.mixin.client;\n\nclass ExampleClientMixin {}\n",
+    }
+    for i in range(java_files):
+        package = f"com.example.generated.p{i // 100}"
+        files[f"src/main/java/{package.replace('.', '/')}/Generated{i}.java"] = synthetic_java(package, f"Generated{i}", 5)
+    for path, text in files.items():
+        _write(os.path.join(root, path), text)
+    _write(os.path.join(root, "gradlew"), "#!/bin/sh\nexec java -jar gradle/wrapper/gradle-wrapper.jar \"$@\"\n", 0o755)
+    os.makedirs(os.path.join(root, "src/main/resources/assets/modid"), exist_ok=True)
+    with open(os.path.join(root, "src/main/resources/assets/modid/icon.png"), "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n" + os.urandom(4096))
+
+    git = ["git", "-C", root, "-c", "user.name=bench", "-c", "user.email=bench@localhost"]
+    subprocess.run(["git", "init", "-q", "-b", branch, root], check=True)
+    subprocess.run(git + ["add", "-A"], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "fixture"], check=True)
+    return root
+
+
+def make_stub_gradle_cache(cache_dir, version):
+    """A gradle_cache directory whose files are stand-ins, so nothing is downloaded."""
+    root = os.path.join(cache_dir, version)
+    _write(os.path.join(root, "gradlew"), "#!/bin/sh\necho stub gradlew\n", 0o755)
+    _write(os.path.join(root, "gradlew.bat"), "@rem stub gradlew.bat\n")
+    os.makedirs(os.path.join(root, "gradle/wrapper"), exist_ok=True)
+    with open(os.path.join(root, "gradle/wrapper/gradle-wrapper.jar"), "wb") as f:
+        f.write(os.urandom(60 * 1024))
+    checksums = {path: gradle_cache.sha256_of(os.path.join(root, path)) for path in gradle_cache.ARTIFACTS}
+    with open(os.path.join(root, "manifest.json"), "w") as f:
+        json.dump({"version": version, "sha256": checksums}, f)
+    return cache_dir
+
+
+def make_synthetic_template_root(root, java_files, base=template_registry.DEFAULT_SET):
+    """Copy of a template set with `java_files` extra templated classes."""
+    shutil.copytree(os.path.join(template_registry.TEMPLATE_ROOT, base), os.path.join(root, base))
+    for i in range(java_files):
+        path = os.path.join(root, base, "files", "src", "main", "java", "com", "@clean_author@", "@mod_id@",
+                            "generated", f"p{i // 100}", f"Generated{i}.java")
+        _write(path, synthetic_java(f"com.@clean_author@.@mod_id@.generated.p{i // 100}", f"Generated{i}", 5)
+               .replace("com.example.ExampleMod", "com.@clean_author@.@mod_id@.@class_name@")
+               .replace("ExampleMod.", "@class_name@.").replace('"modid', '"@mod_id@'))
+    return root
+
+
+# ==========================================
+# MEASUREMENT
+# ==========================================
+def tree_state(root):
+    state = {}
+    if not os.path.isdir(root):
+        return state
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            state[os.path.relpath(path, root)] = (st.st_ino, st.st_size, st.st_mtime_ns)
+    return state
+
+
+class PhaseTimer:
+    def __init__(self, profile_dir=None, prefix=""):
+        self.profile_dir = profile_dir
+        self.prefix = prefix
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name, root=None, output=None):
+        """Time one phase; `root` is diffed for touched files, `output` sized as bytes written."""
+        before = tree_state(root) if root else None
+        profiler = cProfile.Profile() if self.profile_dir else None
+        started = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+            elapsed = time.perf_counter() - started
+            record = {"seconds": elapsed, "files": 0, "bytes": 0, "moved": 0}
+            if root:
+                after = tree_state(root)
+                unchanged = set(before.values())  # a rename keeps inode, size and mtime
+                changed = [path for path, info in after.items() if before.get(path) != info]
+                moved = [path for path in changed if after[path] in unchanged]
+                record["files"] = len(changed) - len(moved)
+                record["moved"] = len(moved)
+                record["bytes"] = sum(after[path][1] for path in changed if path not in set(moved))
+            if output and os.path.exists(output):
+                record["files"] = max(record["files"], 1)
+                record["bytes"] = os.path.getsize(output)
+            self.phases.setdefault(name, []).append(record)
+            if profiler:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{self.prefix}{name}.prof"))
+
+
+def summarize(phases):
+    out = {}
+    for name, records in phases.items():
+        seconds = [r["seconds"] for r in records]
+        out[name] = {
+            "mean_ms": round(1000 * sum(seconds) / len(seconds), 3),
+            "min_ms": round(1000 * min(seconds), 3),
+            "files": records[-1]["files"],
+            "bytes": records[-1]["bytes"],
+            "moved": records[-1].get("moved", 0),
+        }
+    return out
+
+
+# ==========================================
+# GENERATORS
+# ==========================================
+def bench_mod_generator(timer, scratch, template_url, runs):
+    m = MOD
+    cache_dir = os.path.join(scratch, "template-cache")
+    with timer.phase("template_refresh"):
+        template_cache.refresh(template_cache.DEFAULT_BRANCH, template_url, cache_dir)
+    snapshot = template_cache.snapshot(offline=True, cache_dir=cache_dir)
+
+    for run in range(runs):
+        work = os.path.join(scratch, f"mod-{run}")
+        os.makedirs(work)
+        with timer.phase("clone", work):
+            mod_generator.clone_template(work, url=template_url, cache_dir=cache_dir, offline=True)
+        with timer.phase("update_config", work):
+            mod_generator.update_gradle_properties(work, m["mod_id"], m["package_name"])
+            mod_generator.update_build_gradle(work)
+            mod_generator.update_fabric_mod_json(work, m["mod_id"], m["mod_name"], m["description"])
+        with timer.phase("rewrite", work):
+            mod_generator.replace_in_files(work, m["mod_id"], m["mod_name"], m["package_name"])
+        with timer.phase("move", work):
+            mod_generator.move_package_dirs(work, m["mod_id"], m["mod_name"], m["package_name"])
+            mod_generator.rename_resources(work, m["mod_id"])
+        archive = os.path.join(scratch, f"mod-{run}")
+        with timer.phase("zip", output=archive + ".zip"):
+            shutil.make_archive(archive, "zip", root_dir=work)
+        direct = os.path.join(scratch, f"mod-direct-{run}.zip")
+        with timer.phase("direct_archive", output=direct):
+            mod_generator.build_archive(snapshot, direct, m["mod_id"], m["mod_name"], m["description"], m["package_name"])
+        shutil.rmtree(work)
+
+
+def bench_fabric_generator(timer, scratch, template_root, runs):
+    m = MOD
+    version = gradle_cache.DEFAULT_VERSION
+    gradle_dir = make_stub_gradle_cache(os.path.join(scratch, "gradle-cache"), version)
+    with timer.phase("load_templates"):
+        templates = template_registry.TemplateSet(template_registry.DEFAULT_SET, template_root)
+    context = fabric_generator.mod_context(m["mod_name"], m["mod_id"], m["version"], m["author"], m["description"],
+                                           mod_generator.DEFAULT_MC_VERSION)
+
+    for run in range(runs):
+        mod_dir = os.path.join(scratch, f"fabric-{run}", m["mod_id"])
+        with timer.phase("write_templates", mod_dir):
+            templates.write(context, mod_dir)
+        with timer.phase("wrapper", mod_dir):
+            gradle_cache.install(mod_dir, version, offline=True, cache_dir=gradle_dir)
+        archive = os.path.join(scratch, f"fabric-{run}.zip")
+        with timer.phase("zip", output=archive):
+            write_zip(VirtualTree.from_directory(mod_dir), archive)
+        with timer.phase("in_memory_archive"):
+            tree = templates.render_tree(context)
+            for path, source in gradle_cache.wrapper_files(version, True, gradle_dir).items():
+                tree.add_file(path, source)
+            size = sum(len(chunk) for chunk in iter_zip(tree))
+        timer.phases["in_memory_archive"][-1]["bytes"] = size
+        timer.phases["in_memory_archive"][-1]["files"] = len(tree.entries)
+        shutil.rmtree(os.path.dirname(mod_dir))
+
+
+def run_benchmarks(args, scratch):
+    report = {}
+    generators = args.generators.split(",")
+    if "mod" in generators:
+        fixture = make_fixture_repo(os.path.join(scratch, "fixture"), args.java_files)
+        timer = PhaseTimer(args.profile, "mod-")
+        bench_mod_generator(timer, scratch, fixture, args.runs)
+        report["mod_generator"] = summarize(timer.phases)
+
+    if "fabric" in generators:
+        template_root = template_registry.TEMPLATE_ROOT
+        if args.java_files:
+            template_root = make_synthetic_template_root(os.path.join(scratch, "templates"), args.java_files)
+        timer = PhaseTimer(args.profile, "fabric-")
+        bench_fabric_generator(timer, scratch, template_root, args.runs)
+        report["fabric_generator"] = summarize(timer.phases)
+    return report
+
+
+def main():
+    args = parse_args()
+    scratch = tempfile.mkdtemp(prefix="sonicforge-modgen-")
+    report = {"config": vars(args)}
+    try:
+        # The generators print progress (and per-file rewrite counts); keep it out of the timings and the JSON
+        with open(os.devnull, "w") as quiet, redirect_stdout(quiet):
+            report.update(run_benchmarks(args, scratch))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
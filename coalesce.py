@@ -0,0 +1,536 @@
+import asyncio
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+SWEEP_EVERY = 64  # flights led between sweeps of stale lock/result files
+STREAM_WINDOW_BYTES = 4 * 1024 * 1024  # most of a shared stream held for readers behind the leader
+STREAM_LAG_SECONDS = 30  # how long readers may hold a full window before they are cut off
+
+
+class StreamLagged(Exception):
+    pass
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _SharedStream:
+    """One pass through a chunk iterator, read by any number of requests.
+
+    Whichever reader is ahead pulls the next chunk from the source, and a
+    chunk is dropped once every reader has passed it and newer ones fill the
+    window, so at most `window` bytes of recent chunks stay in memory. Readers can
+    join until the first chunk has been dropped. When the window is full the puller waits for the
+    readers behind it; one that is still holding the oldest chunk after
+    lag_seconds is cut off (its next read raises StreamLagged). If the last
+    reader goes away before the end the source is closed and the stream is
+    abandoned. on_done() runs once either way. A sink, if given, gets every
+    chunk as it is pulled and is committed only when the source ran to its end.
+    """
+
+    def __init__(self, source, lock, on_done, sink=None, window=STREAM_WINDOW_BYTES, lag_seconds=STREAM_LAG_SECONDS):
+        self.source = source
+        self.on_done = on_done
+        self.sink = sink
+        self.window = window
+        self.lag_seconds = lag_seconds
+        self.chunks = deque()
+        self.first = 0  # index of chunks[0] in the whole stream
+        self.size = 0
+        self.readers = set()
+        self.pulling = False
+        self.done = False
+        self.abandoned = False
+        self.error = None
+        self._cond = threading.Condition(lock)
+
+    def reader(self):
+        # Callers hold the lock; None once a new reader could no longer start at the beginning
+        if self.first or self.abandoned:
+            return None
+        reader = _Reader(self)
+        self.readers.add(reader)
+        return reader
+
+    def _low(self):
+        # Callers hold the lock; index of the next chunk the slowest reader needs
+        return min((reader.index for reader in self.readers), default=self.first + len(self.chunks))
+
+    def _trim(self):
+        # Callers hold the lock. Chunks everyone has passed are kept while they
+        # fit in the window, so a request arriving a moment late can still join
+        low = self._low()
+        while self.first < low and (self.size > self.window or self.done):
+            self.size -= len(self.chunks.popleft())
+            self.first += 1
+            self._cond.notify_all()
+
+    def _cut_laggards(self):
+        # Callers hold the lock
+        for reader in [r for r in self.readers if r.index == self.first]:
+            reader.lagged = True
+            self.readers.discard(reader)
+        self._trim()
+
+    def chunk(self, reader):
+        while True:
+            with self._cond:
+                lag_deadline = None
+                while True:
+                    if reader.lagged:
+                        raise StreamLagged("Fell too far behind the shared stream")
+                    if reader.index < self.first + len(self.chunks):
+                        chunk = self.chunks[reader.index - self.first]
+                        reader.index += 1
+                        self._trim()
+                        return chunk
+                    if self.done:
+                        if self.error is not None:
+                            raise self.error
+                        raise StopIteration
+                    if self.pulling:
+                        self._cond.wait()
+                    elif self.size >= self.window and self._low() == self.first:
+                        if lag_deadline is None:
+                            lag_deadline = time.monotonic() + self.lag_seconds
+                        remaining = lag_deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._cut_laggards()
+                        else:
+                            self._cond.wait(remaining)
+                    else:
+                        self.pulling = True
+                        break
+            try:
+                chunk = next(self.source)
+            except StopIteration:
+                self._finish(None)
+                raise
+            except BaseException as e:
+                self._finish(e)
+                raise
+            if self.sink is not None:
+                try:
+                    self.sink.write(chunk)
+                except OSError:
+                    # Publishing is best-effort; the readers still get the stream
+                    self.sink.abort()
+                    self.sink = None
+            with self._cond:
+                self.chunks.append(chunk)
+                self.size += len(chunk)
+                self.pulling = False
+                self._cond.notify_all()
+
+    def _finish(self, error):
+        with self._cond:
+            self.done = True
+            self.pulling = False
+            self.error = error
+            self._cond.notify_all()
+        if self.sink is not None:
+            if error is None:
+                self.sink.commit()
+            else:
+                self.sink.abort()
+        self.on_done()
+
+    def release(self, reader):
+        with self._cond:
+            self.readers.discard(reader)
+            self._trim()
+            if self.readers or self.done:
+                return
+            self.done = self.abandoned = True
+        self.source.close()
+        if self.sink is not None:
+            self.sink.abort()
+        self.on_done()
+
+
+class _Reader:
+    def __init__(self, shared):
+        self.shared = shared
+        self.index = 0
+        self.lagged = False
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.shared.chunk(self)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.shared.release(self)
+
+
+class _ResultWriter:
+    """Writes a published result as it is produced: temp file, then rename."""
+
+    def __init__(self, directory, path, content_type):
+        self.path = path
+        fd, self.tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        self.file = os.fdopen(fd, "wb")
+        self.file.write(json.dumps({"content_type": content_type}).encode() + b"\n")
+
+    def write(self, chunk):
+        self.file.write(chunk)
+
+    def commit(self):
+        try:
+            self.file.close()
+            os.replace(self.tmp, self.path)
+        except OSError:
+            self.abort()
+
+    def abort(self):
+        try:
+            self.file.close()
+            os.remove(self.tmp)
+        except OSError:
+            pass
+
+
+class Coalescer:
+    """Single-flight for upstream generations.
+
+    Concurrent callers with the same key share one call: the first runs it,
+    the rest wait and get the same (audio bytes, content type) or the same
+    exception. With across_workers, a leader also holds an flock on
+    <directory>/<key>.lock while it generates and then publishes the result
+    next to it, so a worker that blocked on the lock can reuse it instead of
+    calling the provider again. Every call returns (result, role) where role
+    is "leader", "process" (joined a call in this process) or "worker"
+    (reused another worker's result).
+
+    stream() does the same for streamed results: callers get their own
+    reader over the leader's chunk iterator instead of waiting for the end.
+    """
+
+    def __init__(self, directory=None, across_workers=False, ttl=600, stream_wait=None):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "sonicforge-flights")
+        self.across_workers = across_workers
+        self.ttl = ttl
+        self.stream_wait = stream_wait  # longest wait on another worker's stream (None: no limit)
+        self._calls = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._led = 0
+        if across_workers:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def run(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, "process"
+
+        try:
+            call.result, role = self._lead(key, fn)
+            return call.result, role
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def run_async(self, key, fn):
+        """Same as run() for an event loop; fn returns an awaitable."""
+        while True:
+            future = self._futures.get(key)
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future), "process"
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # we were cancelled, not the leader
+                # The leader's request went away mid-flight; take over
+
+        future = self._futures[key] = asyncio.get_running_loop().create_future()
+        try:
+            result, role = await self._lead_async(key, fn)
+            future.set_result(result)
+            return result, role
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # nobody may be waiting; don't warn about it
+            raise
+        finally:
+            del self._futures[key]
+
+    def stream(self, key, fn):
+        """run() for a streamed result: fn returns a chunk iterator.
+
+        Every caller gets a reader that starts at the first chunk and follows
+        the leader's iterator as it produces. Anything other than an iterator
+        (a redirect) is shared as it is. Across workers, a caller that waited
+        on another worker's stream reads its published output from disk.
+        """
+        key = f"{key}-stream"  # a stream publishes finished output, run() the raw upstream result
+        replacing = False
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    break
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            with self._lock:
+                shared = call.result
+                if not isinstance(shared, _SharedStream):
+                    return shared, "process"
+                reader = shared.reader()
+                if reader is not None:
+                    return reader, "process"
+                # Too late to start from the first chunk, or everyone left
+                # before the end: start a new flight
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                replacing = True
+
+        lock = None
+        try:
+            role = "leader"
+            # A flight this process is replacing may still hold the lock; don't wait on ourselves
+            if self.across_workers and not replacing:
+                # A stream holds its lock until the last reader is done, which
+                # can take minutes; past stream_wait this request goes alone
+                lock, waiting_since = self._acquire(key, self.stream_wait)
+                published = self._published_chunks(key, waiting_since) if waiting_since is not None else None
+                if published is not None:
+                    result, role = published, "worker"
+                    lock.close()
+                    lock = None
+                elif lock is not None:
+                    os.utime(lock.name)
+            if role == "leader":
+                result = fn()
+        except BaseException as e:
+            call.error = e
+            self._stream_done(key, call, lock)
+            raise
+
+        if not hasattr(result, "__next__"):
+            call.result = result
+            self._stream_done(key, call, lock)
+            return result, role
+
+        # Other workers get the output from a file written as the chunks pass through
+        sink = self._writer(key) if lock is not None and role == "leader" else None
+        shared = _SharedStream(result, self._lock, lambda: self._stream_done(key, call, lock), sink)
+        with self._lock:
+            call.result = shared
+            reader = shared.reader()
+        call.event.set()
+        return reader, role
+
+    def _stream_done(self, key, call, lock):
+        # Ends the flight: later callers start a new one (or find the result cached)
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.event.set()
+        if lock is not None:
+            lock.close()
+            self._maybe_sweep()
+
+    # ------------------------------------------
+    # Across workers: flock + published result
+    # ------------------------------------------
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return f"{base}.lock", f"{base}.result"
+
+    def _acquire(self, key, timeout=None):
+        # Returns (open lock file, time we started waiting or None if it was free);
+        # the lock file is None if it was still held after timeout seconds
+        lock_path, _ = self._paths(key)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waiting_since = None
+        while True:
+            f = open(lock_path, "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if waiting_since is None:
+                    waiting_since = time.time()
+                if deadline is None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                elif not _lock_before(f, deadline):
+                    f.close()
+                    return None, waiting_since
+            if _same_file(f, lock_path):
+                return f, waiting_since
+            # The sweep unlinked this lock file while we waited on it; a
+            # newcomer would lock a fresh one, so take that one instead
+            f.close()
+
+    def _published(self, key, since):
+        # Only a result published while we waited counts; older ones are the result cache's job
+        _, result_path = self._paths(key)
+        try:
+            with open(result_path, "rb") as f:
+                if os.fstat(f.fileno()).st_mtime < since:
+                    return None
+                header = json.loads(f.readline())
+                return f.read(), header.get("content_type")
+        except (OSError, ValueError):
+            return None
+
+    def _published_chunks(self, key, since, chunk_size=64 * 1024):
+        # _published() for a stream: its output read back chunk by chunk, not whole
+        _, result_path = self._paths(key)
+        try:
+            f = open(result_path, "rb")
+        except OSError:
+            return None
+        try:
+            if os.fstat(f.fileno()).st_mtime < since:
+                f.close()
+                return None
+            f.readline()
+        except OSError:
+            f.close()
+            return None
+
+        def chunks():
+            with f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        return chunks()
+
+    def _writer(self, key, content_type=None):
+        try:
+            return _ResultWriter(self.directory, self._paths(key)[1], content_type)
+        except OSError:
+            return None
+
+    def _publish(self, key, result):
+        audio_bytes, content_type = result
+        writer = self._writer(key, content_type)
+        if writer is None:
+            return
+        try:
+            writer.write(audio_bytes)
+        except OSError:
+            writer.abort()
+            return
+        writer.commit()
+
+    def _lead(self, key, fn):
+        if not self.across_workers:
+            return fn(), "leader"
+        lock, waiting_since = self._acquire(key)
+        try:
+            if waiting_since is not None:
+                result = self._published(key, waiting_since)
+                if result is not None:
+                    return result, "worker"
+            os.utime(lock.name)  # fresh mtime keeps the sweep off an active lock
+            result = fn()
+            self._publish(key, result)
+        finally:
+            lock.close()
+        self._maybe_sweep()
+        return result, "leader"
+
+    async def _lead_async(self, key, fn):
+        if not self.across_workers:
+            return await fn(), "leader"
+        lock, waiting_since = await asyncio.to_thread(self._acquire, key)
+        try:
+            if waiting_since is not None:
+                result = await asyncio.to_thread(self._published, key, waiting_since)
+                if result is not None:
+                    return result, "worker"
+            os.utime(lock.name)
+            result = await fn()
+            await asyncio.to_thread(self._publish, key, result)
+        finally:
+            lock.close()
+        self._maybe_sweep()
+        return result, "leader"
+
+    def _maybe_sweep(self):
+        with self._lock:
+            self._led += 1
+            due = self._led % SWEEP_EVERY == 0
+        if due:
+            self.sweep()
+
+    def sweep(self):
+        """Drop lock and result files nobody has touched for ttl seconds."""
+        cutoff = time.time() - self.ttl
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if os.stat(path).st_mtime >= cutoff:
+                    continue
+                if not name.endswith(".lock"):
+                    os.remove(path)
+                    continue
+                # Only unlink a lock nobody holds, and unlink it while holding it
+                with open(path, "a") as f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    if _same_file(f, path):
+                        os.remove(path)
+            except OSError:
+                continue
+
+
+def _lock_before(f, deadline, interval=0.1):
+    # flock with a deadline: non-blocking tries until it passes
+    while True:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+
+
+def _same_file(f, path):
+    try:
+        return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+    except OSError:
+        return False
@@ -0,0 +1,190 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+import urllib.request
+
+DEFAULT_VERSION = "v8.9.0"
+CACHE_DIR = os.getenv("GRADLE_WRAPPER_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "sonicforge", "gradle-wrapper"))
+SOURCE_URL = "https://raw.githubusercontent.com/gradle/gradle/{version}/{path}"
+# Gradle publishes the official wrapper jar checksum next to each distribution
+CHECKSUM_URL = "https://services.gradle.org/distributions/gradle-{release}-wrapper.jar.sha256"
+
+# Path inside a mod dir (and inside the gradle/gradle repo) of each wrapper file
+ARTIFACTS = ("gradlew", "gradlew.bat", "gradle/wrapper/gradle-wrapper.jar")
+EXECUTABLE = ("gradlew",)
+
+
+class GradleCacheError(Exception):
+    pass
+
+
+def release_name(version):
+    # "v8.9.0" -> "8.9", "v8.10.2" -> "8.10.2" (the naming services.gradle.org uses)
+    parts = version.lstrip("v").split(".")
+    if len(parts) == 3 and parts[2] == "0":
+        parts = parts[:2]
+    return ".".join(parts)
+
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _version_dir(version, cache_dir):
+    return os.path.join(cache_dir, version)
+
+
+def _read_manifest(version, cache_dir):
+    try:
+        with open(os.path.join(_version_dir(version, cache_dir), "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class _Lock:
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, ".lock")
+
+    def __enter__(self):
+        self.file = open(self.path, "w")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+
+def seed(version=DEFAULT_VERSION, cache_dir=CACHE_DIR):
+    """Download and verify the wrapper files for `version` into the cache."""
+    with _Lock(cache_dir):
+        staging = tempfile.mkdtemp(dir=cache_dir, prefix=f".{version}-")
+        try:
+            checksums = {}
+            for path in ARTIFACTS:
+                target = os.path.join(staging, path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                print(f"Downloading {path} ({version})...")
+                urllib.request.urlretrieve(SOURCE_URL.format(version=version, path=path), target)
+                checksums[path] = sha256_of(target)
+                if path in EXECUTABLE:
+                    os.chmod(target, os.stat(target).st_mode | stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH)
+
+            with urllib.request.urlopen(CHECKSUM_URL.format(release=release_name(version))) as resp:
+                official = resp.read().decode().split()[0].strip()
+            jar = "gradle/wrapper/gradle-wrapper.jar"
+            if checksums[jar] != official:
+                raise GradleCacheError(f"{jar} for {version} does not match the published checksum {official}")
+
+            with open(os.path.join(staging, "manifest.json"), "w") as f:
+                json.dump({"version": version, "sha256": checksums}, f, indent=2)
+
+            target = _version_dir(version, cache_dir)
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            os.replace(staging, target)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+    print(f"Gradle wrapper {version} cached in {target}.")
+    return target
+
+
+def verify(version=DEFAULT_VERSION, cache_dir=CACHE_DIR):
+    """True if every cached file for `version` still matches its recorded checksum."""
+    manifest = _read_manifest(version, cache_dir)
+    if not manifest:
+        return False
+    root = _version_dir(version, cache_dir)
+    for path, expected in manifest["sha256"].items():
+        full = os.path.join(root, path)
+        if not os.path.isfile(full) or sha256_of(full) != expected:
+            print(f"⚠️ Cached {path} for {version} is missing or corrupt")
+            return False
+    return True
+
+
+def ensure(version=DEFAULT_VERSION, offline=False, cache_dir=CACHE_DIR):
+    """Directory holding verified wrapper files, seeding it first unless offline."""
+    if verify(version, cache_dir):
+        return _version_dir(version, cache_dir)
+    if offline:
+        raise GradleCacheError(
+            f"Gradle wrapper {version} is not cached and offline mode is on. "
+            f"Run 'python gradle_cache.py seed --version {version}' first."
+        )
+    return seed(version, cache_dir)
+
+
+def wrapper_files(version=DEFAULT_VERSION, offline=False, cache_dir=CACHE_DIR):
+    """{path inside a mod dir: verified cached file} for one Gradle version."""
+    root = ensure(version, offline, cache_dir)
+    return {path: os.path.join(root, path) for path in ARTIFACTS}
+
+
+def install(mod_dir, version=DEFAULT_VERSION, offline=False, cache_dir=CACHE_DIR, link=True):
+    """Put gradlew, gradlew.bat and gradle-wrapper.jar into `mod_dir`.
+
+    Files are hardlinked out of the cache when possible (they are never
+    edited by the generators), otherwise copied.
+    """
+    for path, src in wrapper_files(version, offline, cache_dir).items():
+        dst = os.path.join(mod_dir, path)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.exists(dst):
+            os.unlink(dst)
+        if link:
+            try:
+                os.link(src, dst)
+                continue
+            except OSError:
+                pass  # different filesystem, or links not allowed
+        shutil.copy2(src, dst)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Manage the local Gradle wrapper artifact cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("seed", "Download and verify wrapper files"),
+                            ("verify", "Check cached files against their checksums")):
+        cmd = sub.add_parser(name, help=help_text)
+        cmd.add_argument("--version", action="append", help=f"Gradle tag, repeatable (default {DEFAULT_VERSION})")
+    sub.add_parser("list", help="Show cached versions")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "list":
+        versions = sorted(v for v in os.listdir(args.cache_dir) if not v.startswith(".")) if os.path.isdir(args.cache_dir) else []
+        if not versions:
+            print(f"No Gradle wrappers cached in {args.cache_dir}.")
+        for version in versions:
+            print(version)
+        return 0
+
+    failed = False
+    for version in args.version or [DEFAULT_VERSION]:
+        if args.command == "seed":
+            seed(version, args.cache_dir)
+        elif verify(version, args.cache_dir):
+            print(f"✅ {version}")
+        else:
+            print(f"❌ {version}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
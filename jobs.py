@@ -0,0 +1,181 @@
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+HEARTBEAT_SECONDS = 10
+
+
+class JobStoreFull(Exception):
+    pass
+
+
+class JobStore:
+    """Bounded, TTL-evicted store for background generation jobs.
+
+    Job state lives in small JSON files next to the finished audio, so any
+    gunicorn worker can answer a poll for a job that another worker is running.
+    The worker that owns a queued or running job touches its file every
+    HEARTBEAT_SECONDS; a job whose file has gone quiet for stale_after seconds
+    lost its worker (restart, crash) and is reported as failed.
+    """
+
+    def __init__(self, directory=None, max_jobs=200, ttl=3600, workers=4, stale_after=HEARTBEAT_SECONDS * 6):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "sonicforge-jobs")
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._active = set()
+        self._heartbeat_pid = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _meta_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def audio_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.audio")
+
+    def _write(self, job):
+        # Write-then-rename so readers in other workers never see half a file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp, self._meta_path(job["id"]))
+
+    def _load(self, path):
+        with open(path) as f:
+            job = json.load(f)
+            touched = os.fstat(f.fileno()).st_mtime
+        if job["status"] in ("queued", "running") and time.time() - touched > self.stale_after:
+            job.update(status="error", error="The server restarted during this generation. Please try again.",
+                       code=503, finished=time.time())
+            self._write(job)
+        return job
+
+    def get(self, job_id):
+        if not JOB_ID_RE.match(job_id or ""):
+            return None
+        try:
+            job = self._load(self._meta_path(job_id))
+        except (OSError, ValueError):
+            return None
+        if time.time() - job["created"] > self.ttl:
+            self._remove(job_id)
+            return None
+        return job
+
+    def _remove(self, job_id):
+        for path in (self._meta_path(job_id), self.audio_path(job_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _list(self):
+        jobs = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                jobs.append(self._load(os.path.join(self.directory, name)))
+            except (OSError, ValueError):
+                continue
+        return jobs
+
+    def evict(self):
+        now = time.time()
+        live = []
+        for job in self._list():
+            if now - job["created"] > self.ttl:
+                self._remove(job["id"])
+            else:
+                live.append(job)
+
+        # Still over the limit: drop the oldest finished jobs first
+        overflow = len(live) - self.max_jobs + 1
+        if overflow > 0:
+            finished = sorted((j for j in live if j["status"] in ("done", "error")), key=lambda j: j["created"])
+            for job in finished[:overflow]:
+                self._remove(job["id"])
+                live.remove(job)
+        return len(live)
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            with self._lock:
+                active = list(self._active)
+            for job_id in active:
+                try:
+                    os.utime(self._meta_path(job_id))
+                except OSError:
+                    pass
+
+    def _start_heartbeat(self):
+        # Callers hold the lock; threads don't survive a fork, so one per process
+        if self._heartbeat_pid != os.getpid():
+            self._heartbeat_pid = os.getpid()
+            threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def submit(self, fn, args=(), meta=None):
+        # The flock makes the cap hold across workers, not just threads
+        with self._lock, open(os.path.join(self.directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.evict() >= self.max_jobs:
+                raise JobStoreFull("Too many generations in progress. Please try again shortly.")
+
+            job = {
+                "id": uuid.uuid4().hex,
+                "status": "queued",
+                "created": time.time(),
+                "started": None,
+                "finished": None,
+                "error": None,
+                "code": None,
+                "mimetype": None,
+                "owner": os.getpid(),
+            }
+            job.update(meta or {})
+            self._write(job)
+            self._active.add(job["id"])
+            self._start_heartbeat()
+
+        self.executor.submit(self._run, job, fn, args)
+        return job["id"]
+
+    def _run(self, job, fn, args):
+        job["status"] = "running"
+        job["started"] = time.time()
+        self._write(job)
+        try:
+            audio, mimetype, info = fn(*args)
+            if isinstance(audio, bytes):
+                audio = [audio]
+            size = 0
+            with open(self.audio_path(job["id"]), "wb") as f:
+                # Streamed results are written chunk by chunk, never held whole
+                for chunk in audio:
+                    f.write(chunk)
+                    size += len(chunk)
+            job["status"] = "done"
+            job["mimetype"] = mimetype
+            job["size"] = size
+            job.update(info)
+        except Exception as e:
+            job["status"] = "error"
+            job["error"] = getattr(e, "message", str(e))
+            job["code"] = getattr(e, "status", 500)
+        job["finished"] = time.time()
+        try:
+            self._write(job)
+        finally:
+            with self._lock:
+                self._active.discard(job["id"])
@@ -0,0 +1,309 @@
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# How long a key sits out after a failure, by upstream status code (seconds).
+# 401/403 mean the key is revoked or invalid, 402 means it ran out of credits,
+# 429 is a rate limit that usually clears quickly.
+COOLDOWNS = {
+    401: 24 * 60 * 60,
+    403: 24 * 60 * 60,
+    402: 6 * 60 * 60,
+    429: 30,
+}
+DEFAULT_COOLDOWN = 10      # network errors, 5xx
+MAX_BACKOFF_COOLDOWN = 15 * 60
+
+# Statuses that say something about the key itself. Anything else (400, 422...)
+# is about the request, so every other key would fail the same way.
+KEY_STATUSES = (401, 402, 403, 429)
+
+LATENCY_SMOOTHING = 0.3
+LATENCY_WINDOW = 200         # recent successful calls kept for percentiles
+MIN_LATENCY_SAMPLES = 20
+
+
+def mask_key(key):
+    return f"...{key[-4:]}" if len(key) > 4 else "****"
+
+
+def key_id(key):
+    # What the shared store keys rows by; the API key itself never goes to disk
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+class KeyState:
+    def __init__(self, index, key):
+        self.index = index
+        self.key = key
+        self.successes = 0
+        self.failures = {}           # status code (or "error") -> count
+        self.consecutive_failures = 0
+        self.last_status = None
+        self.last_error = ""
+        self.last_used = 0.0
+        self.last_failure = 0.0
+        self.cooldown_until = 0.0
+        self.credits = None          # unknown until a balance check or a 402
+        self.latency = None          # smoothed seconds per successful call
+
+    def available(self, now):
+        return self.cooldown_until <= now
+
+    def to_dict(self, now):
+        return {
+            "key": f"#{self.index + 1}",
+            "suffix": mask_key(self.key),
+            "available": self.available(now),
+            "cooldown_remaining": max(0, round(self.cooldown_until - now, 1)),
+            "exhausted": self.credits is not None and self.credits <= 0,
+            "credits": self.credits,
+            "successes": self.successes,
+            "failures": {str(k): v for k, v in self.failures.items()},
+            "consecutive_failures": self.consecutive_failures,
+            "last_status": self.last_status,
+            "last_error": self.last_error[:200],
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+        }
+
+
+# Fields of KeyState kept in the shared store
+SHARED_FIELDS = ("successes", "failures", "consecutive_failures", "last_status", "last_error",
+                 "last_used", "last_failure", "cooldown_until", "credits", "latency")
+
+
+class SharedKeyState:
+    """Key health in SQLite (WAL mode), shared by every worker and kept across restarts.
+
+    Readers check PRAGMA data_version, which only moves when another
+    connection has committed, so an unchanged pool costs one tiny query per
+    request. Updates are read-modify-write inside BEGIN IMMEDIATE, so two
+    workers reporting on the same key can't lose each other's counts.
+    """
+
+    def __init__(self, path=None, timeout=5.0):
+        self.path = path or os.path.join(tempfile.gettempdir(), "sonicforge-keys.db")
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+        self._version = None
+
+    def _connection(self):
+        # One connection per process: a connection must not cross a gunicorn fork
+        if self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            columns = ", ".join(SHARED_FIELDS)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS key_state (key_id TEXT PRIMARY KEY, {columns})")
+            self._conn, self._pid, self._version = conn, os.getpid(), None
+        return self._conn
+
+    def changed(self):
+        """True if another connection committed since the last call (always, the first time)."""
+        version = self._connection().execute("PRAGMA data_version").fetchone()[0]
+        changed = version != self._version
+        self._version = version
+        return changed
+
+    def _apply(self, state, row):
+        values = dict(zip(SHARED_FIELDS, row))
+        values["failures"] = {int(k) if k.isdigit() else k: v for k, v in json.loads(values["failures"] or "{}").items()}
+        for name, value in values.items():
+            setattr(state, name, value)
+
+    def load(self, states):
+        by_id = {key_id(s.key): s for s in states}
+        for row in self._connection().execute(f"SELECT key_id, {', '.join(SHARED_FIELDS)} FROM key_state"):
+            state = by_id.get(row[0])
+            if state is not None:
+                self._apply(state, row[1:])
+
+    def read(self, state):
+        row = self._connection().execute(f"SELECT {', '.join(SHARED_FIELDS)} FROM key_state WHERE key_id = ?",
+                                         (key_id(state.key),)).fetchone()
+        if row is not None:
+            self._apply(state, row)
+
+    def write(self, state):
+        values = [getattr(state, name) for name in SHARED_FIELDS]
+        values[SHARED_FIELDS.index("failures")] = json.dumps({str(k): v for k, v in state.failures.items()})
+        placeholders = ", ".join("?" * (len(SHARED_FIELDS) + 1))
+        self._connection().execute(f"INSERT OR REPLACE INTO key_state (key_id, {', '.join(SHARED_FIELDS)}) VALUES ({placeholders})",
+                                   [key_id(state.key), *values])
+
+    def begin(self):
+        # Takes the write lock up front, so the read that follows can't go stale
+        self._connection().execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        self._connection().execute("COMMIT")
+
+    def rollback(self):
+        if self._conn is not None and self._conn.in_transaction:
+            self._conn.execute("ROLLBACK")
+
+
+class KeyPool:
+    """Picks Stability pool keys by health instead of always starting at key #1.
+
+    Healthy keys are handed out round-robin; keys that have failed recently go
+    to the back of the line (least-recently-failed first) and keys in cooldown
+    are skipped entirely until their deadline passes. With a SharedKeyState,
+    that health is common to all workers, so a key one of them found dead is
+    skipped by the rest, and after a restart too. Recent latencies for
+    percentiles stay per process.
+    """
+
+    def __init__(self, keys, shared=None):
+        self._states = [KeyState(i, k) for i, k in enumerate(keys)]
+        self._shared = shared
+        # Workers each start the round-robin somewhere else instead of all on key #1
+        self._cursor = random.randrange(len(self._states)) if shared and self._states else 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def _sync(self):
+        # Callers hold the lock. A store that can't be read leaves the local view in charge.
+        if self._shared is None:
+            return
+        try:
+            if self._shared.changed():
+                self._shared.load(self._states)
+        except sqlite3.Error as e:
+            print(f"⚠️ Shared key state unavailable: {e}")
+
+    @contextmanager
+    def _update(self, index):
+        # Read-modify-write of one key's state, atomic across workers when shared.
+        # If the store fails, the update still applies to this worker's view.
+        with self._lock:
+            s = self._states[index]
+            shared = self._shared
+            if shared is not None:
+                try:
+                    shared.begin()
+                    shared.read(s)
+                except sqlite3.Error as e:
+                    print(f"⚠️ Shared key state unavailable: {e}")
+                    shared.rollback()
+                    shared = None
+            try:
+                yield s
+            except BaseException:
+                if shared is not None:
+                    shared.rollback()
+                raise
+            if shared is not None:
+                try:
+                    shared.write(s)
+                    shared.commit()
+                except sqlite3.Error as e:
+                    print(f"⚠️ Shared key state not saved: {e}")
+                    shared.rollback()
+
+    def __len__(self):
+        return len(self._states)
+
+    def __bool__(self):
+        return bool(self._states)
+
+    def candidates(self):
+        """Returns (index, key) pairs to try for one request, best first."""
+        now = time.time()
+        with self._lock:
+            self._sync()
+            n = len(self._states)
+            if not n:
+                return []
+            start = self._cursor
+            self._cursor = (self._cursor + 1) % n
+            rotated = self._states[start:] + self._states[:start]
+
+            ready = [s for s in rotated if s.available(now)]
+            clean = [s for s in ready if s.consecutive_failures == 0]
+            flaky = sorted(
+                (s for s in ready if s.consecutive_failures > 0),
+                key=lambda s: (s.consecutive_failures, s.last_failure),
+            )
+            return [(s.index, s.key) for s in clean + flaky]
+
+    def next_available_in(self):
+        """Seconds until the first cooling-down key becomes usable again."""
+        now = time.time()
+        with self._lock:
+            self._sync()
+            if not self._states:
+                return None
+            return max(0, min(s.cooldown_until for s in self._states) - now)
+
+    def report_success(self, index, latency):
+        with self._update(index) as s:
+            s.successes += 1
+            s.consecutive_failures = 0
+            s.last_status = 200
+            s.last_used = time.time()
+            s.cooldown_until = 0.0
+            self._latencies.append(latency)
+            if s.latency is None:
+                s.latency = latency
+            else:
+                s.latency += LATENCY_SMOOTHING * (latency - s.latency)
+
+    def latency_percentile(self, pct):
+        """Pool-wide latency percentile of recent successes, or None if too few."""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def report_failure(self, index, status=None, message=""):
+        now = time.time()
+        with self._update(index) as s:
+            label = status if status is not None else "error"
+            s.failures[label] = s.failures.get(label, 0) + 1
+            s.consecutive_failures += 1
+            s.last_status = status
+            s.last_error = message or ""
+            s.last_used = now
+            s.last_failure = now
+
+            if status == 402:
+                s.credits = 0
+            if status in COOLDOWNS and status != 429:
+                cooldown = COOLDOWNS[status]
+            else:
+                # Back off harder each time the same key keeps failing
+                base = COOLDOWNS.get(status, DEFAULT_COOLDOWN)
+                cooldown = min(base * 2 ** (s.consecutive_failures - 1), MAX_BACKOFF_COOLDOWN)
+            s.cooldown_until = now + cooldown
+
+    def set_credits(self, index, credits):
+        with self._update(index) as s:
+            s.credits = credits
+            if credits is not None and credits <= 0:
+                s.cooldown_until = max(s.cooldown_until, time.time() + COOLDOWNS[402])
+            elif s.last_status == 402:
+                # Topped up since the last 402
+                s.cooldown_until = 0.0
+                s.consecutive_failures = 0
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            self._sync()
+            keys = [s.to_dict(now) for s in self._states]
+        return {
+            "size": len(keys),
+            "available": sum(1 for k in keys if k["available"]),
+            "exhausted": sum(1 for k in keys if k["exhausted"]),
+            "keys": keys,
+        }
@@ -0,0 +1,257 @@
+import atexit
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+# Seconds; generations run from well under a second (cache, HF) to minutes
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+FLUSH_INTERVAL = 1.0
+RETIRED = "retired.json"
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _merge(totals, data, gauges=True):
+    # Add one snapshot's values into {"counters"|"gauges"|"histograms": {(name, labels): value}}
+    for name, labels, value in data.get("counters", []):
+        key = (name, tuple(map(tuple, labels)))
+        totals["counters"][key] = totals["counters"].get(key, 0) + value
+    if gauges:
+        for name, labels, value in data.get("gauges", []):
+            key = (name, tuple(map(tuple, labels)))
+            totals["gauges"][key] = totals["gauges"].get(key, 0) + value
+    for name, labels, h in data.get("histograms", []):
+        key = (name, tuple(map(tuple, labels)))
+        total = totals["histograms"].get(key)
+        if total is None:
+            totals["histograms"][key] = list(h)
+        else:
+            totals["histograms"][key] = [a + b for a, b in zip(total, h)]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    """Counters, gauges and histograms shared across gunicorn workers.
+
+    Each process records into memory, and a background thread writes a
+    snapshot to `<directory>/<pid>.json` every FLUSH_INTERVAL while there are
+    new values. A scrape sums every live worker's snapshot, so /metrics reports
+    the same totals whichever worker answers it. The snapshot of an exited
+    worker is folded, once, into `<directory>/retired.json` and removed: its
+    counters and histograms keep counting towards the totals, its gauges are
+    dropped. A snapshot carries its process's token, so a new process that
+    was handed a dead worker's pid retires that file instead of adopting it.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "sonicforge-metrics")
+        self._defs = {}        # name -> (type, help, buckets)
+        self._counters = {}    # (name, labels) -> value
+        self._gauges = {}
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._derived = []     # (name, help, fn(totals) -> value)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flusher_pid = None
+        self._token = None
+        os.makedirs(self.directory, exist_ok=True)
+        atexit.register(self.flush)
+
+    def counter(self, name, help):
+        self._defs[name] = ("counter", help, None)
+
+    def gauge(self, name, help):
+        self._defs[name] = ("gauge", help, None)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self._defs[name] = ("histogram", help, tuple(buckets))
+
+    def derived(self, name, help, fn):
+        """A gauge computed at scrape time from the aggregated counters."""
+        self._derived.append((name, help, fn))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._dirty = True
+        self._maybe_flush()
+
+    def set(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = value
+            self._dirty = True
+        self._maybe_flush()
+
+    def observe(self, name, value, **labels):
+        buckets = self._defs[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+            self._dirty = True
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        # Started lazily so every forked worker gets its own flusher thread
+        if self._flusher_pid != os.getpid():
+            with self._lock:
+                if self._flusher_pid == os.getpid():
+                    return
+                self._flusher_pid = os.getpid()
+                self._token = uuid.uuid4().hex
+            own = self._path(os.getpid())
+            previous = self._read(own)
+            if previous is not None and previous.get("token") != self._token:
+                self._retire([own])
+            threading.Thread(target=self._flush_loop, daemon=True, name="metrics-flush").start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def _snapshot(self):
+        with self._lock:
+            self._dirty = False
+            return {
+                "counters": [[n, list(map(list, l)), v] for (n, l), v in self._counters.items()],
+                "gauges": [[n, list(map(list, l)), v] for (n, l), v in self._gauges.items()],
+                "histograms": [[n, list(map(list, l)), list(h)] for (n, l), h in self._histograms.items()],
+                "token": self._token,
+            }
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def _retire(self, paths):
+        # Under an flock so two scraping workers can't fold the same file twice
+        try:
+            with open(os.path.join(self.directory, ".lock"), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                totals = {"counters": {}, "gauges": {}, "histograms": {}}
+                _merge(totals, self._read(os.path.join(self.directory, RETIRED)) or {})
+                folded = []
+                for path in paths:
+                    data = self._read(path)
+                    if data is not None:
+                        _merge(totals, data, gauges=False)
+                        folded.append(path)
+                if not folded:
+                    return
+                self._write(os.path.join(self.directory, RETIRED), {
+                    "counters": [[n, list(map(list, l)), v] for (n, l), v in totals["counters"].items()],
+                    "histograms": [[n, list(map(list, l)), h] for (n, l), h in totals["histograms"].items()],
+                })
+                for path in folded:
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def flush(self):
+        if not self._dirty:
+            return
+        data = self._snapshot()
+        try:
+            self._write(self._path(os.getpid()), data)
+        except OSError:
+            pass
+
+    def collect(self):
+        """Totals across every worker: {"counters"|"gauges"|"histograms": {(name, labels): value}}."""
+        self.flush()
+        entries = [e for e in os.listdir(self.directory) if e.endswith(".json") and e[:-5].isdigit()]
+        dead = [os.path.join(self.directory, e) for e in entries if not _pid_alive(int(e[:-5]))]
+        if dead:
+            self._retire(dead)
+
+        totals = {"counters": {}, "gauges": {}, "histograms": {}}
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            # Shared: never between a retirement's write and its removals
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            for entry in os.listdir(self.directory):
+                if entry == RETIRED or (entry.endswith(".json") and entry[:-5].isdigit()):
+                    data = self._read(os.path.join(self.directory, entry))
+                    if data is not None:
+                        _merge(totals, data)
+        return totals
+
+    def total(self, totals, name, **match):
+        """Sum of a counter over every label set that includes `match`."""
+        want = set(_label_key(match))
+        return sum(v for (n, l), v in totals["counters"].items() if n == name and want <= set(l))
+
+    def render(self):
+        totals = self.collect()
+        lines = []
+        for name, (kind, help, buckets) in sorted(self._defs.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for (n, labels), h in sorted(totals["histograms"].items()):
+                    if n != name:
+                        continue
+                    # Stored per-bucket counts are already cumulative (value <= bound)
+                    for bound, count in zip(buckets, h):
+                        lines.append(f"{name}_bucket{_format_labels(labels, [('le', repr(float(bound)))])} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {h[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {h[-2]}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {h[-1]}")
+            else:
+                source = totals["counters"] if kind == "counter" else totals["gauges"]
+                for (n, labels), value in sorted(source.items()):
+                    if n == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name, help, fn in self._derived:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {fn(totals)}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,142 @@
+import os
+import shutil
+import time
+import zipfile
+
+# Per-suffix (compress_type, level). Already-compressed formats are stored so
+# no CPU is spent deflating them again; text deflates well.
+DEFAULT_COMPRESSION = {
+    ".png": (zipfile.ZIP_STORED, None),
+    ".jar": (zipfile.ZIP_STORED, None),
+    ".zip": (zipfile.ZIP_STORED, None),
+    ".ogg": (zipfile.ZIP_STORED, None),
+    "*": (zipfile.ZIP_DEFLATED, 6),
+}
+
+
+def compression_for(path, table):
+    _, ext = os.path.splitext(path)
+    return table.get(ext.lower(), table.get("*", (zipfile.ZIP_DEFLATED, 6)))
+
+
+class VirtualTree:
+    """Archive entries keyed by posix path, with content and path transforms.
+
+    An entry's source is either a file on disk or bytes. Content rewrites
+    see the entry's original path; renames run afterwards. Nothing is read
+    until the tree is written, and entries no rewrite applies to are copied
+    straight from disk into the archive.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.rewrites = []
+        self.renames = []
+
+    @classmethod
+    def from_directory(cls, root):
+        tree = cls()
+        for dirpath, dirs, files in os.walk(root):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(dirpath, name)
+                tree.entries[os.path.relpath(full, root).replace(os.sep, "/")] = full
+        return tree
+
+    def add(self, path, data):
+        self.entries[path] = data.encode("utf-8") if isinstance(data, str) else data
+
+    def add_file(self, path, source):
+        self.entries[path] = source
+
+    def rewrite(self, fn, when):
+        """Pass text of entries where when(path) is true through fn(text) -> text."""
+        self.rewrites.append((when, fn))
+
+    def rename(self, fn):
+        """Map every entry path through fn(path) -> path."""
+        self.renames.append(fn)
+
+    def final_path(self, path):
+        for fn in self.renames:
+            path = fn(path)
+        return path
+
+    def items(self):
+        """Yield (final path, source, rewritten bytes or None)."""
+        for path, source in self.entries.items():
+            fns = [fn for when, fn in self.rewrites if when(path)]
+            data = None
+            if fns:
+                if isinstance(source, bytes):
+                    text = source.decode("utf-8")
+                else:
+                    with open(source, "r", encoding="utf-8") as f:
+                        text = f.read()
+                for fn in fns:
+                    text = fn(text)
+                data = text.encode("utf-8")
+            yield self.final_path(path), source, data
+
+
+def _zip_info(path, source, compression):
+    if isinstance(source, bytes):
+        info = zipfile.ZipInfo(path, time.localtime()[:6])
+        info.external_attr = 0o644 << 16
+    else:
+        info = zipfile.ZipInfo.from_file(source, path)  # keeps gradlew executable
+    info.compress_type, level = compression
+    if level is not None:
+        info._compresslevel = level  # honoured by ZipFile.open(info, "w")
+    return info
+
+
+def _write_entries(zf, tree, compression):
+    # Generator so callers can act between entries; yields once per entry
+    table = {**DEFAULT_COMPRESSION, **(compression or {})}
+    for path, source, data in tree.items():
+        info = _zip_info(path, source, compression_for(path, table))
+        if data is None and isinstance(source, bytes):
+            data = source
+        if data is not None:
+            info.file_size = len(data)
+            with zf.open(info, "w") as dest:
+                dest.write(data)
+        else:
+            info.file_size = os.path.getsize(source)
+            with open(source, "rb") as src, zf.open(info, "w") as dest:
+                shutil.copyfileobj(src, dest)
+        yield path
+
+
+def write_zip(tree, out, compression=None):
+    """Write `tree` as a zip to a path or a (possibly unseekable) binary file object."""
+    with zipfile.ZipFile(out, "w") as zf:
+        for _ in _write_entries(zf, tree, compression):
+            pass
+
+
+class _ChunkSink:
+    # Write-only file object that hands back what was written since last drain
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def iter_zip(tree, compression=None):
+    """Yield the zip archive in chunks as it is built, e.g. for a streamed HTTP response."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w") as zf:
+        for _ in _write_entries(zf, tree, compression):
+            yield from sink.drain()
+    yield from sink.drain()
@@ -1,6 +1,5 @@
 import argparse
 import os
-import subprocess
 import shutil
 import tempfile
 import sys
@@ -8,6 +7,14 @@ import zipfile
 import json
 import re
 
+import template_cache
+from mod_archive import VirtualTree, write_zip
+from rewriter import Rewriter, rewrite_file
+
+DEFAULT_MC_VERSION = "1.21.11"
+# Fabric's rule for mod ids; also keeps an id safe to use as a file name
+MOD_ID_RE = re.compile(r"^[a-z][a-z0-9_-]{1,63}$")
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Generate a Minecraft Fabric 1.21.11 Mod with Mojang Mappings")
     parser.add_argument("mod_id", help="The mod ID (e.g., mymod)")
@@ -15,38 +22,43 @@ def parse_args():
     parser.add_argument("description", help="The mod description")
     parser.add_argument("package_name", help="The package name (e.g., com.example.mymod)")
     parser.add_argument("--output", default=".", help="Output directory for the zip file")
+    parser.add_argument("--mc", default=DEFAULT_MC_VERSION, help="Minecraft version written to gradle.properties")
+    parser.add_argument("--template-url", default=template_cache.TEMPLATE_URL, help="Git URL of the example mod template")
+    parser.add_argument("--template-ref", default=template_cache.DEFAULT_BRANCH, help="Template branch or commit")
+    parser.add_argument("--cache-dir", default=template_cache.CACHE_DIR, help="Where cached template snapshots live")
+    parser.add_argument("--offline", action="store_true", help="Only use the cached template, never touch the network")
+    parser.add_argument("--refresh-template", action="store_true", help="Fetch the latest template before generating")
+    parser.add_argument("--direct", action="store_true", help="Build the zip straight from the cached template, without a temp dir")
+    parser.add_argument("--zip-level", type=int, default=6, help="Deflate level for compressed entries (--direct only)")
+    parser.add_argument("--store-ext", default=".png,.jar,.zip,.ogg", help="Comma-separated suffixes stored uncompressed (--direct only)")
     return parser.parse_args()
 
-def clone_template(temp_dir):
-    print("Cloning fabric-example-mod (1.21 branch)...")
-    subprocess.run([
-        "git", "clone", "--branch", "1.21", "--depth", "1",
-        "https://github.com/FabricMC/fabric-example-mod.git",
-        temp_dir
-    ], check=True)
-
-    # Remove the .git directory to sever the git history
-    git_dir = os.path.join(temp_dir, ".git")
-    if os.path.exists(git_dir):
-        shutil.rmtree(git_dir)
+def clone_template(temp_dir, ref=template_cache.DEFAULT_BRANCH, url=template_cache.TEMPLATE_URL,
+                   cache_dir=template_cache.CACHE_DIR, offline=False):
+    # The template comes from a local snapshot (see template_cache.py); the
+    # network is only used the first time a branch is needed. Snapshots are
+    # git archives, so there is no .git directory to strip.
+    snapshot = template_cache.snapshot(ref, offline=offline, url=url, cache_dir=cache_dir)
+    print(f"Copying fabric-example-mod ({ref}) from {snapshot}...")
+    template_cache.materialize(snapshot, temp_dir)
+
+def gradle_properties_text(content, mod_id, package_name, mc_version=DEFAULT_MC_VERSION):
+    content = re.sub(r'minecraft_version=.*', f'minecraft_version={mc_version}', content)
+    content = re.sub(r'maven_group=.*', f'maven_group={package_name}', content)
+    content = re.sub(r'archives_base_name=.*', f'archives_base_name={mod_id}', content)
+    return content
 
-def update_gradle_properties(temp_dir, mod_id, package_name):
+def update_gradle_properties(temp_dir, mod_id, package_name, mc_version=DEFAULT_MC_VERSION):
     prop_file = os.path.join(temp_dir, "gradle.properties")
     with open(prop_file, "r") as f:
         content = f.read()
 
-    content = re.sub(r'minecraft_version=.*', r'minecraft_version=1.21.11', content)
-    content = re.sub(r'maven_group=.*', f'maven_group={package_name}', content)
-    content = re.sub(r'archives_base_name=.*', f'archives_base_name={mod_id}', content)
+    content = gradle_properties_text(content, mod_id, package_name, mc_version)
 
     with open(prop_file, "w") as f:
         f.write(content)
 
-def update_build_gradle(temp_dir):
-    build_file = os.path.join(temp_dir, "build.gradle")
-    with open(build_file, "r") as f:
-        content = f.read()
-
+def build_gradle_text(content):
     # Ensure mappings use Mojang Mappings
     if 'mappings loom.officialMojangMappings()' not in content:
         # If it uses yarn or something else, replace it
@@ -55,14 +67,20 @@ def update_build_gradle(temp_dir):
             r'mappings loom.officialMojangMappings()',
             content
         )
+    return content
+
+def update_build_gradle(temp_dir):
+    build_file = os.path.join(temp_dir, "build.gradle")
+    with open(build_file, "r") as f:
+        content = f.read()
+
+    content = build_gradle_text(content)
 
     with open(build_file, "w") as f:
         f.write(content)
 
-def update_fabric_mod_json(temp_dir, mod_id, mod_name, description):
-    json_file = os.path.join(temp_dir, "src", "main", "resources", "fabric.mod.json")
-    with open(json_file, "r") as f:
-        data = json.load(f)
+def fabric_mod_json_text(content, mod_id, mod_name, description):
+    data = json.loads(content)
 
     data["id"] = mod_id
     data["name"] = mod_name
@@ -76,60 +94,73 @@ def update_fabric_mod_json(temp_dir, mod_id, mod_name, description):
     # Update entrypoints points to use the new package
     # We will handle package replacement globally as well, but let's update this safely
 
-    with open(json_file, "w") as f:
-        json.dump(data, f, indent=2)
+    return json.dumps(data, indent=2)
 
-def replace_in_files(temp_dir, mod_id, mod_name, package_name):
-    # Find all java files and fabric.mod.json and mixin configs
-    old_package = "com.example" # Default in fabric-example-mod
-    old_mod_id = "modid"
+def update_fabric_mod_json(temp_dir, mod_id, mod_name, description):
+    json_file = os.path.join(temp_dir, "src", "main", "resources", "fabric.mod.json")
+    with open(json_file, "r") as f:
+        content = f.read()
+
+    content = fabric_mod_json_text(content, mod_id, mod_name, description)
 
+    with open(json_file, "w") as f:
+        f.write(content)
+
+def java_class_name(mod_name):
     # Sanitize the mod name to create a valid Java class name
     class_name = re.sub(r'[^a-zA-Z0-9_]', '', mod_name)
     if not class_name or class_name[0].isdigit():
         class_name = "Mod" + class_name
+    return class_name
+
+def template_rewriters(mod_id, mod_name, package_name):
+    """(general rewriter, fabric.mod.json rewriter) for the example mod's identifiers."""
+    old_package = "com.example" # Default in fabric-example-mod
+    old_mod_id = "modid"
+    class_name = java_class_name(mod_name)
+
+    # Longest literal wins, so ExampleModClient is never split into ExampleMod + Client
+    general = Rewriter({
+        old_package: package_name,
+        f'"{old_mod_id}"': f'"{mod_id}"', # Replace "modid" carefully
+        f'{old_mod_id}:': f'{mod_id}:', # Resource locations
+        f'assets/{old_mod_id}': f'assets/{mod_id}', # asset paths
+        "ExampleModClient": f"{class_name}Client",
+        "ExampleMod": class_name,
+    })
+    # Mixin config names only appear as references in fabric.mod.json
+    mod_json = general.extend({
+        f"{old_mod_id}.mixins.json": f"{mod_id}.mixins.json",
+        f"{old_mod_id}.client.mixins.json": f"{mod_id}.client.mixins.json",
+    })
+    return general, mod_json
 
+def replace_in_files(temp_dir, mod_id, mod_name, package_name):
+    """Rewrite identifiers in every .java/.json file; returns {relative path: substitutions}."""
+    general, mod_json = template_rewriters(mod_id, mod_name, package_name)
+
+    changes = {}
     for root, dirs, files in os.walk(temp_dir):
         for file in files:
             if file.endswith(".java") or file.endswith(".json"):
                 filepath = os.path.join(root, file)
+                rewriter = mod_json if file == "fabric.mod.json" else general
                 try:
-                    with open(filepath, "r") as f:
-                        content = f.read()
-
-                    # Update JSON configs for mixins and entrypoints
-                    if file == "fabric.mod.json":
-                        # Entrypoints
-                        content = content.replace(f"{old_package}.ExampleMod", f"{package_name}.{class_name}")
-                        content = content.replace(f"{old_package}.ExampleModClient", f"{package_name}.{class_name}Client")
-                        content = content.replace(f"{old_mod_id}.mixins.json", f"{mod_id}.mixins.json")
-                        content = content.replace(f"{old_mod_id}.client.mixins.json", f"{mod_id}.client.mixins.json")
-                    elif file.endswith(".mixins.json"):
-                        # Mixins package
-                        content = content.replace(f"{old_package}.mixin", f"{package_name}.mixin")
-
-                    content = content.replace(old_package, package_name)
-                    content = content.replace(f'"{old_mod_id}"', f'"{mod_id}"') # Replace "modid" carefully
-                    content = content.replace(f'{old_mod_id}:', f'{mod_id}:') # Resource locations
-                    content = content.replace(f'assets/{old_mod_id}', f'assets/{mod_id}') # asset paths
-                    content = content.replace(f'MOD_ID = "{old_mod_id}"', f'MOD_ID = "{mod_id}"') # java constant
-
-                    # Handle ExampleMod renaming, being careful not to replace part of ExampleModClient if we do ExampleMod first
-                    content = content.replace("ExampleModClient", f"{class_name}Client")
-                    content = content.replace("ExampleMod", class_name)
-
-                    with open(filepath, "w") as f:
-                        f.write(content)
-                except Exception as e:
-                    pass
+                    count = rewrite_file(filepath, rewriter)
+                except UnicodeDecodeError as e:
+                    print(f"Skipping {filepath}: not valid text ({e})")
+                    continue
+                if count:
+                    changes[os.path.relpath(filepath, temp_dir)] = count
+
+    for path, count in sorted(changes.items()):
+        print(f"  {path}: {count} replacement(s)")
+    return changes
 
 def move_package_dirs(temp_dir, mod_id, mod_name, package_name):
     old_package_path = os.path.join("com", "example")
     new_package_path = os.path.join(*package_name.split("."))
-
-    class_name = re.sub(r'[^a-zA-Z0-9_]', '', mod_name)
-    if not class_name or class_name[0].isdigit():
-        class_name = "Mod" + class_name
+    class_name = java_class_name(mod_name)
 
     for source_dir in ["main", "client"]:
         java_dir = os.path.join(temp_dir, "src", source_dir, "java")
@@ -162,6 +193,76 @@ def move_package_dirs(temp_dir, mod_id, mod_name, package_name):
                         new_file = file.replace("ExampleMod", class_name)
                         shutil.move(os.path.join(root, file), os.path.join(root, new_file))
 
+def rename_resources(temp_dir, mod_id):
+    # Rename mixin config file
+    mixin_file = os.path.join(temp_dir, "src", "main", "resources", "fabric-example-mod.mixins.json")
+    if not os.path.exists(mixin_file):
+        mixin_file = os.path.join(temp_dir, "src", "main", "resources", "modid.mixins.json")
+    if os.path.exists(mixin_file):
+        new_mixin_file = os.path.join(temp_dir, "src", "main", "resources", f"{mod_id}.mixins.json")
+        shutil.move(mixin_file, new_mixin_file)
+
+    client_mixin_file = os.path.join(temp_dir, "src", "client", "resources", "fabric-example-mod.client.mixins.json")
+    if not os.path.exists(client_mixin_file):
+        client_mixin_file = os.path.join(temp_dir, "src", "client", "resources", "modid.client.mixins.json")
+    if os.path.exists(client_mixin_file):
+        new_client_mixin_file = os.path.join(temp_dir, "src", "client", "resources", f"{mod_id}.client.mixins.json")
+        shutil.move(client_mixin_file, new_client_mixin_file)
+
+    # Rename assets folder
+    assets_dir = os.path.join(temp_dir, "src", "main", "resources", "assets", "fabric-example-mod")
+    if not os.path.exists(assets_dir):
+        assets_dir = os.path.join(temp_dir, "src", "main", "resources", "assets", "modid")
+    if os.path.exists(assets_dir):
+        new_assets_dir = os.path.join(temp_dir, "src", "main", "resources", "assets", mod_id)
+        shutil.move(assets_dir, new_assets_dir)
+
+def template_path_mapper(mod_id, mod_name, package_name):
+    """Path-only equivalent of move_package_dirs plus main()'s mixin/asset renames."""
+    new_package = "/".join(package_name.split("."))
+    class_name = java_class_name(mod_name)
+    renamed = {}
+    for old in ("fabric-example-mod", "modid"):
+        renamed[f"src/main/resources/{old}.mixins.json"] = f"src/main/resources/{mod_id}.mixins.json"
+        renamed[f"src/client/resources/{old}.client.mixins.json"] = f"src/client/resources/{mod_id}.client.mixins.json"
+
+    def remap(path):
+        if path in renamed:
+            return renamed[path]
+        for old in ("fabric-example-mod", "modid"):
+            prefix = f"src/main/resources/assets/{old}/"
+            if path.startswith(prefix):
+                return f"src/main/resources/assets/{mod_id}/" + path[len(prefix):]
+        for source_dir in ("main", "client"):
+            prefix = f"src/{source_dir}/java/com/example/"
+            if path.startswith(prefix):
+                rest = path[len(prefix):]
+                head, _, name = rest.rpartition("/")
+                if name.startswith("ExampleMod"):
+                    name = name.replace("ExampleMod", class_name)
+                return f"src/{source_dir}/java/{new_package}/" + (f"{head}/{name}" if head else name)
+        return path
+    return remap
+
+def template_tree(snapshot, mod_id, mod_name, description, package_name, mc_version=DEFAULT_MC_VERSION):
+    """The generated mod as a VirtualTree over the template snapshot; nothing is copied."""
+    general, mod_json = template_rewriters(mod_id, mod_name, package_name)
+    tree = VirtualTree.from_directory(snapshot)
+
+    tree.rewrite(lambda text: gradle_properties_text(text, mod_id, package_name, mc_version), lambda p: p == "gradle.properties")
+    tree.rewrite(build_gradle_text, lambda p: p == "build.gradle")
+    tree.rewrite(lambda text: fabric_mod_json_text(text, mod_id, mod_name, description),
+                 lambda p: p == "src/main/resources/fabric.mod.json")
+    is_mod_json = lambda p: p.rpartition("/")[2] == "fabric.mod.json"
+    tree.rewrite(lambda text: mod_json.apply(text)[0], is_mod_json)
+    tree.rewrite(lambda text: general.apply(text)[0], lambda p: p.endswith((".java", ".json")) and not is_mod_json(p))
+    tree.rename(template_path_mapper(mod_id, mod_name, package_name))
+    return tree
+
+def build_archive(snapshot, out, mod_id, mod_name, description, package_name, compression=None, mc_version=DEFAULT_MC_VERSION):
+    """Write the mod zip straight from the template snapshot to a path or file object."""
+    write_zip(template_tree(snapshot, mod_id, mod_name, description, package_name, mc_version), out, compression)
+
 def main():
     args = parse_args()
     print(f"Mod ID: {args.mod_id}")
@@ -169,39 +270,39 @@ def main():
     print(f"Description: {args.description}")
     print(f"Package: {args.package_name}")
 
+    if args.refresh_template:
+        if args.offline:
+            sys.exit("--refresh-template and --offline cannot be used together")
+        template_cache.refresh(args.template_ref, args.template_url, args.cache_dir)
+
+    if args.direct:
+        try:
+            snapshot = template_cache.snapshot(args.template_ref, offline=args.offline, url=args.template_url, cache_dir=args.cache_dir)
+        except template_cache.TemplateCacheError as e:
+            sys.exit(str(e))
+        compression = {"*": (zipfile.ZIP_DEFLATED, args.zip_level)}
+        for ext in filter(None, args.store_ext.split(",")):
+            compression[ext.strip().lower()] = (zipfile.ZIP_STORED, None)
+        zip_filepath = os.path.join(args.output, f"{args.mod_id}.zip")
+        print(f"Writing {zip_filepath} from {snapshot}...")
+        build_archive(snapshot, zip_filepath, args.mod_id, args.mod_name, args.description, args.package_name, compression, args.mc)
+        print("Zipping complete.")
+        return
+
     with tempfile.TemporaryDirectory() as temp_dir:
-        clone_template(temp_dir)
-        print("Cloned successfully.")
+        try:
+            clone_template(temp_dir, args.template_ref, args.template_url, args.cache_dir, args.offline)
+        except template_cache.TemplateCacheError as e:
+            sys.exit(str(e))
+        print("Template ready.")
 
         # Apply updates
-        update_gradle_properties(temp_dir, args.mod_id, args.package_name)
+        update_gradle_properties(temp_dir, args.mod_id, args.package_name, args.mc)
         update_build_gradle(temp_dir)
         update_fabric_mod_json(temp_dir, args.mod_id, args.mod_name, args.description)
         replace_in_files(temp_dir, args.mod_id, args.mod_name, args.package_name)
         move_package_dirs(temp_dir, args.mod_id, args.mod_name, args.package_name)
-
-        # Rename mixin config file
-        mixin_file = os.path.join(temp_dir, "src", "main", "resources", "fabric-example-mod.mixins.json")
-        if not os.path.exists(mixin_file):
-            mixin_file = os.path.join(temp_dir, "src", "main", "resources", "modid.mixins.json")
-        if os.path.exists(mixin_file):
-            new_mixin_file = os.path.join(temp_dir, "src", "main", "resources", f"{args.mod_id}.mixins.json")
-            shutil.move(mixin_file, new_mixin_file)
-
-        client_mixin_file = os.path.join(temp_dir, "src", "client", "resources", "fabric-example-mod.client.mixins.json")
-        if not os.path.exists(client_mixin_file):
-            client_mixin_file = os.path.join(temp_dir, "src", "client", "resources", "modid.client.mixins.json")
-        if os.path.exists(client_mixin_file):
-            new_client_mixin_file = os.path.join(temp_dir, "src", "client", "resources", f"{args.mod_id}.client.mixins.json")
-            shutil.move(client_mixin_file, new_client_mixin_file)
-
-        # Rename assets folder
-        assets_dir = os.path.join(temp_dir, "src", "main", "resources", "assets", "fabric-example-mod")
-        if not os.path.exists(assets_dir):
-            assets_dir = os.path.join(temp_dir, "src", "main", "resources", "assets", "modid")
-        if os.path.exists(assets_dir):
-            new_assets_dir = os.path.join(temp_dir, "src", "main", "resources", "assets", args.mod_id)
-            shutil.move(assets_dir, new_assets_dir)
+        rename_resources(temp_dir, args.mod_id)
 
         print("Mod files generated successfully.")
 
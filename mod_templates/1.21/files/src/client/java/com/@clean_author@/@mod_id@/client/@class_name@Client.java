@@ -0,0 +1,9 @@
+package com.@clean_author@.@mod_id@.client;
+
+import net.fabricmc.api.ClientModInitializer;
+
+public class @class_name@Client implements ClientModInitializer {
+	@Override
+	public void onInitializeClient() {
+	}
+}
@@ -0,0 +1,15 @@
+package com.@clean_author@.@mod_id@;
+
+import net.fabricmc.api.ModInitializer;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+public class @class_name@ implements ModInitializer {
+	public static final String MOD_ID = "@mod_id@";
+	public static final Logger LOGGER = LoggerFactory.getLogger(MOD_ID);
+
+	@Override
+	public void onInitialize() {
+		LOGGER.info("Hello Fabric world!");
+	}
+}
@@ -0,0 +1,548 @@
+"""Provider adapters: one class per upstream API behind a common interface.
+
+Every adapter offers
+
+    generate(prompt, output_format, stream=False, redirect=False) -> (audio, content_type)
+    async agenerate(prompt, output_format) -> (audio bytes, content_type)
+
+where audio is bytes, a chunk iterator (stream=True, if the adapter can
+stream) or an AssetRedirect (redirect=True, if it serves files by URL), and
+declares what it can do:
+
+    group            admission-control group; models of one provider share its limits
+    formats          formats the provider can be asked for; anything else is
+                     requested as formats[0] and transcoded (empty: pass it through)
+    streaming        generate(stream=True) returns the body as it arrives
+    assets           the result is a file URL fetched in a second hop
+    max_concurrency  default concurrent generations per worker (LIMIT_* overrides)
+    configured       has the keys it needs (model "auto" skips it otherwise)
+    params           what besides prompt and format changes the result (cache key)
+
+The app looks adapters up in a Registry by model key, so caching, coalescing,
+admission control, streaming and tracing apply to every provider alike.
+"""
+import abc
+import asyncio
+import contextvars
+import io
+import os
+import time
+import wave
+from concurrent.futures import wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+
+import tracing
+import upstream
+from key_pool import KEY_STATUSES
+
+
+class GenerationError(Exception):
+    def __init__(self, message, status=500, headers=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.headers = headers or {}
+
+
+class AssetRedirect:
+    # generate(redirect=True): the client can fetch the provider's file itself
+    def __init__(self, url):
+        self.url = url
+
+
+def asset_format(url):
+    return os.path.splitext(urlsplit(url).path)[1].lstrip(".").lower()
+
+
+def is_request_error(response):
+    # A bad request fails the same way on every key, so there is no point going on
+    return response is not None and response.status_code < 500 and response.status_code not in KEY_STATUSES
+
+
+class Adapter(abc.ABC):
+    group = None
+    formats = ()
+    streaming = True
+    assets = False
+    max_concurrency = 0
+    params = {}
+
+    @property
+    def configured(self):
+        return True
+
+    def upstream_format(self, output_format):
+        if not self.formats or output_format in self.formats:
+            return output_format
+        return self.formats[0]
+
+    def capabilities(self):
+        return {
+            "group": self.group,
+            "formats": list(self.formats),
+            "streaming": self.streaming,
+            "assets": self.assets,
+            "max_concurrency": self.max_concurrency,
+            "configured": self.configured,
+        }
+
+    @abc.abstractmethod
+    def generate(self, prompt, output_format, stream=False, redirect=False):
+        ...
+
+    @abc.abstractmethod
+    async def agenerate(self, prompt, output_format):
+        ...
+
+
+def read_response(response, stream):
+    # Common tail of a successful call: the body whole, or as chunks when streaming
+    content_type = response.headers.get("Content-Type")
+    if stream:
+        return upstream.iter_body(response), content_type
+    if not response.content: raise GenerationError("No data received", 500)
+    return response.content, content_type
+
+
+# ==========================================
+# STABLE AUDIO (SINGLE MASTER KEY)
+# ==========================================
+def stability_request(api_key, model, prompt, output_format):
+    # (url, kwargs); the kwargs work for requests and httpx alike
+    api_url = f"{upstream.STABILITY_API}/v2beta/audio/{model}/text-to-audio"
+    headers = {"Authorization": f"Bearer {api_key}", "Accept": "audio/*"}
+
+    body = {
+        "prompt": prompt,
+        "model": model,
+        "output_format": output_format
+    }
+    files = {"none": ""}
+    return api_url, {"headers": headers, "data": body, "files": files}
+
+
+class StabilityAdapter(Adapter):
+    group = "stability"
+    formats = ("mp3", "wav")
+    max_concurrency = 16
+
+    def __init__(self, api_key, model="stable-audio-2"):
+        self.api_key = api_key
+        self.model = model
+        self.params = {"model": model}
+
+    @property
+    def configured(self):
+        return bool(self.api_key)
+
+    def _request(self, prompt, output_format):
+        if not self.api_key:
+            raise GenerationError("Master Key (STABILTY_AI) is missing.", 500)
+        return stability_request(self.api_key, self.model, prompt, self.upstream_format(output_format))
+
+    def generate(self, prompt, output_format, stream=False, redirect=False):
+        api_url, kwargs = self._request(prompt, output_format)
+        try:
+            response = upstream.post(api_url, stream=stream, **kwargs)
+        except Exception as e:
+            raise GenerationError(str(e), 500)
+        if response.status_code != 200:
+            raise GenerationError(f"Stability Error: {response.text}", response.status_code)
+        return read_response(response, stream)
+
+    async def agenerate(self, prompt, output_format):
+        api_url, kwargs = self._request(prompt, output_format)
+        try:
+            response = await upstream.async_client().post(api_url, **kwargs)
+        except Exception as e:
+            raise GenerationError(str(e), 500)
+        if response.status_code != 200:
+            raise GenerationError(f"Stability Error: {response.text}", response.status_code)
+        return read_response(response, False)
+
+
+# ==========================================
+# STABLE AUDIO (INFINITE POOL CYCLE)
+# ==========================================
+class StabilityPoolAdapter(StabilityAdapter):
+    """Stable Audio over the STABILITY_KEY_* pool, healthiest key first.
+
+    With hedge on, if the first key hasn't answered within the pool's recent
+    hedge_percentile latency, the same request goes to the next healthy key
+    and whichever succeeds first wins; hedge_max_extra caps the extra calls
+    (and credits) a single request may spend on hedges.
+    """
+
+    def __init__(self, pool, keys, model="stable-audio-2.5", metrics=None, hedge=False,
+                 hedge_percentile=95, hedge_delay=20, hedge_max_extra=1, executor=None):
+        super().__init__(None, model)
+        self.pool = pool
+        self.keys = keys
+        self.metrics = metrics
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay  # until the pool has enough samples
+        self.hedge_max_extra = hedge_max_extra
+        self.executor = executor
+
+    @property
+    def configured(self):
+        return bool(self.pool)
+
+    def candidates(self):
+        if not self.pool:
+            raise GenerationError("No pool keys (STABILITY_KEY_1...) found.", 500)
+
+        candidates = self.pool.candidates()
+        if not candidates:
+            retry_in = int(self.pool.next_available_in() or 0) + 1
+            raise GenerationError(f"All {len(self.pool)} pool keys are cooling down. Try again in {retry_in}s.", 503, {"Retry-After": str(retry_in)})
+        return candidates
+
+    def refresh_credits(self):
+        # Ask Stability for each key's balance so exhausted keys are skipped up front
+        for index, api_key in enumerate(self.keys):
+            try:
+                response = upstream.get(f"{upstream.STABILITY_API}/v1/user/balance", headers={"Authorization": f"Bearer {api_key}"})
+                if response.status_code == 200:
+                    self.pool.set_credits(index, response.json().get("credits"))
+                elif response.status_code in KEY_STATUSES:
+                    self.pool.report_failure(index, response.status_code, response.text)
+            except Exception as e:
+                print(f"⚠️ Balance check failed for Key #{index+1}: {e}")
+
+    def _report(self, index, started, response):
+        # Feed one call's outcome back into the pool; returns (response, error text or None)
+        if response.status_code == 200:
+            print(f"✅ Success on Key #{index+1}")
+            self.pool.report_success(index, time.time() - started)
+            return response, None
+
+        print(f"❌ Key #{index+1} Failed: {response.status_code}")
+        self.pool.report_failure(index, response.status_code, response.text)
+        return response, response.text
+
+    def _attempted(self, attempts):
+        if self.metrics:
+            self.metrics.observe("sonicforge_pool_attempts", attempts)
+        tracing.current().set(pool_attempts=attempts)
+
+    def try_key(self, index, api_key, prompt, output_format, stream=False):
+        # One upstream call on one key. Returns (response or None, error text or None).
+        print(f"🔄 [Pool] Trying Key #{index+1}...")
+        with tracing.span("pool_attempt", key=index + 1) as span:
+            started = time.time()
+            try:
+                api_url, kwargs = stability_request(api_key, self.model, prompt, output_format)
+                response = upstream.post(api_url, stream=stream, **kwargs)
+            except Exception as e:
+                print(f"⚠️ Key #{index+1} Error: {e}")
+                span["error"] = type(e).__name__
+                self.pool.report_failure(index, None, str(e))
+                return None, str(e)
+            span["status"] = response.status_code
+            return self._report(index, started, response)
+
+    async def atry_key(self, index, api_key, prompt, output_format):
+        print(f"🔄 [Pool] Trying Key #{index+1}...")
+        with tracing.span("pool_attempt", key=index + 1) as span:
+            started = time.time()
+            try:
+                api_url, kwargs = stability_request(api_key, self.model, prompt, output_format)
+                response = await upstream.async_client().post(api_url, **kwargs)
+            except Exception as e:
+                err = str(e) or type(e).__name__  # httpx errors often have no message
+                print(f"⚠️ Key #{index+1} Error: {err}")
+                span["error"] = type(e).__name__
+                self.pool.report_failure(index, None, err)
+                return None, err
+            span["status"] = response.status_code
+            return self._report(index, started, response)
+
+    def generate(self, prompt, output_format, stream=False, redirect=False):
+        candidates = self.candidates()
+        output_format = self.upstream_format(output_format)
+        # No hedging for streams: a losing hedge would hold its unread body open
+        if self.hedge and not stream:
+            response = self._generate_hedged(candidates, prompt, output_format)
+        else:
+            response = self._generate(candidates, prompt, output_format, stream)
+        return read_response(response, stream)
+
+    def _generate(self, candidates, prompt, output_format, stream):
+        last_err = ""
+        attempts = 0
+
+        try:
+            # Healthiest keys first; dead and rate-limited keys are skipped
+            for index, api_key in candidates:
+                attempts += 1
+                response, err = self.try_key(index, api_key, prompt, output_format, stream)
+                if err is None:
+                    return response
+                last_err = err
+                if is_request_error(response):
+                    raise GenerationError(f"Stability Error: {response.text}", response.status_code)
+        finally:
+            self._attempted(attempts)
+
+        raise GenerationError(f"All {len(candidates)} available keys failed. Last: {last_err}", 500)
+
+    def _generate_hedged(self, candidates, prompt, output_format):
+        remaining = iter(candidates)
+        pending = {}
+        attempts = 0
+        extra = 0
+        last_err = ""
+        delay = self.pool.latency_percentile(self.hedge_percentile) or self.hedge_delay
+
+        def launch():
+            nonlocal attempts
+            for index, api_key in remaining:
+                # copy_context so the hedge's pool_attempt span lands in this request's trace
+                pending[self.executor.submit(contextvars.copy_context().run, self.try_key, index, api_key, prompt, output_format)] = index
+                attempts += 1
+                return True
+            return False
+
+        try:
+            launch()
+            while pending:
+                can_hedge = extra < self.hedge_max_extra
+                done, _ = wait(pending, timeout=delay if can_hedge else None, return_when=FIRST_COMPLETED)
+                if not done:
+                    # Slower than usual: race another key against the one in flight
+                    if launch():
+                        extra += 1
+                        print(f"🏁 [Pool] Hedging after {delay:.1f}s ({extra}/{self.hedge_max_extra})")
+                    else:
+                        extra = self.hedge_max_extra
+                    continue
+
+                for future in done:
+                    pending.pop(future)
+                    response, err = future.result()
+                    if err is None:
+                        # Losers keep running in the background and still report to the pool
+                        return response
+                    last_err = err
+                    if is_request_error(response):
+                        raise GenerationError(f"Stability Error: {response.text}", response.status_code)
+                    # Replace the failed call; this is failover, not extra hedge spend
+                    launch()
+        finally:
+            self._attempted(attempts)
+
+        raise GenerationError(f"All {len(candidates)} available keys failed. Last: {last_err}", 500)
+
+    async def agenerate(self, prompt, output_format):
+        candidates = self.candidates()
+        output_format = self.upstream_format(output_format)
+        last_err = ""
+        attempts = 0
+
+        try:
+            for index, api_key in candidates:
+                attempts += 1
+                response, err = await self.atry_key(index, api_key, prompt, output_format)
+                if err is None:
+                    return read_response(response, False)
+                last_err = err
+                if is_request_error(response):
+                    raise GenerationError(f"Stability Error: {response.text}", response.status_code)
+        finally:
+            self._attempted(attempts)
+
+        raise GenerationError(f"All {len(candidates)} available keys failed. Last: {last_err}", 500)
+
+
+# ==========================================
+# UDIO AI
+# ==========================================
+class UdioAdapter(Adapter):
+    group = "udio"
+    assets = True
+    max_concurrency = 8
+    params = {"is_instrumental": False}
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    @property
+    def configured(self):
+        return bool(self.api_key)
+
+    def _request(self, prompt, output_format):
+        if not self.api_key: raise GenerationError("Udio Key missing", 500)
+        api_url = f"{upstream.UDIO_API}/v1/generate"
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        payload = {"prompt": prompt, "is_instrumental": False, "format": self.upstream_format(output_format)}
+        return api_url, {"headers": headers, "json": payload}
+
+    def generate(self, prompt, output_format, stream=False, redirect=False):
+        api_url, kwargs = self._request(prompt, output_format)
+        try:
+            response = upstream.post(api_url, stream=stream, **kwargs)
+            if response.status_code != 200:
+                raise GenerationError(response.text, 500)
+            if "application/json" not in response.headers.get("Content-Type", ""):
+                return read_response(response, stream)
+
+            # Second hop: the file itself, streamed over the pooled session (ranged + parallel when large)
+            audio_url = response.json()['audio_url']
+            if redirect and urlsplit(audio_url).scheme in ("http", "https") and asset_format(audio_url) == output_format:
+                return AssetRedirect(audio_url), None
+            if stream:
+                return upstream.download(audio_url)
+            with tracing.span("udio_fetch") as span:
+                chunks, content_type = upstream.download(audio_url)
+                audio_bytes = b"".join(chunks)
+                span["bytes"] = len(audio_bytes)
+        except GenerationError:
+            raise
+        except Exception as e:
+            raise GenerationError(str(e), 500)
+        if not audio_bytes: raise GenerationError("No data received", 500)
+        return audio_bytes, content_type
+
+    async def agenerate(self, prompt, output_format):
+        api_url, kwargs = self._request(prompt, output_format)
+        try:
+            response = await upstream.async_client().post(api_url, **kwargs)
+            if response.status_code != 200:
+                raise GenerationError(response.text, 500)
+            if "application/json" not in response.headers.get("Content-Type", ""):
+                return read_response(response, False)
+            with tracing.span("udio_fetch") as span:
+                audio_bytes, content_type = await upstream.async_download(response.json()['audio_url'])
+                span["bytes"] = len(audio_bytes)
+        except GenerationError:
+            raise
+        except Exception as e:
+            raise GenerationError(str(e), 500)
+        if not audio_bytes: raise GenerationError("No data received", 500)
+        return audio_bytes, content_type
+
+
+# ==========================================
+# HUGGINGFACE (MusicGen / Riffusion)
+# ==========================================
+class HuggingFaceAdapter(Adapter):
+    # The inference API takes no format; whatever it returns is transcoded as needed
+    group = "hf"
+    max_concurrency = 4
+
+    def __init__(self, url, token):
+        self.url = url
+        self.token = token
+        self.params = {"url": url}
+
+    @property
+    def configured(self):
+        return bool(self.token)
+
+    def _request(self, prompt):
+        return self.url, {"headers": {"Authorization": f"Bearer {self.token}"}, "json": {"inputs": prompt}}
+
+    def generate(self, prompt, output_format, stream=False, redirect=False):
+        api_url, kwargs = self._request(prompt)
+        try:
+            response = upstream.post(api_url, stream=stream, **kwargs)
+        except Exception as e:
+            raise GenerationError(str(e), 500)
+        if response.status_code != 200:
+            raise GenerationError(f"HF Error: {response.text}", 503)
+        return read_response(response, stream)
+
+    async def agenerate(self, prompt, output_format):
+        api_url, kwargs = self._request(prompt)
+        try:
+            response = await upstream.async_client().post(api_url, **kwargs)
+        except Exception as e:
+            raise GenerationError(str(e), 500)
+        if response.status_code != 200:
+            raise GenerationError(f"HF Error: {response.text}", 503)
+        return read_response(response, False)
+
+
+# ==========================================
+# FAKE (local, for load tests)
+# ==========================================
+class FakeAdapter(Adapter):
+    """Silent WAV after a fixed delay, generated in-process: no network, no credits.
+
+    Enough to load-test the server's own overhead (caching, admission,
+    transcoding, streaming) without a fake HTTP provider in the loop.
+    """
+    group = "fake"
+    formats = ("wav",)
+    max_concurrency = 64
+
+    def __init__(self, latency=0.5, seconds=5.0, stream_seconds=0.0, chunk_bytes=64 * 1024):
+        self.latency = latency
+        self.seconds = seconds
+        self.stream_seconds = stream_seconds  # spread the body over this long when streaming
+        self.chunk_bytes = chunk_bytes
+        self.params = {"seconds": seconds}
+        self._audio = None
+
+    def audio(self):
+        if self._audio is None:
+            buf = io.BytesIO()
+            with wave.open(buf, "wb") as w:
+                w.setnchannels(1)
+                w.setsampwidth(2)
+                w.setframerate(44100)
+                w.writeframes(b"\x00\x00" * int(44100 * self.seconds))
+            self._audio = buf.getvalue()
+        return self._audio
+
+    def _chunks(self, audio):
+        pieces = range(0, len(audio), self.chunk_bytes)
+        pause = self.stream_seconds / max(len(pieces), 1)
+        for start in pieces:
+            yield audio[start:start + self.chunk_bytes]
+            if pause:
+                time.sleep(pause)
+
+    def generate(self, prompt, output_format, stream=False, redirect=False):
+        time.sleep(self.latency)
+        audio = self.audio()
+        return (self._chunks(audio) if stream else audio), "audio/wav"
+
+    async def agenerate(self, prompt, output_format):
+        await asyncio.sleep(self.latency)
+        return self.audio(), "audio/wav"
+
+
+class Registry:
+    """Model key -> Adapter."""
+
+    def __init__(self):
+        self._adapters = {}
+
+    def register(self, model_key, adapter):
+        self._adapters[model_key] = adapter
+        return adapter
+
+    def get(self, model_key):
+        return self._adapters.get(model_key)
+
+    def __getitem__(self, model_key):
+        adapter = self._adapters.get(model_key)
+        if adapter is None:
+            raise GenerationError("Invalid Model Selection", 400)
+        return adapter
+
+    def __contains__(self, model_key):
+        return model_key in self._adapters
+
+    def groups(self):
+        """{admission group: max_concurrency}; the first adapter registered for a group sets it."""
+        groups = {}
+        for adapter in self._adapters.values():
+            groups.setdefault(adapter.group, adapter.max_concurrency)
+        return groups
+
+    def describe(self):
+        return {model_key: adapter.capabilities() for model_key, adapter in self._adapters.items()}
@@ -0,0 +1,208 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+SWEEP_EVERY = 64  # puts between forced disk sweeps, so other workers' writes get counted
+TMP_GRACE_SECONDS = 3600  # a CacheWriter temp file untouched this long was left by a dead worker
+
+
+def normalize_prompt(prompt):
+    return " ".join(prompt.split()).casefold()
+
+
+def cache_key(model_key, prompt, output_format, params=None):
+    raw = json.dumps(
+        [model_key, normalize_prompt(prompt), output_format, params or {}],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Content-addressed cache of finished tracks.
+
+    Two tiers: a small per-process LRU in memory, and a directory on disk that
+    every gunicorn worker shares. Disk entries are written to a temp file and
+    renamed into place, and eviction runs under an flock, so concurrent
+    workers never see a torn file or evict each other's half-written entries.
+    """
+
+    def __init__(self, directory=None, memory_bytes=64 * 1024 * 1024, disk_bytes=1024 * 1024 * 1024):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "sonicforge-cache")
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_estimate = None
+        self._puts_since_sweep = 0
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.bin")
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def record_bypass(self):
+        self._count("bypassed")
+
+    def _remember(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_size -= len(old)
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, dropped = self._memory.popitem(last=False)
+                self._memory_size -= len(dropped)
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return data
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # keep recently used entries at the back of the eviction queue
+        except OSError:
+            self._count("misses")
+            return None
+
+        self._count("disk_hits")
+        self._remember(key, data)
+        return data
+
+    def contains(self, key):
+        """Whether key is cached, without counting a hit or miss."""
+        with self._lock:
+            if key in self._memory:
+                return True
+        return os.path.exists(self._path(key))
+
+    def put(self, key, data):
+        self._remember(key, data)
+        writer = self.writer(key)
+        try:
+            writer.write(data)
+        except OSError:
+            writer.abort()
+            return
+        writer.commit()
+
+    def writer(self, key):
+        """Incremental disk-only writer, for results that are streamed out."""
+        return CacheWriter(self, key)
+
+    def _stored(self, size):
+        self._count("stores")
+        with self._lock:
+            self._puts_since_sweep += 1
+            if self._disk_estimate is not None:
+                self._disk_estimate += size
+            due = (
+                self._disk_estimate is None
+                or self._disk_estimate > self.disk_bytes
+                or self._puts_since_sweep >= SWEEP_EVERY
+            )
+        if due:
+            self.sweep()
+
+    def sweep(self):
+        # Oldest-used first until the directory fits in disk_bytes again. Temp
+        # files of streams still being written count too; ones a killed worker
+        # left behind are removed
+        stale = time.time() - TMP_GRACE_SECONDS
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            total = 0
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    temp = name.endswith(".tmp")
+                    if not temp and not name.endswith(".bin"):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                        if temp and st.st_mtime < stale:
+                            os.remove(path)
+                            continue
+                    except OSError:
+                        continue
+                    if not temp:
+                        entries.append((st.st_mtime, st.st_size, path))
+                    total += st.st_size
+
+            evicted = 0
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.disk_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                evicted += 1
+
+        with self._lock:
+            self._disk_estimate = total
+            self._puts_since_sweep = 0
+            self.counters["evictions"] += evicted
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            counters["memory_entries"] = len(self._memory)
+            counters["memory_bytes"] = self._memory_size
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        counters["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+        return counters
+
+
+class CacheWriter:
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.path = cache._path(key)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, self.tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        self.file = os.fdopen(fd, "wb")
+        self.size = 0
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        try:
+            self.file.close()
+            os.replace(self.tmp, self.path)
+        except OSError:
+            self.abort()
+            return
+        self.cache._stored(self.size)
+
+    def abort(self):
+        try:
+            self.file.close()
+            os.remove(self.tmp)
+        except OSError:
+            pass
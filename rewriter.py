@@ -0,0 +1,57 @@
+import os
+import re
+import tempfile
+
+
+class Rewriter:
+    """Apply a table of literal substitutions to text in a single pass.
+
+    All literals are compiled into one alternation, longest first, so at any
+    position the longest literal wins (``ExampleModClient`` before
+    ``ExampleMod``) and replaced text is never re-scanned.
+    """
+
+    def __init__(self, replacements):
+        self.replacements = {old: new for old, new in replacements.items() if old}
+        literals = sorted(self.replacements, key=len, reverse=True)
+        self.pattern = re.compile("|".join(map(re.escape, literals))) if literals else None
+
+    def extend(self, replacements):
+        return Rewriter({**self.replacements, **replacements})
+
+    def apply(self, text):
+        """Return (new_text, number_of_substitutions)."""
+        if self.pattern is None:
+            return text, 0
+        return self.pattern.subn(lambda m: self.replacements[m.group(0)], text)
+
+    def apply_bytes(self, data, encoding="utf-8"):
+        text, count = self.apply(data.decode(encoding))
+        return (text.encode(encoding) if count else data), count
+
+
+def write_atomic(path, text):
+    # Write beside the target and swap it in. Replacing the directory entry
+    # (instead of truncating in place) also means a hardlinked template file
+    # is never modified through the link.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".rewrite-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        if os.path.exists(path):
+            os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def rewrite_file(path, rewriter):
+    """Rewrite one file in place; returns the substitution count (0 = untouched)."""
+    with open(path, "r") as f:
+        content = f.read()
+    new_content, count = rewriter.apply(content)
+    if count and new_content != content:
+        write_atomic(path, new_content)
+    return count
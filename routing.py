@@ -0,0 +1,112 @@
+import random
+import threading
+import time
+from collections import deque
+
+
+class Router:
+    """Rolling per-model outcomes, used to pick a provider for model "auto".
+
+    Models are ranked by expected seconds to a successful generation: the
+    median latency of recent successes divided by the recent success rate
+    (smoothed, so one failure doesn't sink a model and an untried one still
+    gets a turn). Outcomes older than `horizon` seconds are forgotten, so a
+    provider that was down is tried again once it has aged out, and an
+    `explore` fraction of requests puts a random other model first so the
+    statistics of models that are not winning stay current. Per process.
+    """
+
+    def __init__(self, window=50, horizon=300, prior_seconds=30.0, explore=0.05):
+        self.window = window
+        self.horizon = horizon
+        self.prior_seconds = prior_seconds  # latency assumed before a model has succeeded
+        self.explore = explore
+        self._outcomes = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_key, ok, seconds):
+        with self._lock:
+            outcomes = self._outcomes.setdefault(model_key, deque(maxlen=self.window))
+            outcomes.append((time.time(), ok, seconds))
+
+    def _recent(self, model_key, now):
+        # Callers hold the lock
+        outcomes = self._outcomes.get(model_key, ())
+        return [(ok, seconds) for at, ok, seconds in outcomes if now - at <= self.horizon]
+
+    def _stats(self, model_key, now):
+        recent = self._recent(model_key, now)
+        latencies = sorted(seconds for ok, seconds in recent if ok)
+        successes = len(latencies)
+        success_rate = (successes + 1) / (len(recent) + 2)
+        latency = latencies[len(latencies) // 2] if latencies else None
+        return {
+            "requests": len(recent),
+            "success_rate": round(success_rate, 4),
+            "p50_seconds": round(latency, 3) if latency is not None else None,
+            "expected_seconds": round((latency or self.prior_seconds) / success_rate, 3),
+        }
+
+    def expected_latency(self, model_key):
+        """Median seconds of recent successes, or None before there are any."""
+        with self._lock:
+            return self._stats(model_key, time.time())["p50_seconds"]
+
+    def ranked(self, models):
+        """`models` best first; ties keep the given order."""
+        now = time.time()
+        with self._lock:
+            cost = {model_key: self._stats(model_key, now)["expected_seconds"] for model_key in models}
+        ranked = sorted(models, key=cost.get)
+        if len(ranked) > 1 and random.random() < self.explore:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    def snapshot(self, models):
+        now = time.time()
+        with self._lock:
+            return {model_key: self._stats(model_key, now) for model_key in models}
+
+    def route(self, models, deadline):
+        """A Route over `models`, best first, with `deadline` seconds to succeed."""
+        return Route(self, self.ranked(models), deadline)
+
+
+class Route:
+    """One request's walk down the ranking; iterate it for the models to try.
+
+    A model is skipped once a previous attempt has failed and the time left
+    is shorter than its recent median latency, and iteration stops when the
+    deadline has passed. Every attempt is reported back with failed() or
+    succeeded(), which also feed the Router's statistics.
+    """
+
+    def __init__(self, router, models, deadline):
+        self.router = router
+        self.models = models
+        self.deadline = time.monotonic() + deadline
+        self.steps = []
+
+    def __iter__(self):
+        for model_key in self.models:
+            remaining = self.deadline - time.monotonic()
+            if self.steps and remaining <= 0:
+                return
+            expected = self.router.expected_latency(model_key)
+            if self.steps and expected is not None and expected > remaining:
+                self.steps.append(f"{model_key};skipped=deadline")
+                continue
+            yield model_key
+
+    def failed(self, model_key, status, seconds):
+        self.router.record(model_key, False, seconds)
+        self.steps.append(f"{model_key};status={status};dur={seconds * 1000:.0f}")
+
+    def succeeded(self, model_key, seconds, cached=False):
+        # A cache hit says nothing about the provider's health or speed
+        if not cached:
+            self.router.record(model_key, True, seconds)
+        self.steps.append(f"{model_key};status=200;dur={seconds * 1000:.0f}" + (";cache=hit" if cached else ""))
+
+    def header(self):
+        return ", ".join(self.steps)
@@ -1,8 +1,100 @@
+const POLL_INTERVAL_MS = 1500;
+const POLL_TIMEOUT_MS = 10 * 60 * 1000;
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+async function waitForJob(statusUrl) {
+    const deadline = Date.now() + POLL_TIMEOUT_MS;
+    while(true) {
+        if(Date.now() > deadline) {
+            throw new Error("The generation is taking too long. Please try again later.");
+        }
+        const response = await fetch(statusUrl);
+        const status = await response.json();
+        if(!response.ok) {
+            throw new Error(status.error || "Lost track of the generation job.");
+        }
+        if(status.status === 'done' || status.status === 'error') {
+            return status;
+        }
+        await sleep(POLL_INTERVAL_MS);
+    }
+}
+
+const AUDIO_TYPES = {mp3: 'audio/mpeg', wav: 'audio/wav'};
+
+// Bumped on every click, so a poll for an older track stops
+let generation = 0;
+
+function streamUrl(prompt, model, format, options = {}) {
+    const query = new URLSearchParams({prompt, model, format});
+    if(options.fresh) query.set('fresh', '1');
+    if(options.cached) query.set('cached', '1');
+    return `/stream?${query}`;
+}
+
+// A streamed track is cached by the server once its last chunk has gone out.
+// The cached=1 URL only ever serves that copy, so offering it for download
+// can't start a second generation. Resolves to it, or null if it never shows up.
+async function waitForCached(url, isCurrent) {
+    const deadline = Date.now() + POLL_TIMEOUT_MS;
+    while(isCurrent() && Date.now() < deadline) {
+        const response = await fetch(url, {method: 'HEAD'});
+        if(response.ok) {
+            return url;
+        }
+        if(response.status !== 404) {
+            return null;
+        }
+        await sleep(POLL_INTERVAL_MS);
+    }
+    return null;
+}
+
+// Progressive playback: the <audio> element fetches /stream itself and can
+// start playing as soon as the first chunk arrives. Resolves once it has data.
+function playStream(player, url) {
+    return new Promise((resolve, reject) => {
+        const done = () => {
+            player.removeEventListener('loadeddata', onData);
+            player.removeEventListener('error', onError);
+        };
+        const onData = () => { done(); resolve(); };
+        const onError = () => { done(); reject(new Error("The stream failed, the server may be busy. Please try again in a moment.")); };
+        player.addEventListener('loadeddata', onData);
+        player.addEventListener('error', onError);
+        player.src = url;
+        player.play().catch(() => {});  // autoplay can be refused; the controls still work
+    });
+}
+
+async function generateWithJob(prompt, model, format, fresh) {
+    // Queue the generation, then poll until the server has the track
+    const response = await fetch('/jobs', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({prompt, model, format, fresh})
+    });
+
+    const job = await response.json();
+    if(!response.ok) {
+        throw new Error(job.error || "Generation failed on server.");
+    }
+
+    const status = await waitForJob(job.status_url);
+    if(status.status === 'error') {
+        throw new Error(status.error || "Generation failed on server.");
+    }
+    return job.audio_url;
+}
+
 document.getElementById('generateBtn').addEventListener('click', async () => {
     const prompt = document.getElementById('promptInput').value;
     const model = document.getElementById('modelSelect').value;
     // Get selected radio button for format
     const format = document.querySelector('input[name="format"]:checked').value;
+    const fresh = document.getElementById('freshInput').checked;
+    const stream = document.getElementById('streamInput').checked;
     
     const loading = document.getElementById('loading');
     const result = document.getElementById('result');
@@ -23,28 +115,43 @@ document.getElementById('generateBtn').addEventListener('click', async () => {
     btn.disabled = true;
     btn.classList.add('opacity-50', 'cursor-not-allowed');
 
+    const player = document.getElementById('player');
+    const download = document.getElementById('download');
+    const current = ++generation;
+    download.classList.add('hidden');
+    download.removeAttribute('href');
+
     try {
-        const response = await fetch('/generate', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({prompt, model, format})
-        });
-        
-        if(!response.ok) {
-            const errData = await response.json();
-            throw new Error(errData.error || "Generation failed on server.");
+        let url = null;
+        if(stream && player.canPlayType(AUDIO_TYPES[format])) {
+            // No retry through /jobs when this fails: an <audio> error can't tell a
+            // busy server (503) or a bad request (4xx) from a broken stream, and
+            // repeating either would only queue another paid generation
+            try {
+                await playStream(player, streamUrl(prompt, model, format, {fresh}));
+            } catch (e) {
+                player.removeAttribute('src');
+                throw e;
+            }
+            const cachedUrl = streamUrl(prompt, model, format, {cached: true});
+            waitForCached(cachedUrl, () => current === generation && !player.error).then(ready => {
+                if(ready && current === generation) {
+                    download.href = ready;
+                    download.classList.remove('hidden');
+                }
+            }).catch(() => {});
+        } else {
+            url = await generateWithJob(prompt, model, format, fresh);
+            player.src = url;
         }
-
-        const blob = await response.blob();
-        const url = URL.createObjectURL(blob);
         
         // Update Player and Download
-        const player = document.getElementById('player');
-        const download = document.getElementById('download');
         const fileLabel = document.getElementById('fileTypeLabel');
 
-        player.src = url;
-        download.href = url;
+        if(url) {
+            download.href = url;
+            download.classList.remove('hidden');
+        }
         download.download = `sonicforge_track.${format}`;
         fileLabel.innerText = format.toUpperCase();
         
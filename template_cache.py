@@ -0,0 +1,189 @@
+import argparse
+import fcntl
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import re
+import tempfile
+
+TEMPLATE_URL = "https://github.com/FabricMC/fabric-example-mod.git"
+DEFAULT_BRANCH = "1.21"
+CACHE_DIR = os.getenv("MOD_TEMPLATE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "sonicforge", "templates"))
+
+# Files the generator rewrites in place get real copies; everything else is
+# hardlinked so a run costs one link() per file instead of a copy.
+REWRITTEN_SUFFIXES = (".java", ".json", ".properties", ".gradle")
+FULL_SHA = re.compile(r"^[0-9a-f]{40}$")
+
+
+class TemplateCacheError(Exception):
+    pass
+
+
+def _mirror_dir(cache_dir):
+    return os.path.join(cache_dir, "mirror.git")
+
+
+def _snapshot_dir(cache_dir, commit):
+    return os.path.join(cache_dir, "snapshots", commit)
+
+
+def _refs_file(cache_dir):
+    return os.path.join(cache_dir, "refs.json")
+
+
+def _read_refs(cache_dir):
+    try:
+        with open(_refs_file(cache_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_refs(cache_dir, refs):
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(refs, f, indent=2)
+    os.replace(tmp, _refs_file(cache_dir))
+
+
+def _git(*args):
+    return subprocess.run(["git", *args], check=True, capture_output=True, text=True).stdout.strip()
+
+
+def _extract(cache_dir, commit):
+    # Unpack one commit of the mirror into snapshots/<commit>, atomically
+    target = _snapshot_dir(cache_dir, commit)
+    if os.path.isdir(target):
+        return target
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    staging = tempfile.mkdtemp(dir=os.path.dirname(target), prefix=".extract-")
+    archive = subprocess.run(
+        ["git", "--git-dir", _mirror_dir(cache_dir), "archive", "--format=tar", commit],
+        check=True, capture_output=True,
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(staging, filter="data")
+        else:
+            tar.extractall(staging)
+    os.replace(staging, target)
+    return target
+
+
+class _Lock:
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, ".lock")
+
+    def __enter__(self):
+        self.file = open(self.path, "w")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+
+def refresh(branch=DEFAULT_BRANCH, url=TEMPLATE_URL, cache_dir=CACHE_DIR):
+    """Fetch the template from GitHub and snapshot the branch's current commit."""
+    with _Lock(cache_dir):
+        mirror = _mirror_dir(cache_dir)
+        if os.path.isdir(mirror):
+            print(f"Updating template mirror from {url}...")
+            _git("--git-dir", mirror, "remote", "set-url", "origin", url)
+            _git("--git-dir", mirror, "fetch", "--prune", "origin", "+refs/heads/*:refs/heads/*")
+        else:
+            print(f"Mirroring {url}...")
+            _git("clone", "--mirror", url, mirror)
+
+        commit = _git("--git-dir", mirror, "rev-parse", f"refs/heads/{branch}^{{commit}}")
+        _extract(cache_dir, commit)
+
+        refs = _read_refs(cache_dir)
+        refs[branch] = commit
+        _write_refs(cache_dir, refs)
+    print(f"Template {branch} is at {commit[:12]}.")
+    return commit
+
+
+def snapshot(ref=DEFAULT_BRANCH, offline=False, url=TEMPLATE_URL, cache_dir=CACHE_DIR):
+    """Path of the extracted template for a branch name or commit id.
+
+    Only goes to the network when nothing is cached for `ref` yet, and never
+    when `offline` is set.
+    """
+    # Snapshots are keyed by commit sha only: a branch name has to be resolved
+    commit = _read_refs(cache_dir).get(ref) or (ref if FULL_SHA.match(ref) else None)
+    if commit and os.path.isdir(_snapshot_dir(cache_dir, commit)):
+        return _snapshot_dir(cache_dir, commit)
+
+    if os.path.isdir(_mirror_dir(cache_dir)):
+        # Already mirrored, just not extracted (or not recorded in refs.json yet)
+        try:
+            resolved = _git("--git-dir", _mirror_dir(cache_dir), "rev-parse", "--verify", "--quiet", f"{commit or ref}^{{commit}}")
+        except subprocess.CalledProcessError:
+            resolved = None
+        if resolved:
+            with _Lock(cache_dir):
+                path = _extract(cache_dir, resolved)
+                if not resolved.startswith(ref):
+                    refs = _read_refs(cache_dir)
+                    refs[ref] = resolved
+                    _write_refs(cache_dir, refs)
+            return path
+
+    if offline:
+        raise TemplateCacheError(
+            f"Template '{ref}' is not cached and --offline was given. "
+            f"Run 'python template_cache.py refresh --branch {ref}' first."
+        )
+    return _snapshot_dir(cache_dir, refresh(ref, url, cache_dir))
+
+
+def materialize(snapshot_path, dest):
+    """Populate `dest` (which may already exist) from a cached snapshot."""
+    for root, dirs, files in os.walk(snapshot_path):
+        rel = os.path.relpath(root, snapshot_path)
+        target_root = os.path.join(dest, rel) if rel != "." else dest
+        os.makedirs(target_root, exist_ok=True)
+        for name in files:
+            src = os.path.join(root, name)
+            dst = os.path.join(target_root, name)
+            if name.endswith(REWRITTEN_SUFFIXES):
+                shutil.copy2(src, dst)
+                continue
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)  # different filesystem, or links not allowed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Manage the local fabric-example-mod template cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    refresh_cmd = sub.add_parser("refresh", help="Fetch the latest template for a branch")
+    refresh_cmd.add_argument("--branch", default=DEFAULT_BRANCH)
+    refresh_cmd.add_argument("--url", default=TEMPLATE_URL)
+    sub.add_parser("list", help="Show cached branches and commits")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "refresh":
+        refresh(args.branch, args.url, args.cache_dir)
+    else:
+        refs = _read_refs(args.cache_dir)
+        if not refs:
+            print(f"No templates cached in {args.cache_dir}.")
+        for branch, commit in sorted(refs.items()):
+            print(f"{branch}\t{commit}")
+
+
+if __name__ == "__main__":
+    main()
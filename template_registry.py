@@ -0,0 +1,145 @@
+"""Precompiled file templates for fabric_generator.
+
+A template set is a directory under mod_templates/:
+
+    mod_templates/<set>/template.json   metadata: minecraft version prefixes, gradle_wrapper tag
+    mod_templates/<set>/files/...       the mod's files, laid out as they will be written
+
+Both file paths and file contents may contain ``@token@`` placeholders
+(lowercase names only, so Java annotations like ``@Override`` are left
+alone). Sets are read and compiled once per process; rendering is a join
+over precomputed segments.
+"""
+import json
+import os
+import re
+import threading
+
+from mod_archive import VirtualTree
+
+TEMPLATE_ROOT = os.getenv("MOD_TEMPLATE_ROOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "mod_templates"))
+DEFAULT_SET = "1.21"
+TOKEN = re.compile(r"@([a-z_][a-z0-9_]*)@")
+BINARY_SUFFIXES = (".png", ".jar", ".ogg", ".nbt")
+
+_sets = {}
+_lock = threading.Lock()
+
+
+class TemplateError(Exception):
+    pass
+
+
+class CompiledTemplate:
+    """A string split once into literal and token segments."""
+
+    def __init__(self, source, name):
+        self.name = name
+        self.parts = TOKEN.split(source)  # literals at even indexes, token names at odd
+        self.tokens = set(self.parts[1::2])
+
+    def render(self, context):
+        try:
+            return "".join(part if i % 2 == 0 else context[part] for i, part in enumerate(self.parts))
+        except KeyError as e:
+            raise TemplateError(f"{self.name}: no value for @{e.args[0]}@") from None
+
+
+class TemplateSet:
+    def __init__(self, name, root=TEMPLATE_ROOT):
+        self.name = name
+        self.root = os.path.join(root, name)
+        try:
+            with open(os.path.join(self.root, "template.json")) as f:
+                self.meta = json.load(f)
+        except OSError:
+            raise TemplateError(f"Unknown template set '{name}' (looked in {root})") from None
+        self.gradle_wrapper = self.meta.get("gradle_wrapper")
+        self.defaults = self.meta.get("defaults", {})
+
+        # (compiled path, compiled text or raw bytes, file mode)
+        self.files = []
+        files_dir = os.path.join(self.root, "files")
+        for dirpath, dirs, names in os.walk(files_dir):
+            dirs.sort()
+            for filename in sorted(names):
+                full = os.path.join(dirpath, filename)
+                rel = os.path.relpath(full, files_dir).replace(os.sep, "/")
+                mode = os.stat(full).st_mode & 0o777
+                if filename.endswith(BINARY_SUFFIXES):
+                    with open(full, "rb") as f:
+                        body = f.read()
+                else:
+                    with open(full, "r", encoding="utf-8") as f:
+                        body = CompiledTemplate(f.read(), rel)
+                self.files.append((CompiledTemplate(rel, rel), body, mode))
+
+        self.tokens = set()
+        for path, body, _ in self.files:
+            self.tokens |= path.tokens
+            if isinstance(body, CompiledTemplate):
+                self.tokens |= body.tokens
+
+    def _render(self, context):
+        context = {**self.defaults, **context}
+        missing = self.tokens - context.keys()
+        if missing:
+            raise TemplateError(f"Template set '{self.name}' needs {', '.join(sorted(missing))}")
+        return [
+            (path.render(context), body if isinstance(body, bytes) else body.render(context).encode("utf-8"), mode)
+            for path, body, mode in self.files
+        ]
+
+    def render(self, context):
+        """{path: bytes} for every file in the set."""
+        return {path: data for path, data, _ in self._render(context)}
+
+    def render_tree(self, context):
+        """The rendered set as a mod_archive.VirtualTree, ready for write_zip/iter_zip."""
+        tree = VirtualTree()
+        for path, data in self.render(context).items():
+            tree.add(path, data)
+        return tree
+
+    def write(self, context, dest):
+        """Render into directory `dest`, creating each parent directory once."""
+        rendered = self._render(context)
+        for directory in sorted({os.path.dirname(path) for path, _, _ in rendered}):
+            os.makedirs(os.path.join(dest, directory), exist_ok=True)
+        for path, data, mode in rendered:
+            target = os.path.join(dest, path)
+            with open(target, "wb") as f:
+                f.write(data)
+            if mode & 0o111:
+                os.chmod(target, mode)
+        return [path for path, _, _ in rendered]
+
+    def match_length(self, mc_version):
+        """Length of the longest declared version prefix covering mc_version (0 = none)."""
+        return max((len(prefix) for prefix in self.meta.get("minecraft", [])
+                    if mc_version == prefix or mc_version.startswith(prefix + ".")), default=0)
+
+
+def available(root=TEMPLATE_ROOT):
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if os.path.isfile(os.path.join(root, name, "template.json")))
+
+
+def load(name=DEFAULT_SET, root=TEMPLATE_ROOT):
+    key = (root, name)
+    templates = _sets.get(key)
+    if templates is None:
+        with _lock:
+            templates = _sets.get(key)
+            if templates is None:
+                templates = _sets[key] = TemplateSet(name, root)
+    return templates
+
+
+def for_minecraft(mc_version, root=TEMPLATE_ROOT):
+    """The template set for a Minecraft version: longest matching prefix, else the default set."""
+    best = max(available(root), key=lambda name: load(name, root).match_length(mc_version), default=None)
+    if best is None or not load(best, root).match_length(mc_version):
+        best = DEFAULT_SET
+    return load(best, root)
@@ -0,0 +1,140 @@
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Per-request phase tracing: a request id, timed spans and a few attributes,
+# reported in a Server-Timing header and as one JSON log line per request.
+# Cheap enough to leave on: a span is two perf_counter() calls and a dict.
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") == "1"
+TRACE_LOG = os.getenv("TRACE_LOG", "1") == "1"
+
+_current = contextvars.ContextVar("sonicforge_trace", default=None)
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class Trace:
+    def __init__(self, name, request_id=None):
+        self.name = name
+        self.request_id = request_id if request_id and _REQUEST_ID.match(request_id) else uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        self.spans = []
+        self.attrs = {}
+        self.responded = None
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, start=None, **attrs):
+        """Record a span measured elsewhere (e.g. a streamed transcode)."""
+        span = {"name": name, "ms": round(seconds * 1000, 2)}
+        if start is not None:
+            span["at_ms"] = round((start - self.started) * 1000, 2)
+        span.update(attrs)
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time the block; the yielded dict can be filled in with attributes (bytes, status...)."""
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except Exception as e:
+            attrs.setdefault("error", type(e).__name__)
+            raise
+        finally:
+            self.add(name, time.perf_counter() - start, start, **attrs)
+
+    def set(self, **attrs):
+        with self._lock:
+            self.attrs.update(attrs)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.attrs[name] = self.attrs.get(name, 0) + value
+
+    def server_timing(self):
+        """Server-Timing header value: spans so far, same-named spans summed."""
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                total, count = totals.get(span["name"], (0.0, 0))
+                totals[span["name"]] = (total + span["ms"], count + 1)
+        parts = [f'{name};dur={total:.1f}' + (f';desc="x{count}"' if count > 1 else "")
+                 for name, (total, count) in totals.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def mark_response(self):
+        # Headers are done; whatever happens until finish() is sending the body
+        self.responded = time.perf_counter()
+
+    def finish(self, **attrs):
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+        now = time.perf_counter()
+        if self.responded is not None:
+            self.add("send", now - self.responded, self.responded)
+        self.set(**attrs)
+        if TRACE_LOG:
+            record = {
+                "trace": self.name,
+                "request_id": self.request_id,
+                "ts": round(self.wall_started, 3),
+                "ms": round((now - self.started) * 1000, 2),
+                **self.attrs,
+                "spans": self.spans,
+            }
+            print(json.dumps(record, default=str), flush=True)
+
+
+class _NullTrace:
+    # Stand-in when tracing is off or no request is being traced
+    request_id = None
+
+    def add(self, *args, **kwargs):
+        pass
+
+    @contextmanager
+    def span(self, name, **attrs):
+        yield attrs
+
+    def set(self, **attrs):
+        pass
+
+    def incr(self, name, value=1):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+def start(name, request_id=None):
+    """Begin tracing the current request (or task); returns the Trace, or None if disabled."""
+    if not TRACE_ENABLED:
+        _current.set(None)
+        return None
+    trace = Trace(name, request_id)
+    _current.set(trace)
+    return trace
+
+
+def stop():
+    """Detach the active Trace; sync workers reuse threads, so the next request must not inherit it."""
+    _current.set(None)
+
+
+def current():
+    """The active Trace, or a no-op stand-in; safe to call from any code path."""
+    return _current.get() or NULL_TRACE
+
+
+def span(name, **attrs):
+    return current().span(name, **attrs)
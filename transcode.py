@@ -0,0 +1,189 @@
+import os
+import subprocess
+import tempfile
+import threading
+
+from pydub import AudioSegment
+
+from audio_format import sniff_bytes
+
+CHUNK_SIZE = 64 * 1024
+STDERR_LIMIT = 4096
+FEEDER_GRACE = 0.1  # seconds a closed transcode waits for the feeder thread
+
+# For input that is still arriving: probe on the first 32 KB instead of waiting
+# for ffmpeg's default 5 MB, and write each encoded packet out immediately
+LOW_LATENCY_INPUT = ["-probesize", "32768"]
+LOW_LATENCY_OUTPUT = ["-flush_packets", "1"]
+
+# ffmpeg muxer arguments for each output format. Everything here must be able
+# to write to a non-seekable pipe, hence fragmented MP4 for m4a.
+MUXERS = {
+    "mp3": ["-f", "mp3"],
+    "wav": ["-f", "wav"],
+    "ogg": ["-f", "ogg"],
+    "flac": ["-f", "flac"],
+    "aac": ["-f", "adts"],
+    "m4a": ["-c:a", "aac", "-f", "mp4", "-movflags", "frag_keyframe+empty_moov"],
+}
+
+
+# Input ffmpeg may have to seek in: an MP4/M4A/MOV that isn't "faststart" keeps
+# its index (the moov atom) after the audio, which can't be demuxed from a pipe.
+# Such input is written to a temp file first, as pydub always did.
+SEEKABLE_INPUT = ("m4a",)
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def _peek(source):
+    # (same source, its first bytes) without losing anything from an iterator
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source, bytes(source[:12])
+    rest = iter(source)
+    first = next(rest, b"")
+    return prepend(first, rest), first[:12]
+
+
+def _spool(source):
+    # Write all of `source` to a temp file and return its path
+    fd, path = tempfile.mkstemp(prefix="sonicforge-", suffix=".input")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                f.write(source)
+            else:
+                for chunk in source:
+                    f.write(chunk)
+    except Exception as e:
+        os.remove(path)
+        raise TranscodeError(f"Input stream failed: {e}")
+    finally:
+        if hasattr(source, "close"):
+            source.close()
+    return path
+
+
+def _feed(stdin, source, errors):
+    # Owns `source`: it may be blocked reading it long after the reader gave up
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            view = memoryview(source)
+            for i in range(0, len(view), CHUNK_SIZE):
+                stdin.write(view[i:i + CHUNK_SIZE])
+        else:
+            for chunk in source:
+                stdin.write(chunk)
+    except (BrokenPipeError, ValueError, OSError):
+        pass  # ffmpeg exited early; its exit code tells the reader why
+    except Exception as e:
+        # The source itself failed (e.g. an upstream stream cut off): ffmpeg
+        # would happily encode the truncated input, so fail the transcode
+        errors.append(e)
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+        if hasattr(source, "close"):
+            source.close()
+
+
+def _drain(stderr, tail):
+    for line in stderr:
+        tail.append(line)
+        while sum(len(l) for l in tail) > STDERR_LIMIT:
+            tail.pop(0)
+
+
+def _reap(proc):
+    # os.wait4 instead of proc.wait() so we also learn ffmpeg's CPU time
+    try:
+        _, status, usage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        proc.wait()
+        return 0.0
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run(source, output_format, chunk_size, on_cpu, low_latency, path=None):
+    # Reads `source` on stdin, or the file at `path` when given
+    cmd = [
+        AudioSegment.converter, "-hide_banner", "-loglevel", "error",
+        *(LOW_LATENCY_INPUT if low_latency else []), "-i", path or "pipe:0", "-vn",
+        *MUXERS[output_format], *(LOW_LATENCY_OUTPUT if low_latency else []), "pipe:1",
+    ]
+    stdin = subprocess.DEVNULL if path else subprocess.PIPE
+    proc = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    tail = []
+    errors = []
+    feeder = threading.Thread(target=_feed, args=(proc.stdin, source, errors), daemon=True)
+    drainer = threading.Thread(target=_drain, args=(proc.stderr, tail), daemon=True)
+    if not path:
+        feeder.start()
+    drainer.start()
+
+    finished = False
+    try:
+        while True:
+            chunk = proc.stdout.read1(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        finished = True
+    finally:
+        if not finished:
+            proc.kill()  # client went away mid-stream
+        proc.stdout.close()
+        cpu = _reap(proc)
+        if on_cpu is not None:
+            on_cpu(cpu)
+        if not path:
+            # The feeder may be stuck in a read of the upstream source (up to the
+            # read timeout); don't hold the caller's slot for that, it closes
+            # the source itself once the read returns
+            feeder.join(FEEDER_GRACE)
+        drainer.join()
+        if path:
+            os.remove(path)
+        if finished and errors:
+            raise TranscodeError(f"Input stream failed: {errors[0]}")
+        if finished and proc.returncode != 0:
+            message = b"".join(tail).decode("utf-8", "replace").strip()
+            raise TranscodeError(message or f"ffmpeg exited with {proc.returncode}")
+
+
+def prepend(first, rest):
+    """Yield `first`, then the rest of the `rest` iterator (closed when done)."""
+    try:
+        yield first
+        yield from rest
+    finally:
+        if hasattr(rest, "close"):
+            rest.close()
+
+
+def stream_transcode(source, output_format, chunk_size=CHUNK_SIZE, on_cpu=None, low_latency=False):
+    """Pipe `source` (bytes or an iterable of chunks) through ffmpeg.
+
+    Returns an iterator of encoded chunks. Neither the decoded PCM nor the
+    full encoded file is ever held in memory. The first chunk is read before
+    returning, so undecodable input raises TranscodeError here, while the
+    caller can still send an error status instead of a half-written 200.
+    `on_cpu(seconds)` is called with ffmpeg's user+system CPU time once it exits.
+    `low_latency` is for a source that is still arriving (progressive streaming).
+    MP4-family input is spooled to a temp file first (see SEEKABLE_INPUT).
+    """
+    if output_format not in MUXERS:
+        raise TranscodeError(f"Unsupported output format: {output_format}")
+    source, head = _peek(source)
+    path = _spool(source) if sniff_bytes(head) in SEEKABLE_INPUT else None
+    chunks = _run(None if path else source, output_format, chunk_size, on_cpu, low_latency, path)
+    try:
+        first = next(chunks)
+    except StopIteration:
+        raise TranscodeError("ffmpeg produced no output")
+    return prepend(first, chunks)
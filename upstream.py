@@ -0,0 +1,238 @@
+import asyncio
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Base URLs can be pointed at a local stub server for testing and benchmarks
+STABILITY_API = os.getenv("STABILITY_API_BASE", "https://api.stability.ai").rstrip("/")
+UDIO_API = os.getenv("UDIO_API_BASE", "https://api.udio.com").rstrip("/")
+HF_API = os.getenv("HF_API_BASE", "https://router.huggingface.co").rstrip("/")
+
+CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "180"))
+TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "32"))
+ASYNC_POOL_SIZE = int(os.getenv("UPSTREAM_ASYNC_POOL_SIZE", "1000"))
+RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+BACKOFF = float(os.getenv("UPSTREAM_BACKOFF", "0.5"))
+
+# Large asset downloads (Udio's audio_url) are split into ranges fetched in parallel
+RANGE_PART_BYTES = int(os.getenv("UPSTREAM_RANGE_PART_KB", "4096")) * 1024
+RANGE_PARALLEL = int(os.getenv("UPSTREAM_RANGE_PARALLEL", "4"))
+DOWNLOAD_CHUNK = 64 * 1024
+
+_sessions = {}
+_async_clients = {}
+_lock = threading.Lock()
+_range_executor = None
+
+
+def _retry_policy():
+    # Connection failures are retried for every method because nothing reached
+    # the provider yet. Read errors and 502/503/504 are only retried for
+    # idempotent methods: re-POSTing a generation could bill the key twice.
+    return Retry(
+        total=RETRIES,
+        connect=RETRIES,
+        read=RETRIES,
+        status=RETRIES,
+        backoff_factor=BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def _new_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=_retry_policy())
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def session_for(url):
+    """One keep-alive session per upstream host, per process.
+
+    Keyed by pid too, so a session opened before gunicorn forks is never
+    shared between workers.
+    """
+    parts = urlsplit(url)
+    key = (os.getpid(), parts.scheme, parts.netloc)
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = _new_session()
+    return session
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault("timeout", TIMEOUT)
+    return session_for(url).request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+class DownloadError(Exception):
+    pass
+
+
+def _range_pool():
+    global _range_executor
+    with _lock:
+        if _range_executor is None:
+            _range_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="range")
+    return _range_executor
+
+
+def iter_body(response):
+    try:
+        for chunk in response.iter_content(DOWNLOAD_CHUNK):
+            if chunk:
+                yield chunk
+    finally:
+        response.close()
+
+
+def _fetch_range(url, start, end):
+    response = get(url, headers={"Range": f"bytes={start}-{end}"})
+    if response.status_code != 206 or len(response.content) != end - start + 1:
+        raise DownloadError(f"Range {start}-{end} of {url} failed: HTTP {response.status_code}")
+    return response.content
+
+
+def _iter_ranges(first, url, total):
+    # First part streams from the probe response; the rest are fetched RANGE_PARALLEL
+    # at a time and yielded in order, so at most that many parts sit in memory
+    starts = iter(range(RANGE_PART_BYTES, total, RANGE_PART_BYTES))
+    pending = []
+
+    def submit():
+        start = next(starts, None)
+        if start is not None:
+            end = min(start + RANGE_PART_BYTES, total) - 1
+            pending.append(_range_pool().submit(_fetch_range, url, start, end))
+
+    try:
+        for _ in range(RANGE_PARALLEL):
+            submit()
+        yield from iter_body(first)
+        while pending:
+            part = pending.pop(0).result()
+            submit()
+            yield part
+    finally:
+        first.close()
+        for future in pending:
+            future.cancel()
+
+
+def _range_total(content_range):
+    # Total size if a 206 for our first part is usable: either the whole file or
+    # exactly RANGE_PART_BYTES of a larger one; None for anything else ("*" total,
+    # a shorter part than asked for), which is re-requested without Range
+    match = re.match(r"bytes 0-(\d+)/(\d+)$", content_range or "")
+    if not match:
+        return None
+    end, total = int(match.group(1)), int(match.group(2))
+    if end == total - 1 or (end == RANGE_PART_BYTES - 1 and total > RANGE_PART_BYTES):
+        return total
+    return None
+
+
+def download(url):
+    """Streamed GET of a file over the pooled session: (chunk iterator, Content-Type).
+
+    The first request asks for RANGE_PART_BYTES only. A server that honours
+    the range and has more to send gets the remaining parts requested in
+    parallel; one that ignores it just streams the whole body back, and a
+    partial answer we can't account for (no total size) is fetched again
+    without Range.
+    """
+    headers = {"Range": f"bytes=0-{RANGE_PART_BYTES - 1}"} if RANGE_PARALLEL > 0 else {}
+    response = get(url, stream=True, headers=headers)
+    content_type = response.headers.get("Content-Type")
+    if response.status_code == 206:
+        total = _range_total(response.headers.get("Content-Range"))
+        if total and total > RANGE_PART_BYTES:
+            return _iter_ranges(response, url, total), content_type
+        if total:
+            return iter_body(response), content_type
+        response.close()
+        response = get(url, stream=True)
+        content_type = response.headers.get("Content-Type")
+    if response.status_code != 200:
+        response.close()
+        raise DownloadError(f"GET {url} failed: HTTP {response.status_code}")
+    return iter_body(response), content_type
+
+
+def async_client():
+    """Shared httpx.AsyncClient for the current process and event loop.
+
+    Used by the ASGI serving mode (asgi_app.py). httpx keeps a keep-alive
+    pool per host and, like the sync sessions, only retries failed connects.
+    """
+    import httpx  # only needed by the ASGI serving mode
+
+    key = (os.getpid(), id(asyncio.get_running_loop()))
+    client = _async_clients.get(key)
+    if client is None:
+        client = _async_clients[key] = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=ASYNC_POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+            transport=httpx.AsyncHTTPTransport(retries=RETRIES),
+        )
+    return client
+
+
+async def async_download(url):
+    """download() for the ASGI mode: (whole body, Content-Type), large files in parallel ranges."""
+    client = async_client()
+    headers = {"Range": f"bytes=0-{RANGE_PART_BYTES - 1}"} if RANGE_PARALLEL > 0 else {}
+    first = await client.get(url, headers=headers)
+    if first.status_code not in (200, 206):
+        raise DownloadError(f"GET {url} failed: HTTP {first.status_code}")
+    total = _range_total(first.headers.get("Content-Range")) if first.status_code == 206 else None
+    if first.status_code == 206 and not total:
+        first = await client.get(url)
+        if first.status_code != 200:
+            raise DownloadError(f"GET {url} failed: HTTP {first.status_code}")
+    content_type = first.headers.get("Content-Type")
+    if not total or total <= RANGE_PART_BYTES:
+        return first.content, content_type
+
+    gate = asyncio.Semaphore(RANGE_PARALLEL)
+
+    async def fetch(start):
+        end = min(start + RANGE_PART_BYTES, total) - 1
+        async with gate:
+            response = await client.get(url, headers={"Range": f"bytes={start}-{end}"})
+        if response.status_code != 206 or len(response.content) != end - start + 1:
+            raise DownloadError(f"Range {start}-{end} of {url} failed: HTTP {response.status_code}")
+        return response.content
+
+    parts = await asyncio.gather(*(fetch(start) for start in range(RANGE_PART_BYTES, total, RANGE_PART_BYTES)))
+    return b"".join([first.content, *parts]), content_type
+
+
+async def close_async_client():
+    client = _async_clients.pop((os.getpid(), id(asyncio.get_running_loop())), None)
+    if client is not None:
+        await client.aclose()